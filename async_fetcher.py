@@ -0,0 +1,121 @@
+import asyncio
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+import pandas as pd
+
+from data_fetcher import (DAY_KLINE_URLS, HOST_RATE_LIMITS, MINUTE_KLINE_URL, STOCK_LIST_URL, TODAY_KLINE_URL,
+                          build_stock_list, concat_history, normalize_adjust, parse_day_kline,
+                          parse_minute_kline, parse_stock_list_page, parse_today_kline, stock_list_pages)
+from ratelimit import TokenBucket
+
+try:
+    import h2  # noqa: F401  装了 h2 才能启用 HTTP/2
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+
+class AsyncDataFetcher:
+    """
+    DataFetcher 的异步版本，供 FastAPI 路由在事件循环内直接 await
+    所有请求共用一个 httpx.AsyncClient：连接池 + keep-alive，装了 h2 时走 HTTP/2
+    """
+
+    def __init__(self, client: Optional[httpx.AsyncClient] = None, upstreams: Optional[dict] = None,
+                 rate_limits: Optional[dict] = None, rate_limiters: Optional[dict] = None, max_connections: int = 100,
+                 max_keepalive: int = 20, timeout: float = 10):
+        """
+        :param client: 外部传入的 httpx.AsyncClient，默认按下面的连接池参数创建
+        :param upstreams: 上游域名重定向，如 {"proxy.finance.qq.com": "http://127.0.0.1:9000"}，用于对接本地假服务测试
+        :param rate_limits: 各域名每秒请求数，默认 HOST_RATE_LIMITS
+        :param rate_limiters: 已有的 {域名: TokenBucket}，如 DataFetcher.rate_limiters；给出时与同步请求共用限速，
+                              同一域名的总速率不超过配置值（忽略 rate_limits）
+        :param max_connections: 连接池最大连接数
+        :param max_keepalive: 保持空闲的长连接数
+        :param timeout: 请求超时（秒）
+        """
+        self.client = client or httpx.AsyncClient(
+            http2=HTTP2,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=30),
+            headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"},
+        )
+        self.upstreams = upstreams or {}
+        self.rate_limiters = rate_limiters if rate_limiters is not None else \
+            {host: TokenBucket(rate) for host, rate in (rate_limits or HOST_RATE_LIMITS).items()}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    def _route(self, url: str) -> str:
+        parts = urlsplit(url)
+        target = self.upstreams.get(parts.hostname)
+        if not target:
+            return url
+        base = urlsplit(target)
+        return urlunsplit((base.scheme, base.netloc, parts.path, parts.query, parts.fragment))
+
+    async def _request(self, url: str) -> dict:
+        """统一请求方法"""
+        limiter = self.rate_limiters.get(urlsplit(url).hostname)
+        if limiter:
+            await limiter.wait()
+        try:
+            response = await self.client.get(self._route(url))
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            raise RuntimeError(f"请求失败 {url}: {str(e)}")
+
+    async def _get_minute_kline(self, stock_code: str, type: str = "m1", end: str = "",
+                                length: int = 800) -> pd.DataFrame:
+        url = MINUTE_KLINE_URL.format(stock_code=stock_code, type=type, end=end, length=length)
+        return parse_minute_kline(await self._request(url), stock_code, type)
+
+    async def _get_day_kline(self, stock_code: str, type: str = "day", start: str = "", end: str = "",
+                             length: int = 800, adjust: str = "qfq") -> pd.DataFrame:
+        url_1, url_2 = [u.format(stock_code=stock_code, type=type, start=start, end=end, length=length,
+                                 adjust=adjust) for u in DAY_KLINE_URLS]
+        try:
+            data = await self._request(url_1)
+        except RuntimeError:
+            data = await self._request(url_2)
+        return parse_day_kline(data, stock_code, type, adjust)
+
+    async def _get_today_kline(self, stock_code: str) -> pd.DataFrame:
+        url = TODAY_KLINE_URL.format(stock_code=stock_code)
+        return parse_today_kline(await self._request(url), stock_code)
+
+    async def get_history(self, stock_code: str, type: str = "day", start: str = "", adjust: str = "qfq"):
+        """下载单个股票全部历史日线，逻辑同 DataFetcher.get_history"""
+        adjust = normalize_adjust(adjust)
+        all_df = []
+        end = ""
+        while True:
+            chunk = (await self._get_day_kline(stock_code, type, start=start, end=end, length=800,
+                                               adjust=adjust)).iloc[:, :6]
+            if not len(chunk):
+                break
+            all_df.append(chunk)
+            end = chunk.iat[0, 0]
+            if start and end <= start:
+                break
+            if len(chunk) < 800:
+                break
+        return concat_history(all_df)
+
+    async def _get_stock_list_page(self, page: int) -> tuple:
+        return parse_stock_list_page(await self._request(STOCK_LIST_URL.format(page=page)))
+
+    async def get_all_stock_list(self):
+        """获取所有股票列表，第一页拿到总条数后其余页并发拉取，失败时返回 None"""
+        try:
+            total, first = await self._get_stock_list_page(1)
+            rest = await asyncio.gather(*[self._get_stock_list_page(p) for p in stock_list_pages(total)])
+        except Exception as e:
+            print(f"获取股票列表失败: {e}")
+            return None
+        return build_stock_list([first] + [cols for _, cols in rest])
@@ -0,0 +1,133 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class Backfiller:
+    """
+    全量历史并发回补
+    多只股票并行下载（线程池限制并发），每个上游域名的速率由 DataFetcher 的令牌桶控制；
+    失败按指数退避重试；每完成一只追加一行进度日志，进程崩溃后用同一个 run_id 重跑会跳过已完成的股票
+    进度日志按 (阶段, run_id) 区分：{state_dir}/{stage}.{run_id}.log，不同阶段互不影响，与日期无关
+    """
+
+    def __init__(self, fetcher, workers: int = 8, retries: int = 3, backoff: float = 1.0, run_id: str = 'manual',
+                 stage: str = 'backfill', state_dir: str = 'data/backfill', report_interval: float = 5.0):
+        """
+        :param fetcher: DataFetcher 实例
+        :param workers: 并发下载的股票数
+        :param retries: 单只股票的最大重试次数
+        :param backoff: 首次重试等待秒数，之后每次翻倍
+        :param run_id: 本次运行的标识，如每日更新同步到的交易日；重跑时传入相同的值即可续跑
+        :param stage: 阶段名，如 backfill、redownload
+        :param state_dir: 进度日志目录，日志在全部完成后删除
+        :param report_interval: 吞吐量打印间隔（秒）
+        """
+        self.fetcher = fetcher
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.stage = stage
+        self.state_dir = state_dir
+        self.state_file = os.path.join(state_dir, f'{stage}.{run_id}.log')
+        self.report_interval = report_interval
+        self.stats = {'done': 0, 'bars': 0, 'failed': 0}  # 最近一次 run 的统计
+
+    def _load_state(self) -> dict:
+        """读取上次未跑完的进度：code -> (最早日期, 最新日期, 行数)"""
+        done = {}
+        # 同一阶段其他 run_id 的残留进度已过时（如前一个交易日未跑完的），作废
+        for name in os.listdir(self.state_dir):
+            path = os.path.join(self.state_dir, name)
+            if name.startswith(f'{self.stage}.') and name.endswith('.log') and path != self.state_file:
+                os.remove(path)
+        if os.path.exists(self.state_file):
+            with open(self.state_file, encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) == 4:
+                        done[parts[0]] = (parts[1], parts[2], int(parts[3]))
+        return done
+
+    def _fetch_one(self, code: str):
+        for attempt in range(self.retries + 1):
+            try:
+                _df = self.fetcher.download_history(code)
+                if _df.empty:
+                    return None
+                return _df['date'].iat[0], _df['date'].iat[-1], len(_df)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                wait = self.backoff * 2 ** attempt
+                print(f'{code} 下载失败，{wait:.1f}s 后重试: {e}')
+                time.sleep(wait)
+
+    def run(self, codes: list) -> dict:
+        """
+        回补一批股票的全部不复权日线历史和复权因子
+        :param codes: 股票代码列表
+        :return: {code: (最早日期, 最新日期, 行数)}，无数据或最终失败的股票不在其中
+        """
+        os.makedirs(self.state_dir, exist_ok=True)
+        wanted = set(codes)
+        results = {c: v for c, v in self._load_state().items() if c in wanted}
+        todo = [c for c in codes if c not in results]
+        if results:
+            print(f'从进度日志恢复 {len(results)} 只，剩余 {len(todo)} 只')
+
+        stats = self.stats = {'done': 0, 'bars': 0, 'failed': 0}
+        start = time.time()
+        stop = threading.Event()
+
+        def report():
+            elapsed = max(time.time() - start, 1e-6)
+            print(f"回补进度 {stats['done']}/{len(todo)}，失败 {stats['failed']}，"
+                  f"{stats['done'] / elapsed:.2f} 只/s，{stats['bars'] / elapsed:.0f} 根/s")
+
+        def reporter():
+            while not stop.wait(self.report_interval):
+                report()
+
+        threading.Thread(target=reporter, daemon=True).start()
+        try:
+            with open(self.state_file, 'a', encoding='utf-8') as log, \
+                    ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(self._fetch_one, c): c for c in todo}
+                for future in as_completed(futures):
+                    code = futures[future]
+                    try:
+                        res = future.result()
+                    except Exception as e:
+                        print(f'{code} 回补失败: {e}')
+                        stats['failed'] += 1
+                        continue
+                    stats['done'] += 1
+                    if res is None:
+                        continue
+                    results[code] = res
+                    stats['bars'] += res[2]
+                    log.write(f'{code}\t{res[0]}\t{res[1]}\t{res[2]}\n')
+                    log.flush()
+        finally:
+            stop.set()
+        report()
+        if not stats['failed']:
+            os.remove(self.state_file)
+        return results
+
+
+if __name__ == "__main__":
+    from data_fetcher import DataFetcher
+
+    parser = argparse.ArgumentParser(description='并发回补股票全部日线历史')
+    parser.add_argument('codes', nargs='*', help='股票代码，默认全部状态为 Halting/Unknown 的股票')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--run-id', default='manual', help='运行标识，中断后用相同的值重跑即从进度日志续跑')
+    args = parser.parse_args()
+
+    fetcher = DataFetcher()
+    codes = args.codes or fetcher.metadata.codes(status=['Halting', 'Unknown'])
+    Backfiller(fetcher, workers=args.workers, run_id=args.run_id).run(codes)
@@ -1,7 +1,17 @@
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
-from data_fetcher import DataFetcher
+from indicators import prefix_sums, sma
+
+# 年化时每年的交易日数
+TRADING_DAYS_PER_YEAR = 252
+# 单边交易成本（佣金 + 滑点），按换手比例扣除
+DEFAULT_FEE = 0.0005
+STAT_FIELDS = ['total_return', 'annual_return', 'sharpe', 'max_drawdown', 'trades', 'exposure']
 
 
 def backtest(df: pd.DataFrame) -> pd.DataFrame:
@@ -13,10 +23,13 @@ def backtest(df: pd.DataFrame) -> pd.DataFrame:
     :return: 包含交易信号、持仓、资金变化等列的DataFrame
     """
     period=600
-    df=df.iloc[-period:]
+    # 复制一份再加列，避免在切片上赋值（SettingWithCopyWarning），也不改动调用方的数据
+    df=df.iloc[-period:].copy()
     # 1. 计算5日和10日移动平均线
-    df['MA5'] = df['close'].rolling(window=5).mean()  # 5日均线
-    df['MA10'] = df['close'].rolling(window=10).mean()  # 10日均线
+    close = df['close'].to_numpy(dtype=float)
+    prefix = prefix_sums(close)  # 两条均线共用一次累加
+    df['MA5'] = sma(close, 5, prefix)  # 5日均线
+    df['MA10'] = sma(close, 10, prefix)  # 10日均线
 
     # 2. 获取前一日的MA值（用于判断交叉方向）
     df['MA5_prev'] = df['MA5'].shift(1)  # 前一日MA5
@@ -35,39 +48,207 @@ def backtest(df: pd.DataFrame) -> pd.DataFrame:
 
     return df
 
+
+# ---------- 向量化的全市场 × 参数网格回测 ----------
+
+def ma_pairs(fasts, slows) -> list:
+    """快慢均线参数网格，只保留 快线周期 < 慢线周期 的组合"""
+    return [(f, s) for f in fasts for s in slows if f < s]
+
+
+def ffill(values: np.ndarray) -> np.ndarray:
+    """沿时间轴（第 0 维）向前填充 NaN（停牌日沿用上一个收盘价），上市前的 NaN 保留"""
+    valid = ~np.isnan(values)
+    index = np.where(valid, np.arange(len(values))[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return values[index, np.arange(values.shape[1])]
+
+
+def ma_cross_positions(close: np.ndarray, fast: int, slow: int, prefix: tuple = None) -> np.ndarray:
+    """
+    均线交叉的目标持仓：快线在慢线之上时持有 1，否则空仓 0
+    与 backtest 的金叉买入、死叉卖出一致，信号在当日收盘产生
+    :return: 与 close 同形状的 0/1 数组
+    """
+    prefix = prefix or prefix_sums(close)
+    return (sma(close, fast, prefix) > sma(close, slow, prefix)).astype(np.float64)
+
+
+def _grid_chunk(close: np.ndarray, pairs: list, fee: float, full: bool) -> dict:
+    """
+    对一组股票（close 的若干列）跑完整个参数网格
+    :return: 逐股票的统计 (参数数, 股票数)、组合的逐日收益之和 (参数数, 交易日数)、逐日有效股票数
+    """
+    close = ffill(np.asarray(close, dtype=np.float64))
+    returns = np.zeros(close.shape)
+    returns[1:] = close[1:] / close[:-1] - 1
+    valid = ~np.isnan(returns)
+    valid[0] = False
+    returns[~valid] = 0
+    days = valid.sum(axis=0)
+    prefix = prefix_sums(close)
+
+    n_pairs, (n_days, n_codes) = len(pairs), close.shape
+    stats = {f: np.full((n_pairs, n_codes), np.nan) for f in STAT_FIELDS}
+    out = {'stats': stats, 'last': np.zeros((n_pairs, n_codes)),
+           'daily': np.zeros((n_pairs, n_days)), 'count': valid.sum(axis=1)}
+    if full:
+        out['position_matrix'] = np.zeros((n_pairs, n_days, n_codes), dtype=np.float32)
+        out['equity_matrix'] = np.ones((n_pairs, n_days, n_codes), dtype=np.float32)
+
+    for i, (fast, slow) in enumerate(pairs):
+        position = ma_cross_positions(close, fast, slow, prefix)
+        held = np.zeros(close.shape)
+        held[1:] = position[:-1]  # 当日收盘的信号，次日才产生收益
+        turnover = np.abs(np.diff(position, axis=0, prepend=0))
+        pnl = held * returns - fee * turnover
+        equity = np.cumprod(1 + pnl, axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(days, pnl.sum(axis=0) / np.maximum(days, 1), np.nan)
+            std = np.sqrt(np.where(valid, (pnl - mean) ** 2, 0).sum(axis=0) / np.maximum(days - 1, 1))
+            stats['total_return'][i] = equity[-1] - 1
+            stats['annual_return'][i] = np.where(days, equity[-1] ** (TRADING_DAYS_PER_YEAR / np.maximum(days, 1)) - 1,
+                                                 np.nan)
+            stats['sharpe'][i] = np.where(std > 0, mean / std * np.sqrt(TRADING_DAYS_PER_YEAR), np.nan)
+            stats['exposure'][i] = np.where(days, (held * valid).sum(axis=0) / np.maximum(days, 1), np.nan)
+        stats['max_drawdown'][i] = (equity / np.maximum.accumulate(equity, axis=0) - 1).min(axis=0)
+        stats['trades'][i] = (np.diff(position, axis=0, prepend=0) > 0).sum(axis=0)
+        out['last'][i] = position[-1]
+        out['daily'][i] = np.where(valid, pnl, 0).sum(axis=1)
+        if full:
+            out['position_matrix'][i] = position
+            out['equity_matrix'][i] = equity
+    return out
+
+
+def run_grid(close: np.ndarray, pairs: list, dates=None, symbols: list = None, fee: float = DEFAULT_FEE,
+             processes: int = 1, full: bool = False) -> dict:
+    """
+    均线交叉策略的全市场 × 参数网格回测，每组参数对全部股票做一次整体的数组运算
+    :param close: (交易日数, 股票数) 的收盘价矩阵（复权价，NaN 表示未上市或停牌），如 PanelStore.slice 的结果
+    :param pairs: [(快线周期, 慢线周期), ...]
+    :param dates: 行对应的日期，用作净值曲线的索引
+    :param symbols: 列对应的股票代码
+    :param fee: 单边交易成本
+    :param processes: 进程数，大于 1 时按股票分块交给进程池，None 表示使用全部 CPU
+    :param full: 是否额外返回逐股票的持仓和净值 (参数数, 交易日数, 股票数)，内存占用为 参数数 × close 的一半
+    :return: dict
+             stats: 每个 (fast, slow, symbol) 一行，total_return、annual_return、sharpe、max_drawdown、trades、exposure
+             equity: 每组参数一列，逐日等权组合（每只股票各占一份资金，空仓部分持有现金）的净值曲线
+             positions: 最新一个交易日收盘后的目标持仓，行为参数，列为股票
+             position_matrix / equity_matrix: full 为 True 时返回
+    """
+    close = np.asarray(close, dtype=np.float64)
+    n_days, n_codes = close.shape
+    pairs = [(int(f), int(s)) for f, s in pairs]
+    symbols = list(symbols) if symbols is not None else list(range(n_codes))
+    dates = dates if dates is not None else np.arange(n_days)
+    processes = processes or multiprocessing.cpu_count()
+
+    if processes > 1 and n_codes > 1:
+        bounds = np.linspace(0, n_codes, min(processes, n_codes) + 1).astype(int)
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=processes, mp_context=ctx) as pool:
+            futures = [pool.submit(_grid_chunk, close[:, lo:hi], pairs, fee, full)
+                       for lo, hi in zip(bounds[:-1], bounds[1:])]
+            parts = [f.result() for f in futures]
+    else:
+        parts = [_grid_chunk(close, pairs, fee, full)]
+
+    stats = {f: np.concatenate([p['stats'][f] for p in parts], axis=1) for f in STAT_FIELDS}
+    daily = sum(p['daily'] for p in parts)
+    count = sum(p['count'] for p in parts)
+    portfolio = np.divide(daily, count, out=np.zeros_like(daily), where=count > 0)
+
+    index = pd.MultiIndex.from_tuples(pairs, names=['fast', 'slow'])
+    result = {
+        'stats': pd.DataFrame({
+            'fast': np.repeat([f for f, _ in pairs], n_codes),
+            'slow': np.repeat([s for _, s in pairs], n_codes),
+            'symbol': np.tile(np.asarray(symbols, dtype=object), len(pairs)),
+            **{f: stats[f].ravel() for f in STAT_FIELDS},
+        }),
+        'equity': pd.DataFrame(np.cumprod(1 + portfolio, axis=1).T, index=dates, columns=index),
+        'positions': pd.DataFrame(np.concatenate([p['last'] for p in parts], axis=1), index=index,
+                                  columns=symbols),
+    }
+    if full:
+        for key in ['position_matrix', 'equity_matrix']:
+            result[key] = np.concatenate([p[key] for p in parts], axis=2)
+    return result
+
+
+def scan_market(pairs: list, start: str = '', end: str = '', length: int = None, symbols: list = None,
+                fee: float = DEFAULT_FEE, processes: int = 1, full: bool = False, root: str = 'data') -> dict:
+    """
+    用全市场截面矩阵（panel.py）的后复权收盘价跑参数网格，参数与返回值同 run_grid
+    后复权价格的涨跌幅与前复权一致，且不受之后新除权的影响
+    """
+    from panel import PanelStore
+    from store import decode_dates
+
+    dates, codes, close = PanelStore(root).slice('close', start, end, length, symbols, 'hfq')
+    return run_grid(close, pairs, decode_dates(dates, 'day').to_numpy(), codes, fee, processes, full)
+
+
 if __name__ == '__main__':
-    # 读取数据
-    df = pd.read_csv('data/day/sz000581.csv')
-
-    # 回测
-    df = backtest(df)
-    # df = df.reset_index(drop=True)
-    plt.plot(df['close'])
-    plt.plot(df['open'])
-    for x in [5,10,20,40]:
-        plt.plot(df['close'].rolling(x).mean())
-
-    buy_signals = df[df['signal'] == 1]  # 买入信号数据
-    sell_signals = df[df['signal'] == -1]  # 卖出信号数据
-
-    # 3. 叠加买入信号（红色圆点）
-    plt.scatter(
-        buy_signals.index,  # x轴：信号发生的日期（df索引，需为datetime类型）
-        buy_signals['close'],  # y轴：信号发生时的收盘价
-        color='red',  # 红色标记买入
-        marker='o',  # 圆形标记
-        s=100,  # 点大小
-        label='买入信号'
-    )
-
-    # 4. 叠加卖出信号（绿色圆点）
-    plt.scatter(
-        sell_signals.index,  # x轴：信号发生的日期
-        sell_signals['close'],  # y轴：信号发生时的收盘价
-        color='green',  # 绿色标记卖出
-        marker='o',  # 圆形标记
-        s=100,  # 点大小
-        label='卖出信号'
-    )
-
-    plt.show()
+    parser = argparse.ArgumentParser(description='均线交叉策略回测')
+    parser.add_argument('--plot', metavar='CODE', help='单只股票：画出收盘价、均线和买卖信号')
+    parser.add_argument('--fast', type=int, nargs='+', default=[5, 10, 20])
+    parser.add_argument('--slow', type=int, nargs='+', default=[20, 30, 60, 120])
+    parser.add_argument('--start', default='', help='开始日期 yyyy-MM-dd')
+    parser.add_argument('--length', type=int, default=None, help='最近多少个交易日')
+    parser.add_argument('--fee', type=float, default=DEFAULT_FEE)
+    parser.add_argument('--processes', type=int, default=1, help='进程数，0 表示使用全部 CPU')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+
+        from data_reader import read_stock_history
+
+        # 读取数据
+        df = read_stock_history(args.plot, 'day')
+
+        # 回测
+        df = backtest(df)
+        # df = df.reset_index(drop=True)
+        plt.plot(df['close'])
+        plt.plot(df['open'])
+        prefix = prefix_sums(df['close'].to_numpy(dtype=float))
+        for x in [5,10,20,40]:
+            plt.plot(df.index, sma(df['close'].to_numpy(dtype=float), x, prefix))
+
+        buy_signals = df[df['signal'] == 1]  # 买入信号数据
+        sell_signals = df[df['signal'] == -1]  # 卖出信号数据
+
+        # 3. 叠加买入信号（红色圆点）
+        plt.scatter(
+            buy_signals.index,  # x轴：信号发生的日期（df索引，需为datetime类型）
+            buy_signals['close'],  # y轴：信号发生时的收盘价
+            color='red',  # 红色标记买入
+            marker='o',  # 圆形标记
+            s=100,  # 点大小
+            label='买入信号'
+        )
+
+        # 4. 叠加卖出信号（绿色圆点）
+        plt.scatter(
+            sell_signals.index,  # x轴：信号发生的日期
+            sell_signals['close'],  # y轴：信号发生时的收盘价
+            color='green',  # 绿色标记卖出
+            marker='o',  # 圆形标记
+            s=100,  # 点大小
+            label='卖出信号'
+        )
+
+        plt.show()
+    else:
+        pairs = ma_pairs(args.fast, args.slow)
+        result = scan_market(pairs, start=args.start, length=args.length, fee=args.fee,
+                             processes=args.processes or None)
+        summary = result['stats'].groupby(['fast', 'slow'])[STAT_FIELDS].median()
+        summary['portfolio_return'] = result['equity'].iloc[-1].to_numpy() - 1
+        print(summary.sort_values('portfolio_return', ascending=False).head(args.top))
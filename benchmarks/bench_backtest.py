@@ -0,0 +1,37 @@
+"""
+全市场 × 参数网格回测的耗时（合成的随机游走收盘价）
+运行：python benchmarks/bench_backtest.py --codes 5000 --days 2500 --processes 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtest import ma_pairs, run_grid  # noqa: E402
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--codes', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=2500)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    close = 10 * np.cumprod(1 + rng.normal(0, 0.02, (args.days, args.codes)), axis=0)
+    # 模拟陆续上市：前 1/5 的股票在区间中途才有数据
+    listed = rng.integers(0, args.days // 2, args.codes // 5)
+    for col, row in enumerate(listed):
+        close[:row, col] = np.nan
+
+    # 5 × 10 = 50 组快慢均线
+    pairs = ma_pairs([3, 5, 8, 10, 13], [20, 30, 40, 60, 80, 100, 120, 150, 200, 250])
+    start = time.perf_counter()
+    result = run_grid(close, pairs, processes=args.processes)
+    cost = time.perf_counter() - start
+    print(f'{args.codes} 只股票 × {args.days} 个交易日 × {len(pairs)} 组参数，'
+          f'{args.processes} 个进程：{cost:.1f}s（每组参数 {cost / len(pairs) * 1000:.0f}ms）')
+    print(result['stats'].groupby(['fast', 'slow'])['sharpe'].median().describe())
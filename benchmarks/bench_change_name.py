@@ -0,0 +1,84 @@
+"""
+change_name 向量化前后的耗时对比（合成的 6000 行东方财富股票列表）
+运行：python benchmarks/bench_change_name.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data_fetcher import STOCK_FIELDS, STOCK_LIST_FIELDS, change_name  # noqa: E402
+
+
+def change_name_legacy(df):
+    """向量化之前的逐行实现，仅用于对比"""
+
+    def safe_div(x, factor=100, r=None):
+        if x == '-':
+            return x
+        if r:
+            return round(float(x) / factor, r)
+        return float(x) / factor
+
+    _cols = ['最新价', '开盘价', '涨跌额', '昨收', '最高价', '最低价', '涨跌幅', '换手率']
+    for col in _cols:
+        if col in df.columns:
+            df[col] = df[col].apply(lambda x: safe_div(x, 100))
+
+    if '总市值' in df.columns:
+        df['总市值'] = df['总市值'].apply(lambda x: safe_div(x, 100000000, 2))
+    if '总手' in df.columns:
+        df['总手'] = df['总手'].apply(lambda x: safe_div(x, 10000, 2))
+
+    def add_prefix(code):
+        if code.startswith(('00', '30')):
+            return 'sz' + code
+        if code.startswith(('60', '68')):
+            return 'sh' + code
+        if code.startswith(('8', '92', '43')):
+            return 'bj' + code
+        return code
+
+    if '股票代码' in df.columns:
+        df['股票代码'] = df['股票代码'].astype(str).apply(add_prefix)
+
+    return df
+
+
+def make_stock_list(n: int = 6000, seed: int = 0) -> pd.DataFrame:
+    """按接口原始格式（fltt=1 的整数、停牌为 '-'）生成股票列表"""
+    rng = np.random.default_rng(seed)
+    cols = {}
+    for fid in STOCK_LIST_FIELDS:
+        values = rng.integers(1, 10 ** 9, n).astype(object)
+        values[rng.random(n) < 0.05] = '-'
+        cols[STOCK_FIELDS[fid]] = values
+    prefixes = np.array(['00', '30', '60', '68', '83', '92', '43'])
+    cols['股票代码'] = [p + f'{i:04d}' for p, i in zip(rng.choice(prefixes, n), range(n))]
+    cols['股票名称'] = [f'股票{i}' for i in range(n)]
+    cols['市场'] = rng.integers(0, 2, n)
+    return pd.DataFrame(cols)
+
+
+def bench(fn, df: pd.DataFrame, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        data = df.copy()
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    df = make_stock_list()
+    legacy = bench(change_name_legacy, df)
+    vectorized = bench(change_name, df)
+    print(f'rows={len(df)}')
+    print(f'legacy     {legacy * 1000:8.2f} ms')
+    print(f'vectorized {vectorized * 1000:8.2f} ms')
+    print(f'speedup    {legacy / vectorized:8.1f}x')
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，按字节预算淘汰
+    每个 key 带一个失效代数：读取方在加载前取代数，写回时代数已变说明期间发生过失效，丢弃这次结果
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (value, nbytes)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def peek(self, key, default=None):
+        """读取但不调整淘汰顺序、不计入命中统计，用于不希望影响热点条目的批量扫描"""
+        with self._lock:
+            item = self._data.get(key)
+            return default if item is None else item[0]
+
+    def generation(self, key) -> int:
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def put(self, key, value, nbytes: int, generation: int = None):
+        """
+        写入缓存，超出预算时从最久未使用的条目开始淘汰
+        :param generation: 加载前通过 generation() 取得的代数，不一致时放弃写入
+        """
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, 0):
+                return
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, nbytes)
+            self.bytes += nbytes
+            while self.bytes > self.max_bytes:
+                _, (_, n) = self._data.popitem(last=False)
+                self.bytes -= n
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+
+    def clear(self):
+        with self._lock:
+            for key in self._data:
+                self._generations[key] = self._generations.get(key, 0) + 1
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
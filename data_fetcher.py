@@ -1,12 +1,20 @@
 import datetime
+import math
 import os
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
+from urllib.parse import urlparse
 
 import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
+from metadata_store import MetadataStore
+from ratelimit import TokenBucket
+from rollup import RollupStore
+from store import BarStore, FactorStore, adjust_type, apply_factors, from_records, get_store
+from trading_calendar import TradingCalendar
 from ts import *
 
 STOCK_FIELDS = {
@@ -118,6 +126,34 @@ STOCK_FIELDS = {
     'f138': '净利润TTM'
 }
 
+# 各上游域名的限速（每秒请求数）
+HOST_RATE_LIMITS = {
+    'proxy.finance.qq.com': 10,
+    'web.ifzq.gtimg.cn': 10,
+    'ifzq.gtimg.cn': 10,
+    'qt.gtimg.cn': 10,
+    'push2.eastmoney.com': 5,
+}
+
+WARMUP_STAGES = ['stock_list', 'trading_days', 'stock_metadata']
+
+MINUTE_KLINE_URL = "https://ifzq.gtimg.cn/appstock/app/kline/mkline?param={stock_code},{type},{end},{length}"
+DAY_KLINE_URLS = (
+    "https://proxy.finance.qq.com/ifzqgtimg/appstock/app/newfqkline/get?param={stock_code},{type},{start},{end},{length},{adjust}",
+    "https://web.ifzq.gtimg.cn/appstock/app/fqkline/get?param={stock_code},{type},{start},{end},{length},{adjust}",
+)
+TODAY_KLINE_URL = "https://web.ifzq.gtimg.cn/appstock/app/minute/query?code={stock_code}"
+# 批量行情快照，一次请求多只股票，返回 GBK 文本，每只一行：v_sz000001="51~平安银行~000001~最新价~昨收~今开~成交量~...";
+QUOTE_URL = "https://qt.gtimg.cn/q={codes}"
+QUOTE_BATCH_SIZE = 60
+# 行情快照中的字段位置：最新价、累计成交量（手）、时间 yyyyMMddHHmmss
+QUOTE_PRICE, QUOTE_VOLUME, QUOTE_TIME = 3, 6, 30
+STOCK_LIST_FIELDS = ['f2', 'f3', 'f4', 'f5', 'f6', 'f7', 'f8', 'f9', 'f10', 'f12', 'f13', 'f14', 'f15', 'f16', 'f17',
+                     'f18', 'f20', 'f23', 'f26']
+STOCK_LIST_PAGE_SIZE = 100
+STOCK_LIST_URL = ("https://push2.eastmoney.com/api/qt/clist/get?np=1&fltt=1&invt=2&fs=m:0+t:6,m:0+t:80,m:1+t:2,m:1+t:23,m:0+t:81+s:2048"
+                  f"&fields={','.join(STOCK_LIST_FIELDS)}&fid=f12&pn={{page}}&pz={STOCK_LIST_PAGE_SIZE}&po=0&dect=1")
+
 
 def normalize_adjust(adjust):
     if adjust is None:
@@ -134,67 +170,276 @@ def normalize_adjust(adjust):
         return "qfq"  # 默认前复权
 
 
-def change_name(df):
-    """把东方财富原始单位换算成常用单位，并补充市场前缀"""
+PRICE_COLUMNS = ['最新价', '开盘价', '涨跌额', '昨收', '最高价', '最低价', '涨跌幅', '换手率']
+FLOAT_COLUMNS = PRICE_COLUMNS + ['总手', '成交额', '振幅', '市盈率', '量比', '总市值', '市净率']
+# 代码前缀 → 市场
+CODE_PREFIXES = [
+    (('00', '30'), 'sz'),
+    (('60', '68'), 'sh'),
+    (('8', '92', '43'), 'bj'),
+]
+
+
+def to_float(values) -> np.ndarray:
+    """转为 float64 数组，'-' 及其他无法解析的值记为 NaN"""
+    arr = np.asarray(values, dtype=object)
+    mask = arr == '-'
+    if mask.any():
+        arr = arr.copy()
+        arr[mask] = np.nan
+    try:
+        return arr.astype('float64')
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(arr), errors='coerce').to_numpy(dtype='float64')
+
+
+def apply_stock_list_schema(df):
+    """
+    股票列表的列类型：数值列 float64（'-' 为 NaN），上市日期 Int64，市场 category
+    从 CSV 缓存读回时也调用一次，保证与接口返回的类型一致
+    """
+    for col in FLOAT_COLUMNS:
+        if col in df.columns and df[col].dtype != 'float64':
+            df[col] = to_float(df[col])
+    if '上市日期' in df.columns:
+        df['上市日期'] = pd.Series(to_float(df['上市日期']), index=df.index).astype('Int64')
+    if '市场' in df.columns:
+        df['市场'] = df['市场'].astype('category')
+    if '股票代码' in df.columns:
+        df['股票代码'] = df['股票代码'].astype(str)
+    return df
+
 
-    def safe_div(x, factor=100, r=None):
-        if x == '-':
-            return x
-        if r:
-            return round(float(x) / factor, r)
-        return float(x) / factor
+def add_prefix(codes) -> np.ndarray:
+    """按代码开头批量补充 sz/sh/bj 前缀，无法识别的保持原样"""
+    codes = np.asarray(codes, dtype=str)
+    conditions = [np.logical_or.reduce([np.char.startswith(codes, s) for s in starts]) for starts, _ in CODE_PREFIXES]
+    prefix = np.select(conditions, [p for _, p in CODE_PREFIXES], default='')
+    return np.char.add(prefix, codes)
 
-    _cols = ['最新价', '开盘价', '涨跌额', '昨收', '最高价', '最低价', '涨跌幅', '换手率']
-    for col in _cols:
+
+def change_name(df):
+    """把东方财富原始单位换算成常用单位，并补充市场前缀（整列向量化计算）"""
+    for col in FLOAT_COLUMNS:
+        if col in df.columns:
+            df[col] = to_float(df[col])
+
+    for col in PRICE_COLUMNS:
         if col in df.columns:
-            df[col] = df[col].apply(lambda x: safe_div(x, 100))
+            df[col] = df[col] / 100
 
     if '总市值' in df.columns:
-        df['总市值'] = df['总市值'].apply(lambda x: safe_div(x, 100000000, 2))
+        df['总市值'] = (df['总市值'] / 100000000).round(2)
     if '总手' in df.columns:
-        df['总手'] = df['总手'].apply(lambda x: safe_div(x, 10000, 2))
+        df['总手'] = (df['总手'] / 10000).round(2)
 
     # 加市场前缀
-    def add_prefix(code):
-        if code.startswith(('00', '30')):
-            return 'sz' + code
-        if code.startswith(('60', '68')):
-            return 'sh' + code
-        if code.startswith(('8', '92', '43')):
-            return 'bj' + code
-        return code
-
     if '股票代码' in df.columns:
-        df['股票代码'] = df['股票代码'].astype(str).apply(add_prefix)
+        df['股票代码'] = add_prefix(df['股票代码']).astype(object)
+
+    return apply_stock_list_schema(df)
 
+
+# 以下解析函数由同步的 DataFetcher 与异步的 AsyncDataFetcher 共用
+
+def parse_minute_kline(data: dict, stock_code: str, type: str) -> pd.DataFrame:
+    data = data['data'][stock_code][type]
+    df = pd.DataFrame(data, columns=['date', 'open', 'close', 'high', 'low', 'volume', '1', 'exchange'])
+    num_cols = ['open', 'close', 'high', 'low', 'volume']
+    for c in num_cols:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+    return df
+
+
+def parse_day_kline(data: dict, stock_code: str, type: str, adjust: str) -> pd.DataFrame:
+    if not data['data']:
+        return pd.DataFrame()
+    key = adjust + type if adjust + type in data['data'][stock_code] else type
+    data = data['data'][stock_code][key]
+    if not data:
+        return pd.DataFrame()
+    col_map = {6: ["date", "open", "close", "high", "low", "volume"],
+               7: ["date", "open", "close", "high", "low", "volume", "info"],
+               10: ["date", "open", "close", "high", "low", "volume", "info", "ex", "amount", "cnt"],
+               11: ["date", "open", "close", "high", "low", "volume", "info", "ex", "amount", "cnt", ""]}
+    df = pd.DataFrame(data, columns=col_map.get(len(data[0])))
+    num_cols = ['open', 'close', 'high', 'low', 'volume']
+    for c in num_cols:
+        if c in df.columns:
+            df[c] = pd.to_numeric(df[c], errors='coerce')
+    df["volume"] = df["volume"].astype(int)
     return df
 
 
+def parse_today_kline(data: dict, stock_code: str) -> pd.DataFrame:
+    if 'data' in data and stock_code in data['data'] and 'data' in data['data'][stock_code]:
+        data = data['data'][stock_code]['data']['data']
+        data = [x.split(' ') for x in data]
+        return pd.DataFrame(data, columns=['date', 'close', 'volume', 'amount'])
+    else:
+        return pd.DataFrame()
+
+
+def parse_quotes(text: str) -> list:
+    """
+    解析批量行情快照
+    :return: [(股票代码, 时间 yyyyMMddHHmmss, 最新价, 累计成交量)]，停牌（最新价为 0）和无法识别的代码跳过
+    """
+    quotes = []
+    for line in text.split(';'):
+        name, sep, value = line.strip().partition('=')
+        fields = value.strip('"').split('~')
+        if not sep or not name.startswith('v_') or len(fields) <= QUOTE_TIME:
+            continue
+        try:
+            price, volume, ts = float(fields[QUOTE_PRICE]), int(float(fields[QUOTE_VOLUME])), int(fields[QUOTE_TIME])
+        except ValueError:
+            continue
+        if price > 0:
+            quotes.append((name[2:], ts, price, volume))
+    return quotes
+
+
+def parse_stock_list_page(data: dict) -> tuple:
+    """
+    解析一页股票列表，直接按字段拆成列
+    :return: (全市场总条数, {字段: 该页的列值})
+    """
+    data = (data or {}).get('data') or {}
+    diff = data.get('diff') or []
+    if isinstance(diff, dict):
+        diff = list(diff.values())
+    return data.get('total', 0), {fid: [row.get(fid, '-') for row in diff] for fid in STOCK_LIST_FIELDS}
+
+
+def stock_list_pages(total: int) -> range:
+    """第一页之后还需要拉取的页码"""
+    return range(2, math.ceil(total / STOCK_LIST_PAGE_SIZE) + 1)
+
+
+def build_stock_list(pages: list) -> pd.DataFrame:
+    """按列拼接各页，换算单位并补充市场前缀"""
+    all_stocks = pd.DataFrame({STOCK_FIELDS.get(fid, fid): [v for page in pages for v in page[fid]]
+                               for fid in STOCK_LIST_FIELDS})
+    change_name(all_stocks)
+    return all_stocks
+
+
+def concat_history(chunks: list) -> pd.DataFrame:
+    """把从新到旧分页下载的K线拼成按日期升序的完整历史"""
+    if not chunks:
+        return pd.DataFrame()
+    df = pd.concat(chunks[::-1], ignore_index=True).drop_duplicates(subset=['date']).sort_values('date')
+    return df.reset_index(drop=True)
+
+
 class DataFetcher:
-    def __init__(self, session: Optional[requests.Session] = None):
-        self.trading_days_file = 'data/trading_days.csv'
+    def __init__(self, session: Optional[requests.Session] = None, store: Optional[BarStore] = None,
+                 factors: Optional[FactorStore] = None, rollups: Optional[RollupStore] = None,
+                 rate_limits: Optional[dict] = None, workers: int = 8, lazy: bool = False):
+        """
+        :param factors: 复权因子表，默认与 store 同一根目录
+        :param rollups: 物化的周/月/年K线，默认由 store、factors 和交易日历创建
+        :param lazy: 为 True 时只加载本地已有的缓存，不访问网络，之后由 warmup() 在后台刷新
+        """
+        self.store = store or get_store()
+        self.calendar = TradingCalendar(self.store.root)
+        self.metadata = MetadataStore(self.store.root)
+        self.factors = factors or FactorStore(self.store.root)
+        self.rollups = rollups or RollupStore(self.store, self.factors, self.calendar)
 
         self.session = session or requests.Session()
         self.session.headers.update({
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         })
+        # 连接池大小与并发数一致，避免多线程回补时反复建连
+        adapter = HTTPAdapter(pool_connections=len(HOST_RATE_LIMITS), pool_maxsize=workers)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.rate_limiters = {host: TokenBucket(rate) for host, rate in (rate_limits or HOST_RATE_LIMITS).items()}
+        self.workers = workers
         self.timeout = 10
         if not os.path.exists('data/'):
             os.makedirs('data/')
-        self.stock_list = self.read_all_stock_list()  # 慢
-        self.trading_days, self.last_day = self.read_trading_days()
-        self.stock_metadata = self.get_stock_metadata()
-        # threading.Thread(target=self.update_all_stock_history, daemon=True).start()
+        self.warmup_status = {stage: 'pending' for stage in WARMUP_STAGES}
+        if lazy:
+            self.load_cached()
+        else:
+            self.warmup()
 
-    def _request(self, url: str) -> dict:
-        """统一请求方法"""
+    def load_cached(self):
+        """只读取本地缓存（可能不是最新的），没有缓存时置空"""
+        cache_stock_data_path = 'data/all_stock_value.csv'
+        self.stock_list = apply_stock_list_schema(pd.read_csv(cache_stock_data_path, encoding='utf-8')) \
+            if os.path.exists(cache_stock_data_path) else None
+        self.calendar.refresh()
+        self.last_day = self.calendar.last or '1970-01-01'
+
+    def warmup(self):
+        """
+        刷新股票列表、交易日历和元数据（慢，可能需要联网）
+        lazy 模式下由后台线程调用，各阶段进度记录在 warmup_status
+        """
+
+        def stock_list():
+            self.stock_list = self.read_all_stock_list()
+
+        def trading_days():
+            self.calendar, self.last_day = self.read_trading_days()
+
+        def stock_metadata():
+            self.get_stock_metadata()
+
+        for stage, load in zip(WARMUP_STAGES, [stock_list, trading_days, stock_metadata]):
+            self.warmup_status[stage] = 'running'
+            try:
+                load()
+                self.warmup_status[stage] = 'done'
+            except Exception as e:
+                self.warmup_status[stage] = f'failed: {e}'
+                print(f'预热 {stage} 失败: {e}')
+
+    @property
+    def stock_metadata(self) -> pd.DataFrame:
+        """整张元数据表；按交易所、状态筛选时直接用 self.metadata.query / codes"""
+        return self.metadata.load()
+
+    @property
+    def ready(self) -> bool:
+        return all(v == 'done' for v in self.warmup_status.values())
+
+    def _get(self, url: str) -> requests.Response:
+        limiter = self.rate_limiters.get(urlparse(url).hostname)
+        if limiter:
+            limiter.acquire()
         try:
             response = self.session.get(url, timeout=self.timeout)
             response.raise_for_status()
+            return response
+        except Exception as e:
+            raise RuntimeError(f"请求失败 {url}: {str(e)}")
+
+    def _request(self, url: str) -> dict:
+        """统一请求方法"""
+        response = self._get(url)
+        try:
             return response.json()
         except Exception as e:
             raise RuntimeError(f"请求失败 {url}: {str(e)}")
 
+    def get_quotes(self, codes: list) -> list:
+        """
+        批量行情快照，每 QUOTE_BATCH_SIZE 只股票一次请求
+        :return: 见 parse_quotes
+        """
+        quotes = []
+        for i in range(0, len(codes), QUOTE_BATCH_SIZE):
+            response = self._get(QUOTE_URL.format(codes=','.join(codes[i:i + QUOTE_BATCH_SIZE])))
+            response.encoding = 'gbk'
+            quotes += parse_quotes(response.text)
+        return quotes
+
     def _get_minute_kline(self, stock_code: str, type: str = "m1", end: str = "", length: int = 800) -> pd.DataFrame:
         """
         获取股票分钟k线数据
@@ -204,15 +449,8 @@ class DataFetcher:
         :param length: 数据长度  最大800
         :return: k线数据
         """
-        url = f"https://ifzq.gtimg.cn/appstock/app/kline/mkline?param={stock_code},{type},{end},{length}"
-        data = self._request(url)
-        data = data['data'][stock_code][type]
-        df = pd.DataFrame(data, columns=['date', 'open', 'close', 'high', 'low', 'volume', '1', 'exchange'])
-        num_cols = ['open', 'close', 'high', 'low', 'volume']
-        for c in num_cols:
-            if c in df.columns:
-                df[c] = pd.to_numeric(df[c], errors='coerce')
-        return df
+        url = MINUTE_KLINE_URL.format(stock_code=stock_code, type=type, end=end, length=length)
+        return parse_minute_kline(self._request(url), stock_code, type)
 
     def _get_day_kline(self, stock_code: str, type: str = "day", start: str = "", end: str = "", length: int = 800,
                        adjust: str = "qfq") -> pd.DataFrame:
@@ -226,30 +464,14 @@ class DataFetcher:
         :param adjust: 复权类型 可选、"hfq"（后复权） "qfq"（前复权）、""（不复权）
         :return: k线数据
         """
-        url_1 = f"https://proxy.finance.qq.com/ifzqgtimg/appstock/app/newfqkline/get?param={stock_code},{type},{start},{end},{length},{adjust}"
-        url_2 = f"https://web.ifzq.gtimg.cn/appstock/app/fqkline/get?param={stock_code},{type},{start},{end},{length},{adjust}"
+        url_1, url_2 = [u.format(stock_code=stock_code, type=type, start=start, end=end, length=length,
+                                 adjust=adjust) for u in DAY_KLINE_URLS]
 
         try:
             data = self._request(url_1)
         except:
             data = self._request(url_2)
-        if not data['data']:
-            return pd.DataFrame()
-        key = adjust + type if adjust + type in data['data'][stock_code] else type
-        data = data['data'][stock_code][key]
-        if not data:
-            return pd.DataFrame()
-        col_map = {6: ["date", "open", "close", "high", "low", "volume"],
-                   7: ["date", "open", "close", "high", "low", "volume", "info"],
-                   10: ["date", "open", "close", "high", "low", "volume", "info", "ex", "amount", "cnt"],
-                   11: ["date", "open", "close", "high", "low", "volume", "info", "ex", "amount", "cnt", ""]}
-        df = pd.DataFrame(data, columns=col_map.get(len(data[0])))
-        num_cols = ['open', 'close', 'high', 'low', 'volume']
-        for c in num_cols:
-            if c in df.columns:
-                df[c] = pd.to_numeric(df[c], errors='coerce')
-        df["volume"] = df["volume"].astype(int)
-        return df
+        return parse_day_kline(data, stock_code, type, adjust)
 
     def _get_today_kline(self, stock_code: str) -> pd.DataFrame:
         """
@@ -257,14 +479,8 @@ class DataFetcher:
         :param stock_code: 股票代码
         :return: k线数据
         """
-        url = f"https://web.ifzq.gtimg.cn/appstock/app/minute/query?code={stock_code}"
-        data = self._request(url)
-        if 'data' in data and stock_code in data['data'] and 'data' in data['data'][stock_code]:
-            data = data['data'][stock_code]['data']['data']
-            data = [x.split(' ') for x in data]
-            return pd.DataFrame(data, columns=['date', 'close', 'volume', 'amount'])
-        else:
-            return pd.DataFrame()
+        url = TODAY_KLINE_URL.format(stock_code=stock_code)
+        return parse_today_kline(self._request(url), stock_code)
 
     def _get_five_day_kline(self, stock_code: str) -> pd.DataFrame:
         """
@@ -347,108 +563,100 @@ class DataFetcher:
                 break
             if len(chunk) < 800:  # 已经到头
                 break
-        if chunk.empty:
-            return pd.DataFrame()
-        df = pd.concat(all_df[::-1], ignore_index=True).drop_duplicates(subset=['date']).sort_values('date')
-        # df.to_csv(f"{stock_code}.csv", index=False)
-        return df.reset_index(drop=True)
+        return concat_history(all_df)
 
     def get_all_stock_list(self):
         """
         获取所有股票列表
+        第一页返回总条数，其余页并发拉取，频率由 push2.eastmoney.com 的令牌桶控制
         :return: 股票列表
         """
-        import time
-        all_stocks = []
-        page = 1
 
-        while True:
-            try:
-                url = f"https://push2.eastmoney.com/api/qt/clist/get?np=1&fltt=1&invt=2&fs=m:0+t:6,m:0+t:80,m:1+t:2,m:1+t:23,m:0+t:81+s:2048&fields=f2,f3,f4,f5,f6,f7,f8,f9,f10,f12,f13,f14,f15,f16,f17,f18,f20,f23,f26&fid=f12&pn={page}&pz=100&po=0&dect=1"
-                data = self._request(url)
-                stocks = ((data or {}).get('data') or {}).get('diff', [])
-                if not stocks:
-                    break
-                all_stocks.extend(stocks)
-                page += 1
-                # 频率控制
-                time.sleep(0.5)
-            except Exception as e:
-                print(f"获取股票列表失败: {e}")
-                return None
-        all_stocks = pd.DataFrame(all_stocks)
-        all_stocks.columns = [STOCK_FIELDS.get(fid, fid) for fid in all_stocks.columns]
-        change_name(all_stocks)
-        return all_stocks
+        def fetch_page(page):
+            return parse_stock_list_page(self._request(STOCK_LIST_URL.format(page=page)))[1]
+
+        try:
+            total, first = parse_stock_list_page(self._request(STOCK_LIST_URL.format(page=1)))
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                rest = list(pool.map(fetch_page, stock_list_pages(total)))
+        except Exception as e:
+            print(f"获取股票列表失败: {e}")
+            return None
+        return build_stock_list([first] + rest)
+
+    @property
+    def trading_days(self) -> list:
+        """交易日历的 yyyy-MM-dd 列表（兼容旧用法），日期运算请直接用 self.calendar"""
+        return self.calendar.to_list()
 
     def read_trading_days(self):
         """
-        读取交易日历
-        :return: 交易日历列表, 最新交易日
+        读取交易日历，本地没有时下载
+        :return: 交易日历, 最新交易日
         """
-        if not os.path.exists(self.trading_days_file):
-            trading_days = self.update_trading_days()
-            return trading_days, '1970-01-01'
-        _df = pd.read_csv(self.trading_days_file)
-        return _df['trading_days'].tolist(), _df.iat[-1, 0]
+        self.calendar.refresh()
+        if not self.calendar:
+            return self.update_trading_days(), '1970-01-01'
+        return self.calendar, self.calendar.last
 
-    def update_trading_days(self):
+    def update_trading_days(self) -> TradingCalendar:
         """
-        更新交易日历
-        :return: 交易日历列表,
+        更新交易日历：只下载日历最后一天之后的上证指数日线，新交易日追加到日历文件尾
+        :return: 交易日历
         """
-        if not os.path.exists(self.trading_days_file):
-            _df = self.get_history('sh000001', 'day')
-            if not _df.empty:
-                trading_days = _df['date'].tolist()
-                pd.DataFrame({'trading_days': trading_days}).to_csv(self.trading_days_file, index=False)
-                return trading_days
-        else:
-            _df = pd.read_csv(self.trading_days_file)
-            trading_days = _df['trading_days'].tolist()
-            if not _df.empty:
-                last_day = _df.iat[-1, 0]
-                _df = self.get_history('sh000001', 'day', start=last_day)
-                if not _df.empty:
-                    trading_days = sorted(set(trading_days + _df['date'].tolist()))
-                    pd.DataFrame({'trading_days': trading_days}).to_csv(self.trading_days_file, index=False)
-                    return trading_days
+        self.calendar.refresh()
+        _df = self.get_history('sh000001', 'day', start=self.calendar.last or '')
+        if not _df.empty:
+            self.calendar.extend(_df['date'])
+        return self.calendar
+
+    def download_history(self, stock_code: str) -> pd.DataFrame:
+        """
+        下载单个股票全部不复权日线和复权因子并落盘，前/后复权在读取时由因子计算
+        :return: 不复权日线
+        """
+        _df = self.get_history(stock_code, 'day', adjust='')
+        if _df.empty:
+            return _df
+        self.factors.write(stock_code, ts_get_adj_factor_history(stock_code))
+        self.store.write(stock_code, adjust_type('day', ''), _df, '')
+        self.rollups.rebuild(stock_code)
+        return _df
 
     def update_daily_history(self, stock_code: str, adjust: str = "qfq"):
         """
-        增量更新单个股票日线文件（csv）
-        首次运行会自动全量下载；后续只拉取新增日期
+        增量更新单个股票日线文件
+        首次运行会自动全量下载；后续只拉取新增日期的不复权K线和复权因子
         """
-        file_path = os.path.join('data', 'day', f"{stock_code}.csv")
         adjust = normalize_adjust(adjust)
+        raw_type = adjust_type('day', '')
 
-        # 如果文件存在，读最新日期；否则全量
-        if os.path.exists(file_path):
-            old_df = pd.read_csv(file_path)
-            last_date = old_df['date'].iat[-1]
-            if last_date == self.trading_days[-1]:
-                return old_df
+        # 如果文件存在，读最新日期，只追加新增部分；否则全量
+        last_date = self.store.last_date(stock_code, raw_type)
+        if last_date is None:
+            self.download_history(stock_code)
+        elif last_date != self.calendar.last:
             start = pd.to_datetime(last_date) + pd.Timedelta(days=1)
             start_str = start.strftime('%Y-%m-%d')
-            new_df = self.get_kline_from_qq(stock_code, 'day', start=start_str, adjust=adjust)
-            _df = pd.concat([old_df, new_df]).drop_duplicates(subset=['date']).sort_values('date')
-        else:
-            _df = self.get_history(stock_code, 'day', adjust)
-
-        # 写回
-        if not _df.empty:
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            _df.to_csv(file_path, index=False)
-        return _df
+            new_df = self.get_kline_from_qq(stock_code, 'day', start=start_str, adjust='')
+            if not new_df.empty:
+                self.factors.append(stock_code, ts_get_adj_factor([stock_code], new_df['date'].tolist()))
+                self.store.append(stock_code, raw_type, new_df, '')
+                self.rollups.update(stock_code, new_df['date'].min())
+        arr = apply_factors(self.store.load(stock_code, raw_type), self.factors.load(stock_code), adjust)
+        return from_records(arr, 'day') if len(arr) else pd.DataFrame()
 
     def read_all_stock_list(self):
         cache_stock_data_path = 'data/all_stock_value.csv'
         if os.path.exists(cache_stock_data_path):
             if datetime.date.fromtimestamp(os.path.getmtime(cache_stock_data_path)) == datetime.date.today():
-                df = pd.read_csv(cache_stock_data_path, encoding='utf-8')
+                df = apply_stock_list_schema(pd.read_csv(cache_stock_data_path, encoding='utf-8'))
                 print(f'从文件读取股票列表')
             else:
                 df = self.get_all_stock_list()
+                if df is None:
+                    # 接口失败时退回到旧缓存
+                    return apply_stock_list_schema(pd.read_csv(cache_stock_data_path, encoding='utf-8'))
                 df.to_csv(cache_stock_data_path, encoding='utf-8', index=False)
                 print(f'从接口获取股票列表')
         else:
@@ -459,21 +667,15 @@ class DataFetcher:
             print(f'从接口获取股票列表')
         return df
 
-    def update_all_data(self):
+    def reconcile_metadata(self) -> pd.DataFrame:
         """
-        更新所有数据
-        1.更新最新所有股票列表
-        2.更新元数据表
-        3.更新所有股票日线数据
+        按最新股票列表调整元数据表：保留仍在列表中的股票，新股票以 Unknown 状态加入
+        只在内存中调整，由 save_metadata 在更新结束时一次写入
         """
-        print('开始更新所有数据')
-        # self.stock_list = self.read_all_stock_list()
-        self.trading_days = self.update_trading_days()
-        self.stock_metadata = pd.read_csv('data/stock_metadata.csv')
+        meta = self.metadata.load()
         codes_in_list = set(self.stock_list['股票代码'])
-        mask_keep = self.stock_metadata['stock_code'].isin(codes_in_list)
-        keep_stocks = self.stock_metadata[mask_keep].copy()
-        existing_codes = set(self.stock_metadata['stock_code'])
+        keep_stocks = meta[meta['stock_code'].isin(codes_in_list)].copy()
+        existing_codes = set(meta['stock_code'])
         new_codes = self.stock_list['股票代码'][~self.stock_list['股票代码'].isin(existing_codes)].unique()
         new_stocks = pd.DataFrame({
             'stock_code': new_codes,
@@ -483,80 +685,55 @@ class DataFetcher:
             'exchange': [code[:2] for code in new_codes],  # 提取 sz/sh/bj
             'status': 'Unknown'  # 后续可更新
         })
-        updated_metadata = pd.concat([keep_stocks, new_stocks], ignore_index=True)
-
-        need_update = updated_metadata[(updated_metadata['status'].isin(['Active', 'Halting', 'Unknown']))]
-        for c in need_update[need_update['status'].isin(['Halting', 'Unknown'])]['stock_code'].tolist():
-            _df = self.get_history(stock_code=c)
-            if not _df.empty:
-                _df.to_csv(os.path.join('data', 'day', f"{c}.csv"), index=False)
-                updated_metadata.loc[updated_metadata['stock_code'] == c, 'latest_trade_date'] = _df.iat[
-                    -1, _df.columns.get_loc('date')]
-                updated_metadata.loc[updated_metadata['stock_code'] == c, 'earliest_trade_date'] = _df.iat[
-                    0, _df.columns.get_loc('date')]
-                updated_metadata.loc[updated_metadata['stock_code'] == c, 'last_sync_time'] = self.last_day
-        # print(updated_metadata)
-        need_update_list = need_update[need_update['status'].isin(['Active'])]['stock_code'].tolist()
-        pos = 0
-        for i, d in enumerate(self.trading_days):
-            if d == self.last_day:
-                pos = i
-                break
-        update_dates = self.trading_days[max(0, pos - 2):]
-        res = ts_get_daily_data(trade_days=update_dates)
-        self.last_day = self.trading_days[-1]
-        if not res.empty:
-            for c in need_update_list:
-                _df = res[res['stock_code'] == c].drop('stock_code', axis=1)
-                if not _df.empty:
-                    try:
-                        old_df = pd.read_csv(os.path.join('data', 'day', f"{c}.csv"))
-                    except Exception as e:
-                        old_df = pd.DataFrame(columns=['date', 'open', 'close', 'high', 'low', 'volume'])
-                    # 往前多取几天，防止数据不完整，处理复权问题
-                    common_dates = _df['date'].isin(old_df['date'])
-                    overlap1 = _df[common_dates].set_index('date').sort_index()[
-                        ['open', 'high', 'low', 'close', 'volume']]
-                    overlap2 = old_df[old_df['date'].isin(_df['date'])].set_index('date').sort_index()[
-                        ['open', 'high', 'low', 'close', 'volume']]
-                    if overlap1.equals(overlap2):
-                        old_df = old_df[~old_df['date'].isin(_df['date'])]
-                        _df = pd.concat([old_df, _df])
-                    else:
-                        print(f' {c} 重新下载')
-                        _df = self.get_history(stock_code=c)
-
-                    _df.to_csv(os.path.join('data', 'day', f"{c}.csv"), index=False)
-                    updated_metadata.loc[updated_metadata['stock_code'] == c, 'latest_trade_date'] = _df.iat[
-                        -1, _df.columns.get_loc('date')]
-                    updated_metadata.loc[updated_metadata['stock_code'] == c, 'earliest_trade_date'] = _df.iat[
-                        0, _df.columns.get_loc('date')]
-                    updated_metadata.loc[updated_metadata['stock_code'] == c, 'last_sync_time'] = self.last_day
-
-        updated_metadata = self.set_status(updated_metadata)
-        updated_metadata.to_csv('data/stock_metadata.csv', index=False)
-        self.stock_metadata = updated_metadata
-        print('所有数据更新完成')
-
-    def get_stock_metadata(self):
-        if not os.path.exists('data/stock_metadata.csv'):
-            if self.stock_list is None:
-                return pd.DataFrame()
-            else:
-                meta = pd.DataFrame()
-                meta['stock_code'] = self.stock_list['股票代码'].copy()
-                meta['latest_trade_date'] = pd.NaT
-                meta['earliest_trade_date'] = pd.NaT
-                meta['last_sync_time'] = pd.NaT
-                meta['exchange'] = self.stock_list['股票代码'].str[:2]
-                meta['status'] = 'Unknown'
-                meta = self.set_status(meta)
-                meta.to_csv('data/stock_metadata.csv', index=False)
-                return meta
-        else:
-            return pd.read_csv('data/stock_metadata.csv')
+        return pd.concat([keep_stocks, new_stocks], ignore_index=True)
+
+    def update_all_data(self, processes: int = None) -> dict:
+        """
+        更新所有数据，按阶段执行见 pipeline.UpdatePipeline
+        1.更新交易日历
+        2.更新元数据表
+        3.更新所有股票日线数据
+        :param processes: 合并写盘阶段的进程数，默认 CPU 核数
+        :return: 运行报告
+        """
+        from pipeline import UpdatePipeline
+        return UpdatePipeline(self, processes=processes).run()
+
+    def apply_synced(self, meta: pd.DataFrame, synced: dict) -> pd.DataFrame:
+        """把同步结果一次性合并进元数据表"""
+        if not synced:
+            return meta
+        updates = pd.DataFrame.from_dict(synced, orient='index', columns=['earliest_trade_date', 'latest_trade_date'])
+        updates['last_sync_time'] = self.last_day
+        date_cols = list(updates.columns)
+        meta = meta.set_index('stock_code')
+        meta[date_cols] = meta[date_cols].astype(object)
+        meta.update(updates)  # None 不覆盖原值
+        return meta.reset_index()
+
+    def save_metadata(self, meta: pd.DataFrame, synced: dict) -> pd.DataFrame:
+        """合并同步结果、刷新状态后写入元数据表，删除、插入和更新在同一个事务内完成"""
+        meta = self.set_status(self.apply_synced(meta, synced))
+        self.metadata.replace(meta)
+        return meta
+
+    def get_stock_metadata(self) -> pd.DataFrame:
+        """元数据表为空时按股票列表建立"""
+        if self.metadata.count() or self.stock_list is None:
+            return self.metadata.load()
+        meta = pd.DataFrame()
+        meta['stock_code'] = self.stock_list['股票代码'].copy()
+        meta['latest_trade_date'] = pd.NaT
+        meta['earliest_trade_date'] = pd.NaT
+        meta['last_sync_time'] = pd.NaT
+        meta['exchange'] = self.stock_list['股票代码'].str[:2]
+        meta['status'] = 'Unknown'
+        meta = self.set_status(meta)
+        self.metadata.upsert(meta)
+        return meta
 
     def set_status(self, meta):
+        """按股票列表的行情字段推断状态，按股票代码对应；不在列表中的股票保持原状态"""
         temp_df = self.stock_list[['最新价', '市盈率', '上市日期']].replace('-', np.nan)
         latest_price = temp_df['最新价']
         volume_ratio = temp_df['市盈率']
@@ -564,10 +741,13 @@ class DataFetcher:
         is_active = latest_price.notna()  # 最新价有数据
         is_halting = ~is_active & volume_ratio.notna()  # 最新价无数据但市盈率有数据
         is_unlisted = listing_date.isna()  # 无上市日期 → 未上市
-        meta.loc[is_active, 'status'] = 'Active'
-        meta.loc[is_halting, 'status'] = 'Halting'
-        meta.loc[is_unlisted, 'status'] = 'Unlisted'
-        meta.loc[~is_active & ~is_halting & ~is_unlisted, 'status'] = 'Delisted'
+        status = pd.Series('Delisted', index=self.stock_list.index)
+        status[is_active] = 'Active'
+        status[is_halting] = 'Halting'
+        status[is_unlisted] = 'Unlisted'
+        status.index = self.stock_list['股票代码']
+        status = status[~status.index.duplicated()]
+        meta['status'] = meta['stock_code'].map(status).fillna(meta['status'])
         return meta
 
 
@@ -1,9 +1,198 @@
-import pandas as pd
 import os
 
-def read_stock_history(stock_code,type) :
-    file_path = f"data/{type}/{stock_code}.csv"
-    if not os.path.exists(file_path):
+import numpy as np
+import pandas as pd
+
+from cache import LRUCache
+from indicators import ALIASES, compute
+from panel import PanelStore
+from resample import RESAMPLE_BASE, resample
+from rollup import ROLLUP_TYPES, RollupStore
+from store import FACTOR_TYPES, FactorStore, adjust_type, apply_factors, from_records, get_store, split_adjust_type, \
+    window
+from trading_calendar import TradingCalendar
+
+store = get_store()
+factors = FactorStore(store.root)
+panel = PanelStore(store.root)  # 全市场截面矩阵，由 python panel.py 生成、每日更新维护
+# 已解析K线的进程内缓存，key 为 (股票代码, k线类型, 复权方式)，预算由 FP_CACHE_MB 配置
+bar_cache = LRUCache(int(os.environ.get('FP_CACHE_MB', 256)) * 1024 * 1024)
+# 指标结果缓存，key 为 (股票代码, k线类型, 复权方式, 指标, 参数)，条目记录计算时的数据版本，预算由 FP_INDICATOR_CACHE_MB 配置
+indicator_cache = LRUCache(int(os.environ.get('FP_INDICATOR_CACHE_MB', 64)) * 1024 * 1024)
+calendar = TradingCalendar(store.root)  # 与每日更新共用同一个日历文件，其他进程追加后自动重新载入
+rollups = RollupStore(store, factors, calendar)
+ADJUSTS = ['qfq', 'hfq', '']
+
+
+def _invalidate(stock_code, store_type):
+    type, adjust = split_adjust_type(store_type)
+    # 前/后复权由不复权K线派生，不复权文件或因子变化时一起失效；由它合成的高周期也一起失效
+    adjusts = ADJUSTS if type in FACTOR_TYPES else [adjust]
+    types = [type] + [t for t, base in RESAMPLE_BASE.items() if base == type]
+    for t in types:
+        for a in adjusts:
+            bar_cache.invalidate((stock_code, t, a))
+
+
+def _invalidate_rollup(stock_code, type):
+    for a in ADJUSTS:
+        bar_cache.invalidate((stock_code, type, a))
+
+
+store.subscribe(_invalidate)
+factors.subscribe(lambda stock_code: _invalidate(stock_code, adjust_type('day', '')))
+rollups.subscribe(_invalidate_rollup)
+
+
+def has_raw(stock_code, type) -> bool:
+    """是否按 不复权K线 + 复权因子 的方式存储"""
+    return type in FACTOR_TYPES and store.exists(stock_code, adjust_type(type, ''))
+
+
+def has_history(stock_code, type, adjust='qfq') -> bool:
+    """本地是否已有可读的数据（不复权+因子、可合成的基础周期，或旧的按复权方式分目录的文件）"""
+    return has_raw(stock_code, type) or _base(stock_code, type, adjust) is not None or \
+        store.exists(stock_code, adjust_type(type, adjust))
+
+
+def _base(stock_code, type, adjust):
+    """本地有基础周期数据时返回基础周期（周/月/年 → 日线，m5~m120 → 1 分钟线），否则 None"""
+    base = RESAMPLE_BASE.get(type)
+    if base and has_history(stock_code, base, adjust):
+        return base
+    return None
+
+
+def trading_days():
+    """交易日历（yyyyMMdd 整数数组），文件更新后自动重新加载，没有日历时返回 None"""
+    calendar.refresh()
+    return calendar.days if calendar else None
+
+
+def _use_rollup(stock_code, type, adjust) -> bool:
+    """物化的周/月/年K线存在且已包含最新日线时直接读取，否则现场合成"""
+    return type in ROLLUP_TYPES and rollups.exists(stock_code, type, adjust) and \
+        rollups.is_current(stock_code, type, adjust)
+
+
+def data_version(stock_code, type, adjust='qfq'):
+    """K线的数据版本（相关文件的 mtime 和大小），每日更新写入后即改变，只 stat 不读文件"""
+    return _version(stock_code, type, adjust)
+
+
+def _version(stock_code, type, adjust):
+    if _use_rollup(stock_code, type, adjust):
+        return 'rollup', rollups.version(stock_code, type, adjust)
+    base = _base(stock_code, type, adjust)
+    if base:
+        trading_days()
+        return _version(stock_code, base, adjust), calendar.version
+    if has_raw(stock_code, type):
+        return store.version(stock_code, adjust_type(type, '')), factors.version(stock_code)
+    return store.version(stock_code, adjust_type(type, adjust))
+
+
+def _load(stock_code, type, adjust, cache=True) -> np.ndarray:
+    if _use_rollup(stock_code, type, adjust):
+        return rollups.load(stock_code, type, adjust)
+    base = _base(stock_code, type, adjust)
+    if base:
+        # 周/月/年及分钟高周期由本地基础周期合成，不再单独下载
+        return resample(read_stock_records(stock_code, base, adjust, cache), type, trading_days())
+    if has_raw(stock_code, type):
+        return apply_factors(store.load(stock_code, adjust_type(type, '')), factors.load(stock_code), adjust)
+    # 尚未回补不复权数据的股票，读旧的按复权方式存放的文件
+    return store.load(stock_code, adjust_type(type, adjust))
+
+
+def read_stock_records(stock_code, type, adjust='qfq', cache=True) -> np.ndarray:
+    """
+    读取结构化K线数组，优先命中缓存；文件版本变了（其他进程写过）视为未命中
+    :param cache: 为 False 时只使用已缓存的结果，不写入也不调整淘汰顺序，批量扫描全市场时不冲掉热点数据
+    """
+    key = (stock_code, type, adjust)
+    version = _version(stock_code, type, adjust)
+    item = bar_cache.get(key) if cache else bar_cache.peek(key)
+    if item is not None and item[0] == version:
+        return item[1]
+    if not cache:
+        return _load(stock_code, type, adjust, cache=False)
+    generation = bar_cache.generation(key)
+    arr = _load(stock_code, type, adjust)
+    if len(arr):
+        bar_cache.put(key, (version, arr), arr.nbytes, generation)
+    return arr
+
+
+def _load_window(stock_code, type, adjust, start, end, length) -> np.ndarray:
+    """直接存储的周期：在 memmap 上二分出区间，只复制命中的记录，复权因子也只作用于这一段"""
+    if has_raw(stock_code, type):
+        arr = store.read_range_records(stock_code, adjust_type(type, ''), start, end, length)
+        return apply_factors(arr, factors.load(stock_code), adjust)
+    return store.read_range_records(stock_code, adjust_type(type, adjust), start, end, length)
+
+
+def read_stock_window(stock_code, type, adjust='qfq', start='', end='', length=None, cache=True) -> np.ndarray:
+    """
+    按日期区间读取结构化K线数组，开销与区间内的根数成正比，而不是与全部历史成正比
+    整段历史已在缓存中时直接切片；物化或现场合成的高周期读整段（合成需要完整的基础周期）后切片；
+    其余按区间读取并以 (股票代码, k线类型, 复权方式, start, end, length) 缓存，文件版本变了视为未命中
+    :param cache: 同 read_stock_records
+    """
+    if _use_rollup(stock_code, type, adjust) or _base(stock_code, type, adjust):
+        arr = read_stock_records(stock_code, type, adjust, cache)
+        lo, hi = window(arr['date'], type, start, end, length)
+        return arr[lo:hi]
+    version = _version(stock_code, type, adjust)
+    item = bar_cache.peek((stock_code, type, adjust))
+    if item is not None and item[0] == version:
+        lo, hi = window(item[1]['date'], type, start, end, length)
+        return item[1][lo:hi]
+    key = (stock_code, type, adjust, start, end, length)
+    item = bar_cache.get(key) if cache else bar_cache.peek(key)
+    if item is not None and item[0] == version:
+        return item[1]
+    generation = bar_cache.generation(key)
+    arr = _load_window(stock_code, type, adjust, start, end, length)
+    if cache and len(arr):
+        bar_cache.put(key, (version, arr), arr.nbytes, generation)
+    return arr
+
+
+def read_stock_history(stock_code, type, adjust='qfq') -> pd.DataFrame:
+    arr = read_stock_records(stock_code, type, adjust)
+    if not len(arr):
         return pd.DataFrame()
-    return pd.read_csv(file_path)
+    return from_records(arr, type)
+
+
+def read_stock_range(stock_code, type, adjust='qfq', start='', end='', length=None) -> pd.DataFrame:
+    """按日期区间读取，只解码命中的那一段"""
+    arr = read_stock_window(stock_code, type, adjust, start, end, length)
+    if not len(arr):
+        return pd.DataFrame()
+    return from_records(arr, type)
+
 
+def read_indicator(stock_code, type, adjust='qfq', name='sma', params: dict = None) -> tuple:
+    """
+    在全部历史K线上计算指标并缓存，同一参数、数据未变时直接返回缓存结果
+    数据版本变了（每日更新或其他进程写过）视为未命中，重新计算后覆盖旧条目
+    :param name: 指标名，见 indicators.INDICATORS
+    :param params: 指标参数，如 {'window': 20}
+    :return: (整数日期数组, {输出列名: 数组})，无数据时日期数组为空
+    """
+    params = params or {}
+    name = ALIASES.get(name, name)
+    key = (stock_code, type, adjust, name, tuple(sorted(params.items())))
+    version = _version(stock_code, type, adjust)
+    item = indicator_cache.get(key)
+    if item is not None and item[0] == version:
+        return item[1]
+    generation = indicator_cache.generation(key)
+    arr = read_stock_records(stock_code, type, adjust)
+    result = arr['date'], compute(name, arr, **params)
+    if len(arr):
+        nbytes = arr['date'].nbytes + sum(v.nbytes for v in result[1].values())
+        indicator_cache.put(key, (version, result), nbytes, generation)
+    return result
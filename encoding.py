@@ -0,0 +1,188 @@
+import gzip
+import hashlib
+
+import numpy as np
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+
+from store import BAR_COLUMNS, MINUTE_TYPES, decode_dates, to_datetime64
+
+try:  # Arrow IPC 输出为可选功能：pip install pyarrow
+    import pyarrow as pa
+except ImportError:
+    pa = None
+try:  # zstd 压缩为可选功能：pip install zstandard
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON_MEDIA_TYPE = 'application/json'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+EVENT_STREAM_MEDIA_TYPE = 'text/event-stream'
+# Arrow IPC 流的结束标记
+ARROW_EOS = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+# 分钟K线的 Arrow 时间戳精度；Arrow 只支持 s/ms/us/ns
+ARROW_TIME_UNIT = 's'
+# 小于该字节数的响应不压缩，压缩收益抵不上开销
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 3
+ZSTD_LEVEL = 3
+
+
+def dumps(obj) -> bytes:
+    """orjson 序列化，NumPy 数组直接按 C 连续内存写出，NaN 写为 null"""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def ndjson_line(obj) -> bytes:
+    """NDJSON 的一行（末尾带换行）"""
+    return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+
+
+def sse_message(event: str, obj) -> bytes:
+    """Server-Sent Events 的一条消息，data 为一行 JSON"""
+    return b'event: ' + event.encode() + b'\ndata: ' + dumps(obj) + b'\n\n'
+
+
+def bar_columns(arr: np.ndarray, type: str) -> dict:
+    """
+    结构化K线数组 → 列式 {列名: 数组}，日期为与原 CSV 一致的字符串
+    结构化数组的列是跨步视图，复制成连续数组后 orjson 才能直接序列化
+    """
+    columns = {'date': decode_dates(arr['date'], type).to_numpy().tolist()}
+    for c in BAR_COLUMNS[1:]:
+        columns[c] = np.ascontiguousarray(arr[c])
+    return columns
+
+
+def bar_rows(arr: np.ndarray, type: str) -> list:
+    """旧的按行格式 [[date, open, close, high, low, volume], ...]，列顺序与原 CSV 一致"""
+    columns = [decode_dates(arr['date'], type).to_numpy().tolist()] + [arr[c].tolist() for c in BAR_COLUMNS[1:]]
+    return [list(row) for row in zip(*columns)]
+
+
+def arrow_bytes(columns: dict, metadata: dict = None) -> bytes:
+    """
+    列式数据 → Arrow IPC 流
+    :param columns: {列名: 数组}，datetime64 列写为 Arrow 的 date32 / timestamp
+    :param metadata: 附在 schema 上的键值对，如股票代码、复权方式
+    """
+    if pa is None:
+        raise RuntimeError('Arrow 输出需要安装 pyarrow')
+    table = pa.table(columns)
+    if metadata:
+        table = table.replace_schema_metadata({k: str(v) for k, v in metadata.items()})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def arrow_bar_columns(arr: np.ndarray, type: str) -> dict:
+    """结构化K线数组 → Arrow 用的列，日期保留为日期类型而不是字符串"""
+    if type in MINUTE_TYPES:
+        d = np.asarray(arr['date'], dtype=np.int64)
+        dates = to_datetime64(d // 10000) + (d // 100 % 100 * 60 + d % 100).astype('timedelta64[m]')
+        # Arrow 的 timestamp 不支持分钟精度，转为秒
+        dates = dates.astype(f'datetime64[{ARROW_TIME_UNIT}]')
+    else:
+        dates = to_datetime64(arr['date'])
+    return {'date': dates, **{c: np.ascontiguousarray(arr[c]) for c in BAR_COLUMNS[1:]}}
+
+
+def arrow_bar_schema(type: str):
+    """分股票流式输出K线时的 Arrow schema，每个记录批次是一只股票"""
+    if pa is None:
+        raise RuntimeError('Arrow 输出需要安装 pyarrow')
+    date = pa.timestamp(ARROW_TIME_UNIT) if type in MINUTE_TYPES else pa.date32()
+    return pa.schema([('stock_code', pa.string()), ('date', date)] +
+                     [(c, pa.int64() if c == 'volume' else pa.float64()) for c in BAR_COLUMNS[1:]])
+
+
+def arrow_schema_message(schema) -> bytes:
+    """Arrow IPC 流的开头（schema 消息），之后逐个拼接 arrow_batch_message，最后以 ARROW_EOS 结束"""
+    return schema.serialize().to_pybytes()
+
+
+def arrow_batch_message(schema, stock_code: str, arr: np.ndarray, type: str) -> bytes:
+    """一只股票的K线 → Arrow IPC 记录批次消息"""
+    columns = arrow_bar_columns(arr, type)
+    arrays = [pa.array([stock_code] * len(arr), pa.string())] + \
+             [pa.array(columns[field.name], field.type) for field in list(schema)[1:]]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema).serialize().to_pybytes()
+
+
+def wants_arrow(request: Request, format: str = '') -> bool:
+    """format=arrow，或未指定 format 时 Accept 头要求 Arrow"""
+    if format:
+        return format == 'arrow'
+    return ARROW_MEDIA_TYPE in request.headers.get('accept', '')
+
+
+def make_etag(*parts) -> str:
+    """由请求参数和数据版本生成强 ETag"""
+    return '"' + hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest() + '"'
+
+
+def body_etag(body: bytes) -> str:
+    """由响应体内容生成 ETag，用于没有数据版本可用的预序列化响应"""
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def _encoded_etag(etag: str, encoding: str) -> str:
+    """压缩后的表示使用不同的 ETag，在引号内加上编码后缀，如 -gzip"""
+    return etag[:-1] + f'-{encoding}"' if encoding else etag
+
+
+def not_modified(request: Request, etag: str):
+    """If-None-Match 命中时（含压缩后的 ETag）返回 304 响应，否则 None"""
+    tags = request.headers.get('if-none-match', '')
+    if not etag or not tags:
+        return None
+    for tag in tags.split(','):
+        tag = tag.strip().removeprefix('W/')
+        for encoding in ['', 'gzip', 'zstd']:
+            if tag == '*' or tag == _encoded_etag(etag, encoding):
+                return Response(status_code=304, headers={'ETag': tag if tag != '*' else etag})
+    return None
+
+
+def _choose_encoding(request: Request) -> str:
+    accepted = {e.split(';')[0].strip().lower() for e in request.headers.get('accept-encoding', '').split(',')}
+    if zstandard is not None and 'zstd' in accepted:
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return ''
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+def encode(request: Request, body: bytes, media_type: str = JSON_MEDIA_TYPE, etag: str = None,
+           cache: dict = None) -> Response:
+    """
+    按 Accept-Encoding 压缩（优先 zstd，其次 gzip）并带上 ETag
+    :param body: 已序列化的响应体
+    :param cache: 同一份 body 的压缩结果缓存 {编码: 字节}，body 不变时重复使用
+    """
+    headers = {'Vary': 'Accept, Accept-Encoding'}
+    encoding = _choose_encoding(request) if len(body) >= MIN_COMPRESS_BYTES else ''
+    if etag:
+        headers['ETag'] = _encoded_etag(etag, encoding)
+    if encoding:
+        if cache is not None and encoding in cache:
+            body = cache[encoding]
+        else:
+            body = compress(body, encoding)
+            if cache is not None:
+                cache[encoding] = body
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,465 @@
+"""
+技术指标：SMA、EMA、MACD、RSI、BOLL、ATR，以及均线交叉信号
+
+两种用法：
+- 批量：对整段数组一次算完，输入可以是一维（单只股票）或二维（交易日数 × 股票数，沿第 0 维计算）
+- 流式：每只股票保存一份滚动状态，追加一根新K线只需 O(1)，状态可序列化为 JSON 落盘，下次接着算
+
+EMA 类指标按通达信的递推公式计算（EMA: Y=(2X+(N-1)Y')/(N+1)，RSI/ATR 的平滑为 SMA(X,N,1): Y=(X+(N-1)Y')/N），
+从第一根K线起即有值，批量与流式的结果一致
+
+NaN（停牌、缺失的K线）在批量和流式中按同一规则处理：
+- 窗口类（SMA、BOLL、均线交叉）：窗口按K线根数计，窗口内有 NaN 时结果为 NaN，直到它移出窗口
+- 递推类（EMA、MACD、RSI、ATR）：跳过 NaN，沿用上一个值；涨跌和真实波幅相对上一根有效K线计算
+"""
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def _frame(values: np.ndarray):
+    return pd.DataFrame(values) if values.ndim == 2 else pd.Series(values)
+
+
+def _ewm(values: np.ndarray, alpha: float) -> np.ndarray:
+    """递推平滑 Y = alpha*X + (1-alpha)*Y'，以第一个有效值为初值，NaN 跳过"""
+    return _frame(values).ewm(alpha=alpha, adjust=False, ignore_na=True).mean().to_numpy()
+
+
+def prefix_sums(values: np.ndarray) -> tuple:
+    """沿时间轴的累加和与有效值个数（首行补 0），同一序列算多个窗口的 sma 时可共用"""
+    valid = ~np.isnan(values)
+    zero = np.zeros((1,) + values.shape[1:])
+    total = np.concatenate([zero, np.cumsum(np.where(valid, values, 0), axis=0)])
+    count = np.concatenate([zero, np.cumsum(valid, axis=0)])
+    return total, count
+
+
+# ---------- 批量 ----------
+
+def sma(values: np.ndarray, window: int = 5, prefix: tuple = None) -> np.ndarray:
+    """
+    简单移动平均，用累加和一次算完所有列
+    :param values: 一维或 (交易日数, 股票数) 的二维数组
+    :param window: 窗口长度，窗口内有 NaN 或不足 window 根时结果为 NaN
+    :param prefix: prefix_sums(values) 的结果，同一序列算多个窗口时传入以免重复累加
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(values.shape, np.nan)
+    if window > len(values):
+        return out
+    total, count = prefix or prefix_sums(values)
+    full = count[window:] - count[:-window] == window
+    out[window - 1:] = np.where(full, (total[window:] - total[:-window]) / window, np.nan)
+    return out
+
+
+def ema(values: np.ndarray, window: int) -> np.ndarray:
+    """指数移动平均，平滑系数 2/(window+1)"""
+    return _ewm(np.asarray(values, dtype=np.float64), 2 / (window + 1))
+
+
+def macd(close: np.ndarray, fast: int = 12, slow: int = 26, signal: int = 9) -> tuple:
+    """
+    :return: (DIF, DEA, MACD柱)，MACD柱 = 2 × (DIF - DEA)
+    """
+    close = np.asarray(close, dtype=np.float64)
+    dif = ema(close, fast) - ema(close, slow)
+    # NaN 的K线上 DIF 沿用上一个值，但不能再喂给 DEA 一次
+    dea = ema(np.where(np.isnan(close), np.nan, dif), signal)
+    return dif, dea, 2 * (dif - dea)
+
+
+def _prev_valid(close: np.ndarray) -> np.ndarray:
+    """每根K线之前最近一根有效K线的收盘价，与流式计算中保存的 prev 一致"""
+    return _frame(close).ffill().shift(1).to_numpy()
+
+
+def _change(close: np.ndarray) -> np.ndarray:
+    """相对上一根有效K线的涨跌，本身为 NaN 或之前没有有效K线时为 NaN"""
+    return close - _prev_valid(close)
+
+
+def rsi(close: np.ndarray, window: int = 14) -> np.ndarray:
+    """相对强弱指标（0~100），涨跌幅度分别按 SMA(X,N,1) 平滑，第一根K线没有涨跌，结果为 NaN"""
+    change = _change(np.asarray(close, dtype=np.float64))
+    up = _ewm(np.where(change > 0, change, np.where(np.isnan(change), np.nan, 0)), 1 / window)
+    move = _ewm(np.abs(change), 1 / window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(move > 0, up / move * 100, np.nan)
+
+
+def bollinger(close: np.ndarray, window: int = 20, k: float = 2) -> tuple:
+    """
+    布林带，标准差为样本标准差（除以 window-1）
+    :return: (中轨, 上轨, 下轨)
+    """
+    close = np.asarray(close, dtype=np.float64)
+    mid = sma(close, window)
+    # 减去每列的均值后再累加平方和，避免价格较高（如后复权）时大数相减丢失精度
+    valid = ~np.isnan(close)
+    centered = close - np.where(valid, close, 0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    total, count = prefix_sums(centered)
+    squares, _ = prefix_sums(centered ** 2)
+    std = np.full(close.shape, np.nan)
+    if 1 < window <= len(close):
+        s1 = total[window:] - total[:-window]
+        s2 = squares[window:] - squares[:-window]
+        var = np.maximum((s2 - s1 ** 2 / window) / (window - 1), 0)
+        std[window - 1:] = np.where(count[window:] - count[:-window] == window, np.sqrt(var), np.nan)
+    return mid, mid + k * std, mid - k * std
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray) -> np.ndarray:
+    """
+    真实波幅 max(最高-最低, |最高-昨收|, |最低-昨收|)，第一根为 最高-最低
+    昨收取上一根有效K线的收盘价，收盘价为 NaN 的K线结果为 NaN
+    """
+    high, low, close = (np.asarray(a, dtype=np.float64) for a in (high, low, close))
+    prev = _prev_valid(close)
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev), np.abs(low - prev)))
+    return np.where(np.isnan(close), np.nan, tr)
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, window: int = 14) -> np.ndarray:
+    """平均真实波幅，真实波幅按 SMA(X,N,1) 平滑"""
+    return _ewm(true_range(high, low, close), 1 / window)
+
+
+def ma_cross(close: np.ndarray, fast: int = 5, slow: int = 10) -> np.ndarray:
+    """
+    均线交叉信号，与 backtest.backtest 的口径一致
+    :return: 1 为快线上穿慢线（买入），-1 为下穿（卖出），其余为 0
+    """
+    close = np.asarray(close, dtype=np.float64)
+    prefix = prefix_sums(close)
+    diff = sma(close, fast, prefix) - sma(close, slow, prefix)
+    prev = np.full(diff.shape, np.nan)
+    prev[1:] = diff[:-1]
+    with np.errstate(invalid='ignore'):
+        return np.where((prev < 0) & (diff > 0), 1, np.where((prev > 0) & (diff < 0), -1, 0))
+
+
+# ---------- 流式 ----------
+
+class Indicator:
+    """
+    流式指标的基类，每个实例对应一只股票的一条指标
+    update(bar) 喂入一根新K线（含 close，ATR 还需要 high/low 的 dict 或结构化数组的一行），返回最新值
+    滚动状态全部保存在实例属性里，state() 可直接 json 序列化，from_state 还原
+    """
+    name = ''
+    # 输出列名，多列输出时 update 返回同顺序的元组
+    outputs = []
+
+    def update(self, bar):
+        raise NotImplementedError
+
+    def update_many(self, bars) -> list:
+        """依次喂入多根K线（如由历史K线预热），返回每根对应的值"""
+        return [self.update(bar) for bar in bars]
+
+    def state(self) -> dict:
+        return {'name': self.name,
+                **{k: v.state() if isinstance(v, Indicator) else v for k, v in vars(self).items()}}
+
+    @staticmethod
+    def from_state(state: dict) -> 'Indicator':
+        obj = object.__new__(INDICATORS[state['name']])
+        for k, v in state.items():
+            if k != 'name':
+                setattr(obj, k, Indicator.from_state(v) if isinstance(v, dict) and 'name' in v else v)
+        return obj
+
+
+def _value(bar, field: str = 'close') -> float:
+    value = bar if isinstance(bar, (int, float)) else bar[field]
+    return float(value)
+
+
+def _finite(value) -> float:
+    """窗口和中 NaN 和空位按 0 计"""
+    return 0.0 if value is None or math.isnan(value) else value
+
+
+class SMA(Indicator):
+    """
+    滑动窗口用环形缓冲保存最近 window 个值，维护窗口和；每 window 次更新重新求和一次，消除累积误差
+    NaN 也进入窗口并计数，窗口内有 NaN 时结果为 NaN，与批量的 sma 一致
+    """
+    name = 'sma'
+    outputs = ['sma']
+    nans = 0  # 窗口内 NaN 的个数；类属性作默认值，兼容没有该字段的旧状态
+
+    def __init__(self, window: int = 5):
+        self.window = window
+        self.buffer = [0.0] * window
+        self.pos = 0
+        self.count = 0
+        self.total = 0.0
+
+    def _push(self, value: float) -> float:
+        """写入环形缓冲，返回被挤出的旧值（窗口未满时为 None）"""
+        old = self.buffer[self.pos] if self.count == self.window else None
+        self.buffer[self.pos] = value
+        self.pos = (self.pos + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        self.nans += math.isnan(value) - (old is not None and math.isnan(old))
+        return old
+
+    def update(self, bar):
+        value = _value(bar)
+        old = self._push(value)
+        self.total += _finite(value) - _finite(old)
+        if self.pos == 0:
+            self.total = math.fsum(v for v in self.buffer[:self.count] if not math.isnan(v))
+        return self.value()
+
+    def value(self) -> float:
+        return self.total / self.window if self.count == self.window and not self.nans else math.nan
+
+
+class EMA(Indicator):
+    name = 'ema'
+    outputs = ['ema']
+
+    def __init__(self, window: int = 12, alpha: float = None):
+        self.window = window
+        self.alpha = alpha if alpha is not None else 2 / (window + 1)
+        self.last = None
+
+    def update(self, bar):
+        value = _value(bar)
+        if math.isnan(value):
+            return self.value()
+        self.last = value if self.last is None else self.alpha * value + (1 - self.alpha) * self.last
+        return self.last
+
+    def value(self) -> float:
+        return math.nan if self.last is None else self.last
+
+
+class MACD(Indicator):
+    name = 'macd'
+    outputs = ['dif', 'dea', 'macd']
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = EMA(fast)
+        self.slow = EMA(slow)
+        self.signal = EMA(signal)
+
+    def update(self, bar):
+        value = _value(bar)
+        if math.isnan(value):
+            return self.value()
+        dif = self.fast.update(value) - self.slow.update(value)
+        dea = self.signal.update(dif)
+        return dif, dea, 2 * (dif - dea)
+
+    def value(self) -> tuple:
+        dif = self.fast.value() - self.slow.value()
+        dea = self.signal.value()
+        return dif, dea, 2 * (dif - dea)
+
+
+class RSI(Indicator):
+    name = 'rsi'
+    outputs = ['rsi']
+
+    def __init__(self, window: int = 14):
+        self.window = window
+        self.prev = None
+        self.up = EMA(window, alpha=1 / window)
+        self.move = EMA(window, alpha=1 / window)
+
+    def update(self, bar):
+        value = _value(bar)
+        if math.isnan(value):
+            return self.value()
+        if self.prev is not None:
+            change = value - self.prev
+            self.up.update(max(change, 0.0))
+            self.move.update(abs(change))
+        self.prev = value
+        return self.value()
+
+    def value(self) -> float:
+        move = self.move.value()
+        return self.up.value() / move * 100 if move > 0 else math.nan
+
+
+class Bollinger(Indicator):
+    """
+    窗口均值和离差平方和随进出窗口的值滑动更新，每 window 次更新由缓冲区重算一次
+    窗口内有 NaN 时结果为 NaN，暂停增量更新，NaN 移出窗口后由缓冲区重算
+    """
+    name = 'boll'
+    outputs = ['mid', 'upper', 'lower']
+    dirty = False  # 窗口内出现过 NaN，均值和离差平方和需要重算
+
+    def __init__(self, window: int = 20, k: float = 2):
+        self.k = k
+        self.ring = SMA(window)
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, bar):
+        value = _value(bar)
+        w = self.ring
+        old = w._push(value)
+        if w.nans:
+            self.dirty = True
+            return self.value()
+        if self.dirty:
+            self.dirty = False
+            self._recompute()
+        elif old is None:
+            # 窗口未满：Welford 增量
+            delta = value - self.mean
+            self.mean += delta / w.count
+            self.m2 += delta * (value - self.mean)
+        else:
+            # 窗口已满：一进一出
+            mean = self.mean + (value - old) / w.window
+            self.m2 += (value - old) * (value - mean + old - self.mean)
+            self.mean = mean
+        if w.pos == 0:
+            self._recompute()
+        w.total = self.mean * w.count
+        return self.value()
+
+    def _recompute(self):
+        values = self.ring.buffer[:self.ring.count]
+        self.mean = math.fsum(values) / len(values)
+        self.m2 = math.fsum((v - self.mean) ** 2 for v in values)
+
+    def value(self) -> tuple:
+        w = self.ring
+        if w.count < w.window or w.window < 2 or w.nans:
+            return math.nan, math.nan, math.nan
+        std = math.sqrt(max(self.m2, 0.0) / (w.window - 1))
+        return self.mean, self.mean + self.k * std, self.mean - self.k * std
+
+
+class ATR(Indicator):
+    name = 'atr'
+    outputs = ['atr']
+
+    def __init__(self, window: int = 14):
+        self.window = window
+        self.prev = None
+        self.smooth = EMA(window, alpha=1 / window)
+
+    def update(self, bar):
+        high, low, close = _value(bar, 'high'), _value(bar, 'low'), _value(bar, 'close')
+        if math.isnan(close):
+            return self.value()
+        tr = high - low
+        if self.prev is not None:
+            tr = max(tr, abs(high - self.prev), abs(low - self.prev))
+        self.prev = close
+        return self.smooth.update(tr)
+
+    def value(self) -> float:
+        return self.smooth.value()
+
+
+class MACross(Indicator):
+    name = 'cross'
+    outputs = ['signal']
+
+    def __init__(self, fast: int = 5, slow: int = 10):
+        self.fast = SMA(fast)
+        self.slow = SMA(slow)
+        self.prev = None
+
+    def update(self, bar):
+        # NaN 也喂给两条均线，窗口内有 NaN 时差值为 NaN，不产生信号
+        value = _value(bar)
+        diff = self.fast.update(value) - self.slow.update(value)
+        prev, self.prev = self.prev, None if math.isnan(diff) else diff
+        if prev is None or self.prev is None:
+            return 0
+        return 1 if prev < 0 < diff else -1 if prev > 0 > diff else 0
+
+
+INDICATORS = {cls.name: cls for cls in [SMA, EMA, MACD, RSI, Bollinger, ATR, MACross]}
+# 接口中可用的别名
+ALIASES = {'ma': 'sma', 'bollinger': 'boll'}
+# 周期类参数，必须不小于 1
+PERIOD_PARAMS = ['window', 'fast', 'slow', 'signal']
+
+
+def compute(name: str, bars, **params) -> dict:
+    """
+    批量计算一条指标
+    :param name: sma/ema/macd/rsi/boll/atr/cross，或 ALIASES 中的别名
+    :param bars: 含 close（atr 还需要 high、low）列的结构化数组或 DataFrame
+    :param params: 指标参数，如 window=20、fast=12
+    :return: 输出列名 → 数组
+    """
+    name = ALIASES.get(name, name)
+    if name not in INDICATORS:
+        raise ValueError(f"未知指标: {name}，可选 {list(INDICATORS)}")
+    for param in PERIOD_PARAMS:
+        if param in params and not params[param] >= 1:
+            raise ValueError(f"参数 {param} 必须为不小于 1 的整数，收到 {params[param]}")
+    close = np.asarray(bars['close'], dtype=np.float64)
+    if name == 'sma':
+        values = sma(close, **params)
+    elif name == 'ema':
+        values = ema(close, **params)
+    elif name == 'macd':
+        values = macd(close, **params)
+    elif name == 'rsi':
+        values = rsi(close, **params)
+    elif name == 'boll':
+        values = bollinger(close, **params)
+    elif name == 'cross':
+        values = ma_cross(close, **params)
+    else:
+        values = atr(bars['high'], bars['low'], close, **params)
+    if not isinstance(values, tuple):
+        values = (values,)
+    return dict(zip(INDICATORS[name].outputs, values))
+
+
+class IndicatorStates:
+    """
+    多只股票的流式指标状态：{股票代码: {指标键: Indicator}}，整体存成一个 JSON 文件
+    指标键由调用方决定，如 "macd_12_26_9"
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: 状态文件路径，存在时载入
+        """
+        self.path = path
+        self.states = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.states = {code: {key: Indicator.from_state(s) for key, s in items.items()}
+                               for code, items in json.load(f).items()}
+
+    def get(self, stock_code: str, key: str, name: str = None, **params) -> Indicator:
+        """取一条指标的状态，不存在时按 name 和 params 新建"""
+        items = self.states.setdefault(stock_code, {})
+        if key not in items:
+            items[key] = INDICATORS[name or key](**params)
+        return items[key]
+
+    def update(self, stock_code: str, bar) -> dict:
+        """把一根新K线喂给该股票的全部指标，返回 指标键 → 最新值"""
+        return {key: ind.update(bar) for key, ind in self.states.get(stock_code, {}).items()}
+
+    def save(self, path: str = None):
+        path = path or self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({code: {key: ind.state() for key, ind in items.items()}
+                       for code, items in self.states.items()}, f)
+        os.replace(tmp, path)
@@ -0,0 +1,242 @@
+import asyncio
+import datetime
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+
+from encoding import sse_message
+from resample import AFTERNOON_OPEN, MORNING_MINUTES, MORNING_OPEN, resample
+from store import bar_dtype, decode_date, to_records
+
+# 由内存返回的k线类型：1day 为当日的1分钟线，m5 由1分钟线合成
+LIVE_TYPES = ['1day', 'm1', 'm5']
+# 每只股票保留的1分钟K线根数，默认 5 个交易日（每天 241 根，含 09:30 集合竞价）
+LIVE_CAPACITY = int(os.environ.get('FP_LIVE_CAPACITY', 241 * 5))
+# 轮询间隔（秒），宜为 60 的约数
+LIVE_INTERVAL = int(os.environ.get('FP_LIVE_INTERVAL', 5))
+# 每个订阅者积压的消息上限，客户端读得太慢时丢弃新消息，不拖慢轮询
+SUBSCRIBER_QUEUE_SIZE = 1000
+MORNING_CLOSE = MORNING_OPEN + MORNING_MINUTES
+AFTERNOON_CLOSE = 15 * 60
+# 轮询时段（分钟数）：开盘前的集合竞价起，到收盘后 1 分钟止，以取到收盘快照
+LIVE_SESSIONS = [(9 * 60 + 25, MORNING_CLOSE + 1), (AFTERNOON_OPEN, AFTERNOON_CLOSE + 1)]
+
+
+def in_session(now: datetime.datetime = None) -> bool:
+    """是否在轮询时段内（工作日；节假日的快照时间不前进，轮询到也不会产生新K线）"""
+    now = now or datetime.datetime.now()
+    minutes = now.hour * 60 + now.minute
+    return now.weekday() < 5 and any(lo <= minutes <= hi for lo, hi in LIVE_SESSIONS)
+
+
+def minute_label(ts: int) -> int:
+    """
+    行情时间 yyyyMMddHHmmss → 所属1分钟K线的日期 yyyyMMddHHmm，以结束时刻标记，与分钟K线接口一致
+    开盘前的集合竞价归入 09:30，午间休市归入 11:30，收盘后归入 15:00
+    """
+    day, hhmmss = divmod(int(ts), 1000000)
+    minutes = hhmmss // 10000 * 60 + hhmmss // 100 % 100 + 1
+    if minutes <= MORNING_OPEN:
+        minutes = MORNING_OPEN
+    elif MORNING_CLOSE < minutes <= AFTERNOON_OPEN:
+        minutes = MORNING_CLOSE
+    elif minutes > AFTERNOON_CLOSE:
+        minutes = AFTERNOON_CLOSE
+    return day * 10000 + minutes // 60 * 100 + minutes % 60
+
+
+class BarRing:
+    """一只股票最近 capacity 根1分钟K线的环形缓冲区，写满后覆盖最旧的一根"""
+
+    def __init__(self, capacity: int = LIVE_CAPACITY):
+        self.bars = np.zeros(capacity, dtype=bar_dtype('m1'))
+        self.count = 0  # 累计写入的根数，最新一根在 (count - 1) % capacity
+
+    def __len__(self) -> int:
+        return min(self.count, len(self.bars))
+
+    @property
+    def last(self) -> int:
+        """最新一根的下标"""
+        return (self.count - 1) % len(self.bars)
+
+    def append(self, bar):
+        self.bars[self.count % len(self.bars)] = bar
+        self.count += 1
+
+    def extend(self, arr: np.ndarray):
+        for bar in arr[-len(self.bars):]:
+            self.append(bar)
+
+    def to_array(self) -> np.ndarray:
+        """按时间升序复制出来"""
+        return self.bars[np.arange(self.count - len(self), self.count) % len(self.bars)]
+
+
+class LiveBars:
+    """
+    盘中实时K线：交易时段内定时批量拉取关注列表的行情快照，聚合成1分钟K线存入各股票的环形缓冲区
+    每只股票首次轮询时用分钟K线接口载入最近的1分钟线，之后只靠批量快照更新，上游请求数与客户端数量无关
+    1day / m1 / m5 直接由内存返回；K线的变化推送给 subscribe 的订阅者
+    """
+
+    def __init__(self, fetcher, watchlist=(), capacity: int = LIVE_CAPACITY):
+        """
+        :param fetcher: DataFetcher，提供 get_quotes 和 _get_minute_kline
+        :param watchlist: 关注的股票代码
+        :param capacity: 每只股票保留的1分钟K线根数
+        """
+        self.fetcher = fetcher
+        self.capacity = capacity
+        self.watchlist = {}  # 有序的集合
+        self.rings = {}
+        # 每只股票上一次快照的 [日期 yyyyMMdd, 当日累计成交量, 时间 yyyyMMddHHmmss]，成交量按差值计入当前K线
+        self._quotes = {}
+        self.versions = {}  # 每次K线变化加一，用作 ETag
+        self._subscribers = {}  # 队列 → (事件循环, 关注的股票代码)
+        self._lock = threading.Lock()
+        self.watch(watchlist)
+
+    def watch(self, codes):
+        for code in codes:
+            if code and code.strip():
+                self.watchlist[code.strip()] = None
+
+    def _seed(self, code: str):
+        """载入最近的1分钟线，当日已有的成交量作为累计成交量的起点"""
+        arr = to_records(self.fetcher._get_minute_kline(code, 'm1', length=min(self.capacity, 800)), 'm1')
+        ring = BarRing(self.capacity)
+        ring.extend(arr)
+        day = int(arr['date'][-1] // 10000) if len(arr) else 0
+        volume = int(arr['volume'][arr['date'] // 10000 == day].sum()) if len(arr) else 0
+        with self._lock:
+            self.rings[code] = ring
+            self._quotes[code] = [day, volume, 0]
+            self.versions[code] = self.versions.get(code, 0) + 1
+
+    def on_quote(self, code: str, ts: int, price: float, volume: int) -> list:
+        """
+        一条快照并入当前1分钟K线，调用方持有 self._lock
+        :return: 变化的K线 [(K线, 是否已结束)]：跨入新的一分钟时先返回结束的上一根，再返回新的一根
+        """
+        ring, state = self.rings[code], self._quotes[code]
+        if ts <= state[2]:  # 快照没有更新（停牌、休市或节假日）
+            return []
+        day, label = ts // 1000000, minute_label(ts)
+        delta = max(volume - (state[1] if state[0] == day else 0), 0)
+        state[:] = [day, volume, ts]
+        bars, i = ring.bars, ring.last
+        if ring.count and bars['date'][i] == label:
+            bars['high'][i] = max(bars['high'][i], price)
+            bars['low'][i] = min(bars['low'][i], price)
+            bars['close'][i] = price
+            bars['volume'][i] += delta
+            changed = [(bars[i].copy(), False)]
+        elif not ring.count or label > bars['date'][i]:
+            changed = [(bars[i].copy(), True)] if ring.count else []
+            ring.append((label, price, price, price, price, delta))
+            changed.append((bars[ring.last].copy(), False))
+        else:  # 晚到的旧快照，成交量已计入
+            return []
+        self.versions[code] += 1
+        return changed
+
+    def poll(self) -> int:
+        """
+        拉取一轮行情：新加入的股票先载入最近的1分钟线，再批量拉取全部关注股票的快照
+        :return: 有K线变化的股票数
+        """
+        for code in [c for c in self.watchlist if c not in self.rings]:
+            try:
+                self._seed(code)
+            except Exception as e:
+                print(f'载入 {code} 的1分钟线失败: {e}')
+        quotes = self.fetcher.get_quotes([c for c in self.watchlist if c in self.rings])
+        messages = []
+        with self._lock:
+            for code, ts, price, volume in quotes:
+                if code in self.rings:
+                    messages += [(code, self._message(code, bar, closed))
+                                 for bar, closed in self.on_quote(code, ts, price, volume)]
+        self._publish(messages)
+        return len({code for code, _ in messages})
+
+    def job(self):
+        """调度器任务：交易时段内轮询，出错只打印，下一轮重试"""
+        if not self.watchlist or not in_session():
+            return
+        try:
+            self.poll()
+        except Exception as e:
+            print(f'实时行情轮询失败: {e}')
+
+    # ---------- 读取 ----------
+
+    def records(self, code: str, type: str) -> Optional[np.ndarray]:
+        """
+        内存中的K线（结构化数组，日期为 yyyyMMddHHmm）；不在关注列表或尚未载入时返回 None
+        :param type: 1day（最新一个交易日的1分钟线）、m1 或 m5
+        """
+        with self._lock:
+            ring = self.rings.get(code)
+            if ring is None or not len(ring):
+                return None
+            arr = ring.to_array()
+        if type == 'm5':
+            return resample(arr, 'm5')
+        if type == '1day':
+            days = arr['date'] // 10000
+            return arr[days == days[-1]]
+        return arr
+
+    def version(self, code: str) -> int:
+        return self.versions.get(code, 0)
+
+    # ---------- 推送 ----------
+
+    @staticmethod
+    def _message(code: str, bar, closed: bool) -> bytes:
+        return sse_message('bar', {
+            "stock_code": code,
+            "date": decode_date(bar['date'], 'm1'),
+            **{c: bar[c].item() for c in ['open', 'close', 'high', 'low', 'volume']},
+            "closed": closed,
+        })
+
+    def subscribe(self, codes) -> asyncio.Queue:
+        """
+        在事件循环内调用，返回接收 SSE 消息（字节）的队列；不再需要时调用 unsubscribe
+        :param codes: 关注的股票代码
+        """
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[queue] = (asyncio.get_running_loop(), set(codes))
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def _publish(self, messages: list):
+        """从轮询线程投递到各订阅者所在的事件循环"""
+        if not messages:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers.items())
+        for queue, (loop, codes) in subscribers:
+            batch = [m for code, m in messages if code in codes]
+            if batch:
+                try:
+                    loop.call_soon_threadsafe(_offer, queue, batch)
+                except RuntimeError:  # 事件循环已关闭
+                    pass
+
+
+def _offer(queue: asyncio.Queue, batch: list):
+    for message in batch:
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return
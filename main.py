@@ -1,69 +1,262 @@
+import asyncio
+import os
+import threading
+from collections import deque
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
 
-from data_fetcher import DataFetcher
+import numpy as np
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from async_fetcher import AsyncDataFetcher
+from data_fetcher import DataFetcher, normalize_adjust
+from encoding import ARROW_EOS, ARROW_MEDIA_TYPE, EVENT_STREAM_MEDIA_TYPE, NDJSON_MEDIA_TYPE, arrow_bar_columns, \
+    arrow_bar_schema, arrow_batch_message, arrow_bytes, arrow_schema_message, bar_columns, bar_rows, body_etag, dumps, \
+    encode, make_etag, ndjson_line, not_modified, wants_arrow
 from pydantic import BaseModel
-from data_reader import read_stock_history
+from data_reader import bar_cache, calendar, data_version, factors, has_history, indicator_cache, panel, read_indicator, \
+    read_stock_records, read_stock_window, rollups, store
+from live import LIVE_INTERVAL, LIVE_TYPES, LiveBars
+from resample import RESAMPLE_BASE
+from singleflight import SingleFlight
+from store import FACTOR_TYPES, adjust_type, decode_dates, window as date_window
+from trading_calendar import to_int
+from ts import ts_get_adj_factor_history
 
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
 import pytz
 
-fetcher = DataFetcher()
+# 与 data_reader 共用存储，写入时缓存随之失效；启动时只读本地缓存，联网刷新放到后台预热
+fetcher = DataFetcher(store=store, factors=factors, rollups=rollups, lazy=True)
+# 路由内的缓存未命中走异步下载，不占用线程池；与预热、定时更新共用各域名的令牌桶
+afetcher = AsyncDataFetcher(rate_limiters=fetcher.rate_limiters)
+history_flight = SingleFlight()
+# /api/all-list 的预序列化结果，股票列表对象被替换（每日更新、预热）后重新生成
+_all_list = {'source': None, 'body': None, 'etag': None, 'compressed': {}, 'index': {}}
+_all_list_lock = threading.Lock()
+HISTORY_TYPES = ['day', 'week', 'month', 'year']
+# 批量K线接口同时在读的股票数，限制在途数据量，内存占用与请求的股票数无关
+BATCH_PREFETCH = int(os.environ.get('FP_BATCH_PREFETCH', 8))
 scheduler = BackgroundScheduler(timezone=pytz.timezone('Asia/Shanghai'))  # 设置为中国时区
-# 添加定时任务：每天 16:00 执行
-scheduler.add_job(
-    fetcher.update_all_data,
-    'cron',
-    hour=16,
-    minute=0,
-    id='update_stock_data_daily',
-    replace_existing=True,
-    name='每日16:00更新股票数据'
-)
+# 添加定时任务：每天 16:00 执行；每日更新改由独立进程（python pipeline.py --daemon）运行时设 FP_UPDATE_IN_API=0
+if os.environ.get('FP_UPDATE_IN_API', '1') != '0':
+    scheduler.add_job(
+        fetcher.update_all_data,
+        'cron',
+        hour=16,
+        minute=0,
+        id='update_stock_data_daily',
+        replace_existing=True,
+        name='每日16:00更新股票数据'
+    )
+
+
+# 盘中实时K线：FP_LIVE_WATCHLIST 为逗号分隔的股票代码，交易时段内每 FP_LIVE_INTERVAL 秒批量拉取一次
+live = LiveBars(fetcher, os.environ.get('FP_LIVE_WATCHLIST', '').split(','))
+# 没有客户端推送消息时，每隔该秒数发送一条注释，防止代理断开空闲连接
+SSE_KEEPALIVE = 15
+if live.watchlist:
+    scheduler.add_job(
+        live.job,
+        CronTrigger(day_of_week='mon-fri', hour='9-11,13-15', second=f'*/{LIVE_INTERVAL}'),
+        id='poll_live_bars',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+        name='交易时段轮询实时行情'
+    )
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动事件
+    threading.Thread(target=fetcher.warmup, daemon=True, name='warmup').start()
     scheduler.start()
     print("⏰ 定时任务调度器已启动")
     yield
     # 关闭事件
     scheduler.shutdown()
+    await afetcher.aclose()
     print("⏰ 定时任务调度器已关闭")
 
 
 app = FastAPI(lifespan=lifespan)
 
 
+async def download_history(stock_code: str, type: str = "day", adjust: str = "qfq"):
+    """
+    本地没有数据时下载全部历史并落盘
+    同一 (股票代码, k线类型, 复权方式, 区间) 的并发请求只触发一次上游下载和一次写盘，区间固定为全量
+    日线只下载不复权K线和复权因子，任意复权方式都由它们计算，因此不同复权方式共用一次下载；周/月/年只下载日线
+    """
+    if RESAMPLE_BASE.get(type) == 'day':
+        type = 'day'  # 周/月/年由日线合成
+    if type in FACTOR_TYPES:
+        adjust = ''
+
+    async def fetch():
+        if has_history(stock_code, type, adjust):  # 排队期间已被前一次下载落盘
+            return
+        if type in FACTOR_TYPES:
+            _df, factor_df = await asyncio.gather(afetcher.get_history(stock_code, type, adjust=''),
+                                                  asyncio.to_thread(ts_get_adj_factor_history, stock_code))
+            if _df.empty:
+                return
+        else:
+            _df, factor_df = await afetcher.get_history(stock_code, type, adjust=adjust), None
+        # 写盘和周/月/年重算放到线程池，不阻塞事件循环上的其他请求
+        await asyncio.to_thread(write, _df, factor_df)
+
+    def write(_df, factor_df):
+        if factor_df is not None:
+            factors.write(stock_code, factor_df)  # 先写因子，读取方看到不复权文件时因子已就绪
+        store.write(stock_code, adjust_type(type, adjust), _df, adjust)
+        if type in FACTOR_TYPES:
+            rollups.rebuild(stock_code)
+
+    await history_flight.do((stock_code, type, adjust, ('', '')), fetch)
+
+
+def check_range(start: str, end: str):
+    """
+    校验日期区间参数：格式错误、起止颠倒，或区间落在交易日历内却没有交易日时抛出 ValueError
+    晚于日历最后一天的区间不判断（日历可能比行情晚更新）
+    """
+    lo = to_int(start) if start else None
+    hi = to_int(end) if end else None
+    if lo and hi:
+        if lo > hi:
+            raise ValueError(f"开始日期 {start} 晚于结束日期 {end}")
+        calendar.refresh()
+        if calendar and hi <= to_int(calendar.last) and calendar.sessions_between(lo, hi) == 0:
+            raise ValueError(f"{start} 至 {end} 之间没有交易日")
+
+
 @app.get("/")
-def read_root():
+async def read_root():
     return {"Hello": "Quant World!"}
 
 
+@app.get("/api/ready")
+async def get_ready():
+    return {
+        "ready": fetcher.ready,
+        "stages": fetcher.warmup_status
+    }
+
+
+def _all_list_cache() -> dict:
+    """股票列表对象被替换后重新序列化整表，并按股票代码建索引供筛选分页使用"""
+    stock_list = fetcher.stock_list
+    # 在线程池中调用，加锁保证同一张表只序列化一次，返回的快照中 body、etag、index 互相一致
+    with _all_list_lock:
+        if _all_list['body'] is None or _all_list['source'] is not stock_list:
+            records = [] if stock_list is None else \
+                stock_list.astype(object).where(stock_list.notna(), None).to_dict("records")  # NaN → null
+            body = dumps({"data": records})
+            index = {} if stock_list is None else {r['股票代码']: r for r in records}
+            _all_list.update(source=stock_list, body=body, etag=body_etag(body), compressed={}, index=index)
+        return dict(_all_list)
+
+
 @app.get("/api/all-list")
-def get_all_list():
+async def get_all_list(request: Request, exchange: str = "", status: str = "", lagging: bool = False,
+                       offset: int = 0, limit: int = None):
+    """
+    全市场股票列表；不带参数时返回整表（预序列化的缓存字节）
+    :param exchange: 逗号分隔的交易所，如 sh,sz
+    :param status: 逗号分隔的状态，如 Active
+    :param lagging: 只返回最新K线日期落后于交易日历的股票
+    :param offset: 分页起点，按股票代码排序
+    :param limit: 每页条数，不给时不分页
+    """
+    if offset < 0 or (limit is not None and limit < 0):
+        return {
+            "error": "offset 和 limit 不能为负数"
+        }
+
+    def respond():
+        cache = _all_list_cache()
+        if not (exchange or status or lagging or offset or limit is not None):
+            return not_modified(request, cache['etag']) or \
+                encode(request, cache['body'], etag=cache['etag'], cache=cache['compressed'])
+        # 筛选由元数据表的索引完成；总数和分页只算股票列表里有的代码，与 data 是同一个集合
+        metadata = fetcher.metadata
+        if lagging:
+            calendar.refresh()
+        lag_before = calendar.last if lagging else None
+        etag = make_etag('all-list', cache['etag'], metadata.version(), exchange, status, lag_before, offset, limit)
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+        index = cache['index']
+        codes = [c for c in metadata.codes(exchange, status, lag_before) if c in index]
+        page = codes[offset:] if limit is None else codes[offset:offset + limit]
+        body = dumps({
+            "total": len(codes),
+            "offset": offset,
+            "data": [index[c] for c in page]
+        })
+        return encode(request, body, etag=etag)
+
+    # SQLite 查询、序列化和压缩都在线程池中完成，不阻塞事件循环
+    return await asyncio.to_thread(respond)
+
+
+@app.get("/api/cache")
+async def get_cache_stats():
     return {
-        "data": fetcher.stock_list.to_dict("records")
+        **bar_cache.stats(),
+        "indicators": indicator_cache.stats(),
+        "singleflight": history_flight.stats()
     }
 
 
+def bars_response(request: Request, meta: dict, arr: np.ndarray, type: str, orient: str, arrow: bool,
+                  etag: str):
+    """
+    K线响应：默认为由 NumPy 数组直接序列化的列式 JSON，orient=rows 为旧的按行格式，arrow 为 Arrow IPC 流
+    :param meta: 附加字段，JSON 中与 data 并列，Arrow 中写入 schema 元数据
+    """
+    if arrow:
+        return encode(request, arrow_bytes(arrow_bar_columns(arr, type), meta), ARROW_MEDIA_TYPE, etag)
+    data = bar_rows(arr, type) if orient == 'rows' else bar_columns(arr, type)
+    return encode(request, dumps({**meta, "data": data}), etag=etag)
+
+
 @app.get("/api/kline")
-def get_kline(stock_code: str, type: str = "day"):
+async def get_kline(request: Request, stock_code: str, type: str = "day", orient: str = "columns",
+                    format: str = ""):
+    """
+    :param orient: columns（默认，列式 {"date": [...], "open": [...], ...}）或 rows（旧格式，按行的二维数组）
+    :param format: json（默认）或 arrow（Arrow IPC 流，需安装 pyarrow），未指定时也可通过 Accept 头协商
+    """
     try:
-        _df = read_stock_history(stock_code, type)
-        if _df.empty:
-            _df = fetcher.get_history(stock_code, type)
+        arrow = wants_arrow(request, format)
+        if type in LIVE_TYPES and stock_code in live.watchlist:
+            # 关注列表中的股票由内存中的实时K线返回，不访问上游
+            arr = live.records(stock_code, type)
+            if arr is not None:
+                etag = make_etag('live', stock_code, type, orient, arrow, live.version(stock_code))
+                return not_modified(request, etag) or \
+                    bars_response(request, {"stock_code": stock_code}, arr, 'm1' if type == '1day' else type, orient,
+                                  arrow, etag)
+        if not has_history(stock_code, type) and type in HISTORY_TYPES:
+            await download_history(stock_code, type)
+        # 数据版本只 stat 文件，客户端缓存仍有效时不读取也不序列化
+        etag = make_etag('kline', stock_code, type, orient, arrow, data_version(stock_code, type))
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+        # 读文件（memmap、复权计算）和序列化都在线程池中进行
+        return await asyncio.to_thread(lambda: bars_response(request, {"stock_code": stock_code},
+                                                             read_stock_records(stock_code, type), type, orient,
+                                                             arrow, etag))
     except Exception as e:
         return {
             "error": str(e)
         }
-    print(_df)
-    return {
-        "stock_code": stock_code,
-        "data": _df.values.tolist()
-    }
 
 
 class KlineRequest(BaseModel):
@@ -75,6 +268,8 @@ class KlineRequest(BaseModel):
     :param end: 结束日期    格式：yyyy-MM-dd
     :param length: 数据长度  指数最大2000，个股最大800
     :param adjust: 复权类型 可选、"hfq"、"1"（后复权） "qfq"、"2"（前复权）、"raw"、""、"nfn"、"3"（不复权）
+    :param orient: 返回格式 columns（列式，默认）或 rows（按行）
+    :param format: json（默认）或 arrow
     :return: k线数据
     """
     stock_code: str
@@ -83,6 +278,250 @@ class KlineRequest(BaseModel):
     end: str = ""
     length: int = 800
     adjust: str = "qfq"
+    orient: str = "columns"
+    format: str = ""
+
+
+@app.get("/api/all_history")
+async def get_all_history(request: Request, req: KlineRequest = Depends()):
+    adjust = normalize_adjust(req.adjust)
+    length = max(1, min(req.length, 2000))
+    try:
+        check_range(req.start, req.end)
+        # 本地没有该复权方式的数据时全量下载一次并落盘，之后只做区间读取
+        if not has_history(req.stock_code, req.type, adjust) and req.type in HISTORY_TYPES:
+            await download_history(req.stock_code, req.type, adjust)
+        arrow = wants_arrow(request, req.format)
+        etag = make_etag('all_history', req.stock_code, req.type, adjust, req.start, req.end, length, req.orient,
+                         arrow, data_version(req.stock_code, req.type, adjust))
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        def respond():
+            # 只读取并复权区间内的K线，length=800 的开销与 800 根成正比
+            arr = read_stock_window(req.stock_code, req.type, adjust, req.start, req.end, length)
+            return bars_response(request, {"stock_code": req.stock_code, "adjust": adjust or "raw"}, arr,
+                                 req.type, req.orient, arrow, etag)
+
+        return await asyncio.to_thread(respond)
+    except Exception as e:
+        return {
+            "error": str(e)
+        }
+
+
+def select_codes(codes: str = "", exchange: str = "", status: str = "") -> list:
+    """
+    批量接口的股票范围：给出 codes 时按列表，否则按元数据表筛选
+    :param codes: 逗号分隔的股票代码
+    :param exchange: 逗号分隔的交易所，如 sh,sz
+    :param status: 逗号分隔的状态，如 Active
+    """
+    if codes:
+        return [c.strip() for c in codes.split(',') if c.strip()]
+    if not (exchange or status):
+        return []
+    return fetcher.metadata.codes(exchange, status)
+
+
+async def stream_bars(codes: list, type: str, adjust: str, start: str, end: str, length: int, arrow: bool):
+    """
+    逐只股票读取并编码，按请求顺序输出；同时最多 BATCH_PREFETCH 只在线程池中读取
+    第一只股票编码完成即开始输出，不等全部读完
+    """
+    schema = arrow_bar_schema(type) if arrow else None
+
+    def read(code: str) -> bytes:
+        try:
+            if not has_history(code, type, adjust):
+                raise FileNotFoundError("本地没有数据")
+            # 批量扫描不写入K线缓存，避免一次全市场请求冲掉热点股票
+            arr = read_stock_window(code, type, adjust, start, end, length, cache=False)
+            if arrow:
+                return arrow_batch_message(schema, code, arr, type)
+            return ndjson_line({"stock_code": code, "data": bar_columns(arr, type)})
+        except Exception as e:
+            # 单只股票出错（文件损坏、正在写入等）不中断整个流；Arrow 流没有放错误信息的位置，跳过并记录
+            if arrow:
+                print(f'批量K线跳过 {code}: {e}')
+                return b''
+            return ndjson_line({"stock_code": code, "error": str(e)})
+
+    if arrow:
+        yield arrow_schema_message(schema)
+    pending = deque()
+    codes = iter(codes)
+    try:
+        while True:
+            while len(pending) < BATCH_PREFETCH:
+                code = next(codes, None)
+                if code is None:
+                    break
+                pending.append(asyncio.create_task(asyncio.to_thread(read, code)))
+            if not pending:
+                break
+            chunk = await pending.popleft()
+            if chunk:
+                yield chunk
+    finally:
+        for task in pending:  # 客户端断开时丢弃还没输出的结果
+            task.cancel()
+    if arrow:
+        yield ARROW_EOS
+
+
+@app.get("/api/batch_kline")
+async def get_batch_kline(request: Request, codes: str = "", exchange: str = "", status: str = "",
+                          type: str = "day", adjust: str = "qfq", start: str = "", end: str = "", length: int = 800,
+                          format: str = ""):
+    """
+    多只股票的K线，一只股票一段，边读边流式返回，只读本地数据
+    :param codes: 逗号分隔的股票代码；留空时按 exchange/status 从元数据表筛选
+    :param exchange: 逗号分隔的交易所，如 sh,sz
+    :param status: 逗号分隔的状态，如 Active
+    :param length: 每只股票最多返回条数，上限 2000
+    :param format: ndjson（默认，每行 {"stock_code": ..., "data": {列式K线}}）或 arrow（每只股票一个记录批次）
+    """
+    selected = select_codes(codes, exchange, status)
+    if not selected:
+        return {
+            "error": "请通过 codes 指定股票，或通过 exchange/status 从元数据表筛选"
+        }
+    arrow = wants_arrow(request, format)
+    try:
+        check_range(start, end)
+        chunks = stream_bars(selected, type, normalize_adjust(adjust), start, end, max(1, min(length, 2000)), arrow)
+        first = await anext(chunks) if arrow else None  # 先生成 schema，pyarrow 未安装时在这里报错
+    except Exception as e:
+        return {
+            "error": str(e)
+        }
+
+    async def body():
+        if first is not None:
+            yield first
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type=ARROW_MEDIA_TYPE if arrow else NDJSON_MEDIA_TYPE)
+
+
+@app.get("/api/live/stream")
+async def get_live_stream(codes: str):
+    """
+    实时K线推送（Server-Sent Events）：关注股票的1分钟K线每次变化推送一条 bar 事件
+    data 为 {"stock_code", "date", "open", "close", "high", "low", "volume", "closed"}，closed 表示该分钟已结束
+    :param codes: 逗号分隔的股票代码，须在 FP_LIVE_WATCHLIST 中
+    """
+    selected = [c.strip() for c in codes.split(',') if c.strip()]
+    missing = [c for c in selected if c not in live.watchlist]
+    if not selected or missing:
+        return {
+            "error": f"不在实时关注列表中: {missing}" if missing else "请通过 codes 指定股票"
+        }
+    queue = live.subscribe(selected)
+
+    async def events():
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b': keep-alive\n\n'
+        finally:  # 客户端断开时取消订阅
+            live.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type=EVENT_STREAM_MEDIA_TYPE,
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.get("/api/indicator")
+async def get_indicator(request: Request, stock_code: str, name: str = "ma", type: str = "day", adjust: str = "qfq",
+                        window: int = None, fast: int = None, slow: int = None, signal: int = None,
+                        k: float = None, start: str = "", end: str = "", length: int = 800):
+    """
+    服务端计算的指标序列，结果按 (股票代码, k线类型, 复权方式, 指标, 参数) 缓存，数据更新后自动重算
+    :param name: ma/sma、ema、macd、rsi、boll、atr、cross（均线交叉信号，1 买入、-1 卖出）
+    :param window: 均线/RSI/BOLL/ATR 的周期
+    :param fast: MACD 快线或均线交叉的快线周期
+    :param slow: MACD 慢线或均线交叉的慢线周期
+    :param signal: MACD 的 DEA 周期
+    :param k: BOLL 的标准差倍数
+    :param start: 开始日期 yyyy-MM-dd，指标仍按全部历史计算，只截取返回区间
+    :param length: 最多返回条数，上限 2000
+    """
+    adjust = normalize_adjust(adjust)
+    params = {p: v for p, v in [('window', window), ('fast', fast), ('slow', slow), ('signal', signal), ('k', k)]
+              if v is not None}
+    try:
+        check_range(start, end)
+        if not has_history(stock_code, type, adjust) and type in HISTORY_TYPES:
+            await download_history(stock_code, type, adjust)
+        length = max(1, min(length, 2000))
+        etag = make_etag('indicator', stock_code, type, adjust, name, sorted(params.items()), start, end, length,
+                         data_version(stock_code, type, adjust))
+        cached = not_modified(request, etag)
+        if cached:
+            return cached
+
+        def respond():
+            dates, values = read_indicator(stock_code, type, adjust, name, params)
+            lo, hi = date_window(dates, type, start, end, length)
+            return encode(request, dumps({
+                "stock_code": stock_code,
+                "name": name,
+                "params": params,
+                "adjust": adjust or "raw",
+                "dates": decode_dates(dates[lo:hi], type).tolist(),
+                "data": {column: v[lo:hi] for column, v in values.items()}  # 预热期的 NaN 序列化为 null
+            }), etag=etag)
+
+        # 读文件、计算整段历史的指标（未命中时）、序列化和压缩都在线程池中进行
+        return await asyncio.to_thread(respond)
+    except Exception as e:
+        return {
+            "error": str(e)
+        }
+
+
+@app.get("/api/panel")
+async def get_panel(request: Request, field: str = "close", start: str = "", end: str = "", length: int = 250,
+                    adjust: str = "qfq", symbols: str = ""):
+    """
+    全市场截面：交易日 × 股票的二维数组，由 NumPy 数组经 orjson 直接序列化（NaN 为 null，停牌或未上市）
+    :param field: open、high、low、close、volume
+    :param length: 最多返回的交易日数，上限 2000
+    :param symbols: 逗号分隔的股票代码，默认全部
+    """
+    if not panel.exists():
+        return {
+            "error": "截面矩阵尚未生成，请先运行 python panel.py"
+        }
+    adjust = normalize_adjust(adjust)
+    length = max(1, min(length, 2000))
+    etag = make_etag('panel', field, start, end, length, adjust, symbols, panel.version(field, adjust))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    def respond():
+        dates, codes, values = panel.slice(field, start, end, length, symbols.split(',') if symbols else None, adjust)
+        return encode(request, dumps({
+            "field": field,
+            "adjust": adjust or "raw",
+            "dates": decode_dates(dates, 'day').tolist(),
+            "symbols": codes,
+            "data": values
+        }), etag=etag)
+
+    try:
+        # 读 memmap、复权计算、序列化和压缩都在线程池中进行
+        return await asyncio.to_thread(respond)
+    except Exception as e:
+        return {
+            "error": str(e)
+        }
 
 
 if __name__ == "__main__":
@@ -91,7 +530,7 @@ if __name__ == "__main__":
     # uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=False)
     import requests
 
-    res = requests.get('http://localhost:8000/api/kline?stock_code=sh000001&type=day')
+    res = requests.get('http://localhost:8000/api/kline?stock_code=sh000001&type=day&orient=rows')
     data = res.json().get("data")[-1]
     # data=read_stock_history('sh600001','day')
     for i in data:
@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+METADATA_FILE = 'stock_metadata.db'
+# 旧版的 CSV 元数据表，首次打开时导入
+LEGACY_METADATA_FILE = 'stock_metadata.csv'
+METADATA_COLUMNS = ['stock_code', 'latest_trade_date', 'earliest_trade_date', 'last_sync_time', 'exchange', 'status']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stock_metadata (
+    stock_code TEXT PRIMARY KEY,
+    latest_trade_date TEXT,
+    earliest_trade_date TEXT,
+    last_sync_time TEXT,
+    exchange TEXT,
+    status TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_stock_metadata_status ON stock_metadata (status, latest_trade_date);
+CREATE INDEX IF NOT EXISTS idx_stock_metadata_exchange ON stock_metadata (exchange, status);
+"""
+
+
+def _values(value):
+    """'sh,sz' / ['sh', 'sz'] → ['sh', 'sz']，空值返回空列表"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    return [v.strip() for v in value if v and v.strip()]
+
+
+class MetadataStore:
+    """
+    股票元数据表，存放在 SQLite 文件 {root}/stock_metadata.db
+    stock_code 为主键，status、exchange 上建有索引；日期列为 'yyyy-MM-dd' 字符串，缺失为 NULL
+    每次写入在一个事务内批量完成，并把 user_version 加一作为数据版本
+    """
+
+    def __init__(self, root: str = 'data'):
+        """
+        :param root: 数据根目录
+        """
+        self.root = root
+        self.path = os.path.join(root, METADATA_FILE)
+        os.makedirs(root, exist_ok=True)
+        # 同一连接在 API 线程池、定时任务线程间共用，由锁串行化
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        # WAL 模式下独立的更新进程写入时，API 进程的读取不被阻塞
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """表为空且有旧版 CSV 时导入；CSV 保留不删"""
+        legacy = os.path.join(self.root, LEGACY_METADATA_FILE)
+        if not os.path.exists(legacy) or self.count():
+            return
+        meta = pd.read_csv(legacy, dtype=str)
+        if not meta.empty:
+            self.upsert(meta)
+            print(f'元数据表已从 {legacy} 导入 {len(meta)} 条')
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 先拿写锁，成功提交时数据版本加一，出错回滚"""
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                yield cur
+                version = cur.execute('PRAGMA user_version').fetchone()[0]
+                cur.execute(f'PRAGMA user_version = {version + 1}')
+                cur.execute('COMMIT')
+            except BaseException:
+                cur.execute('ROLLBACK')
+                raise
+
+    def _query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def version(self) -> int:
+        """数据版本，每次写入加一；其他进程写入后同样可见"""
+        return self._query('PRAGMA user_version')[0][0]
+
+    # ---------- 写入 ----------
+
+    @staticmethod
+    def _records(meta: pd.DataFrame, columns: list):
+        """逐行的参数元组，NaN/NaT 写为 NULL"""
+        values = meta[columns].astype(object)
+        return values.where(values.notna(), None).itertuples(index=False, name=None)
+
+    def upsert(self, meta: pd.DataFrame) -> int:
+        """
+        批量插入或更新，一个事务内完成
+        :param meta: 含 stock_code 的元数据，只更新其中出现的列
+        :return: 写入的行数
+        """
+        columns = [c for c in METADATA_COLUMNS if c in meta.columns]
+        with self._transaction() as cur:
+            cur.executemany(self._upsert_sql(columns), self._records(meta, columns))
+        return len(meta)
+
+    def replace(self, meta: pd.DataFrame) -> int:
+        """
+        用 meta 替换整张表：删除不在 meta 中的股票，其余批量插入或更新，一个事务内完成
+        :return: 删除的行数
+        """
+        columns = [c for c in METADATA_COLUMNS if c in meta.columns]
+        keep = set(meta['stock_code'])
+        with self._transaction() as cur:
+            removed = [(c,) for (c,) in cur.execute('SELECT stock_code FROM stock_metadata') if c not in keep]
+            cur.executemany('DELETE FROM stock_metadata WHERE stock_code = ?', removed)
+            cur.executemany(self._upsert_sql(columns), self._records(meta, columns))
+        return len(removed)
+
+    @staticmethod
+    def _upsert_sql(columns: list) -> str:
+        updates = ', '.join(f'{c} = excluded.{c}' for c in columns if c != 'stock_code')
+        return f"INSERT INTO stock_metadata ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) " \
+               f"ON CONFLICT (stock_code) DO " + (f'UPDATE SET {updates}' if updates else 'NOTHING')
+
+    # ---------- 查询 ----------
+
+    @staticmethod
+    def _where(exchange=None, status=None, lag_before: str = None) -> tuple:
+        """
+        :param exchange: 交易所，如 'sh,sz' 或 ['sh', 'sz']
+        :param status: 状态，如 'Active' 或 ['Halting', 'Unknown']
+        :param lag_before: 只取 latest_trade_date 早于该日期（或为空）的股票，如传入交易日历的最后一天
+        """
+        clauses, params = [], []
+        for column, values in [('exchange', _values(exchange)), ('status', _values(status))]:
+            if values:
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params += values
+        if lag_before:
+            clauses.append('(latest_trade_date IS NULL OR latest_trade_date < ?)')
+            params.append(lag_before)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def _select(self, columns: list, exchange=None, status=None, lag_before: str = None, limit: int = None,
+                offset: int = 0) -> list:
+        where, params = self._where(exchange, status, lag_before)
+        sql = f"SELECT {', '.join(columns)} FROM stock_metadata{where} ORDER BY stock_code"
+        if limit is not None or offset:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [-1 if limit is None else limit, offset]
+        return self._query(sql, params)
+
+    def query(self, exchange=None, status=None, lag_before: str = None, limit: int = None,
+              offset: int = 0) -> pd.DataFrame:
+        """
+        按条件筛选，结果按 stock_code 排序，条件参数见 _where
+        :param limit: 最多返回条数，None 表示不限
+        :param offset: 跳过的条数，与 limit 一起用于分页
+        """
+        rows = self._select(METADATA_COLUMNS, exchange, status, lag_before, limit, offset)
+        return pd.DataFrame(rows, columns=METADATA_COLUMNS)
+
+    def codes(self, exchange=None, status=None, lag_before: str = None, limit: int = None,
+              offset: int = 0) -> list:
+        """同 query，只返回股票代码"""
+        return [c for (c,) in self._select(['stock_code'], exchange, status, lag_before, limit, offset)]
+
+    def count(self, exchange=None, status=None, lag_before: str = None) -> int:
+        where, params = self._where(exchange, status, lag_before)
+        return self._query(f'SELECT COUNT(*) FROM stock_metadata{where}', params)[0][0]
+
+    def load(self) -> pd.DataFrame:
+        """整张表"""
+        return self.query()
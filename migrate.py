@@ -0,0 +1,113 @@
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from rollup import RollupStore
+from store import STORES, FactorStore, adjust_type, get_store
+
+
+def migrate(src: str = 'csv', dst: str = 'bar', root: str = 'data', types: list = None) -> int:
+    """
+    一次性把 {root}/{type}/ 下的K线文件从一种存储格式转换为另一种
+    :param src: 源存储后端
+    :param dst: 目标存储后端
+    :param root: 数据根目录
+    :param types: 需要转换的 k线类型，默认扫描根目录下全部子目录
+    :return: 转换的文件数
+    """
+    src_store = get_store(src, root)
+    dst_store = get_store(dst, root)
+    if types is None:
+        types = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    total = 0
+    for type in types:
+        codes = src_store.codes(type)
+        start = time.time()
+        for code in codes:
+            try:
+                dst_store.write(code, type, src_store.read(code, type))
+                total += 1
+            except Exception as e:
+                print(f'{type}/{code} 转换失败: {e}')
+        print(f'{type}: {len(codes)} 个文件, 耗时 {time.time() - start:.1f}s')
+    return total
+
+
+def derive_raw(qfq: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    由前复权日线和因子变化点反推不复权日线：不复权 = 前复权 × 基准因子 / 当日因子
+    基准因子取文件最后一根K线当日的因子（前复权文件是在那天按当时的最新因子算出的）
+    前复权价已取整到分，反推结果在除权日之前可能与上游的不复权价差一分
+    :param qfq: 前复权日线结构化数组
+    :param points: FactorStore.load 返回的因子变化点，为空时原样返回（如指数）
+    """
+    if not len(points) or not len(qfq):
+        return qfq.copy()
+    idx = np.maximum(np.searchsorted(points['date'], qfq['date'], side='right') - 1, 0)
+    factor = points['factor'][idx]
+    out = qfq.copy()
+    for c in ['open', 'close', 'high', 'low']:
+        out[c] = np.round(qfq[c] * factor[-1] / factor, 2)
+    return out
+
+
+def migrate_raw(root: str = 'data', backend: str = None, workers: int = 4) -> int:
+    """
+    一次性由旧的前复权日线 {root}/day/ 生成不复权日线 {root}/day_raw/、复权因子表和物化的周/月/年K线
+    每只股票只调用一次 tushare 复权因子接口，不重新下载K线；已有不复权数据的股票跳过，可中断后重跑
+    :param root: 数据根目录
+    :param backend: 存储后端，默认同 get_store
+    :param workers: 并发拉取因子的线程数，总调用频率仍受 tushare 令牌桶限制
+    :return: 转换的股票数
+    """
+    from ts import ts_get_adj_factor_history
+
+    store = get_store(backend, root)
+    factors = FactorStore(root)
+    rollups = RollupStore(store, factors)
+    raw_type = adjust_type('day', '')
+    done = set(store.codes(raw_type))
+    codes = [c for c in store.codes('day') if c not in done]
+    print(f'{len(codes)} 只股票需要生成不复权日线，{len(done)} 只已有')
+
+    def convert(code: str) -> bool:
+        try:
+            factor_df = ts_get_adj_factor_history(code)
+            factors.write(code, factor_df)
+            store.write_records(code, raw_type, derive_raw(store.load(code, 'day'), factors.load(code)), '')
+            rollups.rebuild(code)
+            return True
+        except Exception as e:
+            print(f'{code} 转换失败: {e}')
+            return False
+
+    start = time.time()
+    total = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, ok in enumerate(pool.map(convert, codes), 1):
+            total += ok
+            if i % 500 == 0:
+                print(f'已处理 {i}/{len(codes)}，耗时 {time.time() - start:.1f}s')
+    print(f'day_raw: {total} 只股票, 耗时 {time.time() - start:.1f}s')
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='K线存储格式迁移')
+    parser.add_argument('--raw', action='store_true',
+                        help='由旧的前复权日线和复权因子生成不复权日线（升级到不复权存储后执行一次）')
+    parser.add_argument('--workers', type=int, default=4, help='--raw 时并发拉取复权因子的线程数')
+    parser.add_argument('--src', default='csv', choices=list(STORES))
+    parser.add_argument('--dst', default='bar', choices=list(STORES))
+    parser.add_argument('--root', default='data')
+    parser.add_argument('--types', nargs='*', default=None, help='k线类型，如 day week，默认全部')
+    args = parser.parse_args()
+    if args.raw:
+        n = migrate_raw(args.root, workers=args.workers)
+        print(f'迁移完成，共 {n} 只股票')
+    else:
+        n = migrate(args.src, args.dst, args.root, args.types)
+        print(f'迁移完成，共 {n} 个文件')
@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from store import BarStore, FactorStore, adjust_type, decode_dates, encode_dates, get_store, window
+from trading_calendar import TradingCalendar
+
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+# 列按块预留，新股上市时占用空列，不必重写整个矩阵
+COLUMN_BLOCK = 256
+
+
+class PanelStore:
+    """
+    全市场截面矩阵（交易日 × 股票），存放在 {root}/panel/
+    每个字段一个按行（交易日）连续存放的 float64 文件，另有一个逐日的后复权因子矩阵，
+    读取时以 memmap 打开，取“最近 250 天全部股票的收盘价”只需读连续的 250 行
+    meta.json 记录行数、列容量、股票代码顺序和文件代数；新交易日直接追加到文件尾
+    扩容或重建时写入带新代数的文件，meta.json 原子替换后读取方才切换过去，之后再删除旧文件
+    """
+
+    def __init__(self, root: str = 'data'):
+        self.root = os.path.join(root, 'panel')
+        self._meta_version = None
+        self._meta = None
+        self._dates = None
+        self._maps = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    @staticmethod
+    def _name(name: str, meta: dict) -> str:
+        """meta 所指的文件名：第 0 代为 close.f8、dates.i4，之后为 close.1.f8、dates.1.i4"""
+        generation = meta.get('generation', 0)
+        if not generation:
+            return name
+        stem, suffix = name.rsplit('.', 1)
+        return f'{stem}.{generation}.{suffix}'
+
+    def _remove_files(self, meta: dict):
+        """删除旧代数的文件；已经 memmap 打开的读取方不受影响"""
+        for name in [f'{f}.f8' for f in PANEL_FIELDS + ['factor']] + ['dates.i4']:
+            try:
+                os.remove(self._path(self._name(name, meta)))
+            except FileNotFoundError:
+                pass
+
+    def exists(self) -> bool:
+        return os.path.exists(self._path('meta.json'))
+
+    def _load_meta(self) -> dict:
+        """meta.json 变了（其他进程更新过）才重新打开"""
+        st = os.stat(self._path('meta.json'))
+        version = st.st_mtime_ns, st.st_size
+        if version != self._meta_version:
+            with open(self._path('meta.json'), encoding='utf-8') as f:
+                self._meta = json.load(f)
+            rows = self._meta['rows']
+            self._dates = np.fromfile(self._path(self._name('dates.i4', self._meta)), dtype='<i4', count=rows)
+            self._maps = {}
+            self._meta_version = version
+        return self._meta
+
+    def _save_meta(self, meta: dict):
+        tmp_path = self._path('meta.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path('meta.json'))
+
+    @property
+    def symbols(self) -> list:
+        return self._load_meta()['symbols']
+
+    @property
+    def dates(self) -> np.ndarray:
+        """交易日（yyyyMMdd 整数）"""
+        self._load_meta()
+        return self._dates
+
+    def matrix(self, field: str) -> np.ndarray:
+        """
+        只读 memmap 打开整张矩阵
+        :param field: open/high/low/close/volume，或 factor（后复权因子）
+        :return: (交易日数, 股票数) 的二维数组
+        """
+        meta = self._load_meta()
+        maps = self._maps  # 取局部引用，其他线程重新载入 meta 时替换的是新字典
+        if field not in maps:
+            if meta['rows'] == 0:
+                return np.empty((0, len(meta['symbols'])))
+            maps[field] = np.memmap(self._path(self._name(f'{field}.f8', meta)), dtype='<f8', mode='r',
+                                    shape=(meta['rows'], meta['capacity']))
+        return maps[field][:, :len(meta['symbols'])]
+
+    def version(self, field: str, adjust: str = '') -> tuple:
+        """
+        数据版本：meta.json 和所用矩阵文件的修改时间、大小，每日更新写入后改变
+        :param adjust: 已归一化的复权方式，复权价格还取决于因子矩阵
+        """
+        meta = self._load_meta()
+        names = ['meta.json'] + [self._name(f'{f}.f8', meta)
+                                 for f in [field] + (['factor'] if adjust and field != 'volume' else [])]
+        versions = []
+        for name in names:
+            try:
+                st = os.stat(self._path(name))
+            except FileNotFoundError:
+                versions.append(None)
+                continue
+            versions.append((st.st_mtime_ns, st.st_size))
+        return tuple(versions)
+
+    def slice(self, field: str, start: str = '', end: str = '', length: int = None, symbols: list = None,
+              adjust: str = '') -> tuple:
+        """
+        取一段全市场截面
+        :param field: open/high/low/close/volume
+        :param start: 开始日期（含），留空表示最早
+        :param end: 结束日期（含），留空表示最新
+        :param length: 最多返回的交易日数，从区间末尾往前数
+        :param symbols: 只取这些股票，默认全部
+        :param adjust: 已归一化的复权方式 "qfq"、"hfq"、""，价格按逐日因子计算，成交量不变
+        :return: (日期数组, 股票代码列表, 二维数组)
+        """
+        if field not in PANEL_FIELDS:
+            raise ValueError(f"未知字段: {field}，可选 {PANEL_FIELDS}")
+        lo, hi = window(self.dates, 'day', start, end, length)
+        codes = self.symbols
+        cols = slice(None)
+        if symbols is not None:
+            index = {c: i for i, c in enumerate(codes)}
+            cols = [index[c] for c in symbols if c in index]
+            codes = [codes[i] for i in cols]
+        values = np.array(self.matrix(field)[lo:hi, cols])
+        if adjust and field != 'volume':
+            factor = self.matrix('factor')
+            values *= factor[lo:hi, cols]
+            if adjust == 'qfq':
+                values /= factor[-1, cols]
+            values = np.round(values, 2)
+        return self.dates[lo:hi], codes, values
+
+    def frame(self, field: str, start: str = '', end: str = '', length: int = None, symbols: list = None,
+              adjust: str = '') -> pd.DataFrame:
+        """slice 的 DataFrame 版本，行索引为日期，列为股票代码"""
+        dates, codes, values = self.slice(field, start, end, length, symbols, adjust)
+        return pd.DataFrame(values, index=decode_dates(dates, 'day').to_numpy(), columns=codes)
+
+    # ---------- 写入 ----------
+
+    def build(self, store: BarStore, factors: FactorStore, trading_days: list, codes: list = None):
+        """
+        由每只股票的不复权日线和复权因子整体生成
+        :param trading_days: 交易日历，矩阵的行
+        :param codes: 股票代码，默认全部已落盘的不复权日线
+        """
+        os.makedirs(self.root, exist_ok=True)
+        codes = sorted(codes if codes is not None else store.codes(adjust_type('day', '')))
+        dates = encode_dates(trading_days, 'day')
+        capacity = (len(codes) // COLUMN_BLOCK + 1) * COLUMN_BLOCK
+        start = time.time()
+        # 已有矩阵时写入下一代文件，读取方在 meta.json 替换前仍读旧文件
+        old = self._load_meta() if self.exists() else None
+        meta = {'rows': len(dates), 'capacity': capacity, 'symbols': codes,
+                'generation': old.get('generation', 0) + 1 if old else 0}
+        maps = {f: self._create(self._name(f'{f}.f8', meta), len(dates), capacity) for f in PANEL_FIELDS + ['factor']}
+        # 按列块在内存里拼好再整块写入，避免逐列跨行写文件
+        for lo in range(0, len(codes), COLUMN_BLOCK):
+            block_codes = codes[lo:lo + COLUMN_BLOCK]
+            block = {f: np.full((len(dates), len(block_codes)), np.nan) for f in maps}
+            for i, code in enumerate(block_codes):
+                self._fill_column(block, dates, i, store.load(code, adjust_type('day', '')), factors.load(code),
+                                  clear=False)
+            for f, m in maps.items():
+                m[:, lo:lo + len(block_codes)] = block[f]
+        for m in maps.values():
+            m.flush()
+        del maps
+        dates.astype('<i4').tofile(self._path(self._name('dates.i4', meta)))
+        self._save_meta(meta)
+        if old:
+            self._remove_files(old)
+        print(f'截面矩阵生成完成: {len(dates)} 个交易日 × {len(codes)} 只股票，耗时 {time.time() - start:.1f}s')
+
+    def _create(self, name: str, rows: int, capacity: int) -> np.memmap:
+        m = np.memmap(self._path(name), dtype='<f8', mode='w+', shape=(max(rows, 1), capacity))
+        m[:] = np.nan
+        return m
+
+    def _open_rw(self, field: str, meta: dict) -> np.memmap:
+        return np.memmap(self._path(self._name(f'{field}.f8', meta)), dtype='<f8', mode='r+',
+                         shape=(meta['rows'], meta['capacity']))
+
+    @staticmethod
+    def _fill_column(maps: dict, dates: np.ndarray, col: int, arr: np.ndarray, points: np.ndarray,
+                     clear: bool = True):
+        """把一只股票的整段历史写入第 col 列，clear 为 True 时先清空原有内容"""
+        if clear:
+            for m in maps.values():
+                m[:, col] = np.nan
+        if not len(arr):
+            return
+        rows = np.searchsorted(dates, arr['date'])
+        ok = (rows < len(dates)) & (dates[np.minimum(rows, len(dates) - 1)] == arr['date'])
+        rows, arr = rows[ok], arr[ok]
+        for f in PANEL_FIELDS:
+            maps[f][rows, col] = arr[f]
+        # 因子从上市首日起逐日填满，停牌日也有值，便于按最后一行计算前复权
+        first = rows[0] if len(rows) else len(dates)
+        if len(points):
+            idx = np.maximum(np.searchsorted(points['date'], dates[first:], side='right') - 1, 0)
+            maps['factor'][first:, col] = points['factor'][idx]
+        else:
+            maps['factor'][first:, col] = 1.0
+
+    def _ensure_columns(self, meta: dict, codes: list) -> dict:
+        """
+        新股票追加到代码表，列容量不够时整体扩容：矩阵复制到下一代文件，
+        由调用方保存 meta.json 切换过去后再删除旧文件
+        """
+        known = set(meta['symbols'])
+        new = [c for c in codes if c not in known]
+        if not new:
+            return meta
+        symbols = meta['symbols'] + new
+        if len(symbols) > meta['capacity']:
+            capacity = (len(symbols) // COLUMN_BLOCK + 1) * COLUMN_BLOCK
+            resized = dict(meta, capacity=capacity, generation=meta.get('generation', 0) + 1)
+            for f in PANEL_FIELDS + ['factor']:
+                m = self._create(self._name(f'{f}.f8', resized), meta['rows'], capacity)
+                m[:meta['rows'], :meta['capacity']] = self._open_rw(f, meta)
+                m.flush()
+                del m
+            shutil.copyfile(self._path(self._name('dates.i4', meta)), self._path(self._name('dates.i4', resized)))
+            meta = resized
+        return dict(meta, symbols=symbols)
+
+    def _append_rows(self, meta: dict, new_dates: np.ndarray) -> dict:
+        """追加新交易日的空行，因子沿用上一行"""
+        if not len(new_dates):
+            return meta
+        block = np.full((len(new_dates), meta['capacity']), np.nan)
+        for f in PANEL_FIELDS:
+            with open(self._path(self._name(f'{f}.f8', meta)), 'ab') as fp:
+                fp.write(block.tobytes())
+        if meta['rows']:
+            last = np.array(self._open_rw('factor', meta)[-1])
+            block[:] = last
+        with open(self._path(self._name('factor.f8', meta)), 'ab') as fp:
+            fp.write(block.tobytes())
+        with open(self._path(self._name('dates.i4', meta)), 'ab') as fp:
+            fp.write(new_dates.astype('<i4').tobytes())
+        return dict(meta, rows=meta['rows'] + len(new_dates))
+
+    def update(self, res: pd.DataFrame, factors: pd.DataFrame = None, refresh: dict = None):
+        """
+        每日更新：写入新K线所在的行，整段刷新被重新下载的股票
+        :param res: 带 stock_code 列的新K线（不复权）
+        :param factors: 带 stock_code 列的新复权因子
+        :param refresh: {code: (不复权K线结构化数组, 因子变化点)}，历史被整段重写的股票
+        """
+        refresh = refresh or {}
+        meta = old = self._load_meta()
+        dates = self._dates
+        codes = list(res['stock_code'].unique()) if not res.empty else []
+        meta = self._ensure_columns(meta, codes + [c for c in refresh if c not in codes])
+        if not res.empty:
+            res_dates = encode_dates(res['date'], 'day')
+            last = dates[-1] if len(dates) else 0
+            meta = self._append_rows(meta, np.unique(res_dates[res_dates > last]))
+            dates = np.concatenate([dates, np.unique(res_dates[res_dates > last])]).astype('<i4')
+        maps = {f: self._open_rw(f, meta) for f in PANEL_FIELDS + ['factor']}
+        index = {c: i for i, c in enumerate(meta['symbols'])}
+        if not res.empty:
+            rows = np.searchsorted(dates, res_dates)
+            ok = (rows < len(dates)) & (dates[np.minimum(rows, len(dates) - 1)] == res_dates)
+            if not ok.all():
+                print(f'{int((~ok).sum())} 根K线的日期不在截面矩阵的交易日中，已跳过')
+            rows, cols = rows[ok], res['stock_code'].map(index).to_numpy()[ok]
+            for f in PANEL_FIELDS:
+                maps[f][rows, cols] = res[f].to_numpy(dtype=float)[ok]
+            if factors is not None and not factors.empty:
+                f_dates = encode_dates(factors['date'], 'day')
+                f_rows = np.searchsorted(dates, f_dates)
+                f_cols = factors['stock_code'].map(index)
+                f_ok = (f_rows < len(dates)) & f_cols.notna().to_numpy() & \
+                       (dates[np.minimum(f_rows, len(dates) - 1)] == f_dates)
+                maps['factor'][f_rows[f_ok], f_cols[f_ok].astype(int).to_numpy()] = \
+                    factors['factor'].to_numpy(dtype=float)[f_ok]
+            # 有K线却没有因子的（新股、接口缺数据），沿用前一天的因子，再没有就是 1
+            factor = maps['factor']
+            for r in np.unique(rows):
+                c = cols[rows == r]
+                missing = c[np.isnan(factor[r, c])]
+                if len(missing):
+                    prev = factor[r - 1, missing] if r > 0 else np.full(len(missing), np.nan)
+                    factor[r, missing] = np.where(np.isnan(prev), 1.0, prev)
+        for code, (arr, points) in refresh.items():
+            self._fill_column(maps, dates, index[code], arr, points)
+        for m in maps.values():
+            m.flush()
+        del maps
+        self._save_meta(meta)
+        if meta.get('generation', 0) != old.get('generation', 0):
+            self._remove_files(old)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='生成全市场截面矩阵')
+    parser.add_argument('--root', default='data')
+    parser.add_argument('--start', default='', help='矩阵起始日期 yyyy-MM-dd，默认交易日历的第一天')
+    args = parser.parse_args()
+
+    trading_days = TradingCalendar(args.root).to_list(start=args.start)
+    bar_store = get_store(root=args.root)
+    PanelStore(args.root).build(bar_store, FactorStore(args.root), trading_days)
@@ -0,0 +1,259 @@
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from backfill import Backfiller
+from panel import PanelStore
+from rollup import RollupStore
+from store import FactorStore, adjust_type
+from ts import ts_get_adj_factor, ts_get_daily_data
+
+# 每次更新最多全量回补多少只还没有不复权历史的股票，其余留到之后几次；升级时请先运行 migrate.py --raw
+RAW_BACKFILL_LIMIT = int(os.environ.get('FP_RAW_BACKFILL_LIMIT', 300))
+
+
+def overlap_mismatch(new_df: pd.DataFrame, old_df: pd.DataFrame) -> set:
+    """
+    新旧数据在重叠的 (stock_code, date) 上逐列比较，返回有差异的股票（一般是发生了除权，需要重新下载）
+    """
+    cols = ['open', 'high', 'low', 'close', 'volume']
+    merged = new_df[['stock_code', 'date'] + cols].merge(old_df, on=['stock_code', 'date'], suffixes=('', '_old'))
+    diff = np.zeros(len(merged), dtype=bool)
+    for c in cols:
+        a, b = merged[c], merged[f'{c}_old']
+        diff |= ((a != b) & ~(a.isna() & b.isna())).to_numpy()
+    return set(merged.loc[diff, 'stock_code'])
+
+
+def ingest_chunk(store, factor_store: FactorStore, res: pd.DataFrame, factors: pd.DataFrame, n: int,
+                 rollups: RollupStore = None) -> dict:
+    """
+    把一批股票的新K线（不复权）和复权因子合并进本地文件，并更新物化的周/月/年K线
+    除权除息不会改变不复权K线，只需在因子表里追加一条；重叠日期上K线不一致说明数据被修正过，需要重新下载
+    :param store: BarStore
+    :param factor_store: FactorStore
+    :param res: 带 stock_code 列的新K线
+    :param factors: 带 stock_code 列的新复权因子
+    :param n: 与文件尾部比较的K线根数（更新区间的交易日数）
+    :param rollups: 物化的高周期K线，默认由 store 和 factor_store 创建
+    :return: {"synced": {code: (None, 最新日期)}, "redownload": [...], "missing": [...], "failed": {code: 错误}}
+             redownload 为重叠数据不一致的股票；missing 为本地还没有不复权历史的股票，由全量回补分批处理
+    """
+    raw_type = adjust_type('day', '')
+    rollups = rollups or RollupStore(store, factor_store)
+    # 往前多取几天，防止数据不完整
+    # 一次读出所有股票文件尾部的几根K线，与新数据在重叠日期上整体比较
+    tails = store.tails(res['stock_code'].unique(), raw_type, n)
+    has_file = set(tails['stock_code'])
+    missing = set(res['stock_code']) - has_file
+    redownload = overlap_mismatch(res, tails)
+    factor_groups = dict(tuple(factors.groupby('stock_code', sort=False))) if not factors.empty else {}
+    synced, failed = {}, {}
+    for c, _df in res.groupby('stock_code', sort=False):
+        if c in redownload or c in missing:
+            continue
+        try:
+            if c in factor_groups:
+                factor_store.append(c, factor_groups[c])
+            store.append(c, raw_type, _df.drop(columns='stock_code'), '')
+            rollups.update(c, _df['date'].min())
+        except Exception as e:
+            failed[c] = str(e)
+            continue
+        synced[c] = (None, _df['date'].max())
+    return {"synced": synced, "redownload": sorted(redownload), "missing": sorted(missing), "failed": failed}
+
+
+def _ingest_worker(store_cls, root: str, res: pd.DataFrame, factors: pd.DataFrame, n: int) -> dict:
+    return ingest_chunk(store_cls(root), FactorStore(root), res, factors, n)
+
+
+class UpdatePipeline:
+    """
+    每日更新流水线，按阶段执行：
+    calendar → metadata → backfill → tushare → ingest → redownload → panel → save
+    逐股票的合并写盘（ingest）分块交给进程池；每个阶段记录耗时、处理行数和失败数，结束后写一份 JSON 运行报告
+    """
+
+    def __init__(self, fetcher, processes: int = None, report_dir: str = 'data/reports'):
+        """
+        :param fetcher: DataFetcher 实例
+        :param processes: ingest 阶段的进程数，默认 CPU 核数；<= 1 时在当前进程内执行
+        :param report_dir: 运行报告目录
+        """
+        self.fetcher = fetcher
+        self.processes = os.cpu_count() if processes is None else processes
+        self.report_dir = report_dir
+        self.stages = []
+
+    @contextmanager
+    def _stage(self, name: str):
+        stats = {"name": name, "seconds": 0.0, "rows": 0, "failures": 0}
+        self.stages.append(stats)
+        start = time.perf_counter()
+        try:
+            yield stats
+        except Exception as e:
+            stats["error"] = str(e)
+            raise
+        finally:
+            stats["seconds"] = round(time.perf_counter() - start, 3)
+            print(f"[{name}] {stats['seconds']}s, rows={stats['rows']}, failures={stats['failures']}")
+
+    def _backfill(self, codes: list, stats: dict, stage: str) -> dict:
+        """
+        全量回补；进度日志按 (阶段, 同步到的交易日) 区分，
+        中途崩溃后重跑（哪怕已过零点）同步的仍是同一个交易日，从日志续跑，回补与重下两个阶段互不干扰
+        """
+        backfiller = Backfiller(self.fetcher, workers=self.fetcher.workers,
+                                run_id=self.fetcher.calendar.last or 'initial', stage=stage,
+                                state_dir=os.path.join(self.fetcher.store.root, 'backfill'))
+        results = backfiller.run(codes)
+        stats["rows"] += sum(r[2] for r in results.values())
+        stats["failures"] += backfiller.stats['failed']
+        return {c: (earliest, latest) for c, (earliest, latest, _) in results.items()}
+
+    def _ingest(self, res: pd.DataFrame, factors: pd.DataFrame, n: int, stats: dict) -> tuple:
+        store, factor_store = self.fetcher.store, self.fetcher.factors
+        codes = res['stock_code'].unique()
+        if self.processes <= 1 or len(codes) < 2 * self.processes:
+            results = [ingest_chunk(store, factor_store, res, factors, n, self.fetcher.rollups)]
+        else:
+            parts = np.array_split(codes, self.processes)
+            chunks = [res[res['stock_code'].isin(part)] for part in parts]
+            factor_chunks = [factors[factors['stock_code'].isin(part)] if not factors.empty else factors
+                             for part in parts]
+            # API 进程里有调度线程，用 spawn 避免 fork 带锁
+            ctx = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=self.processes, mp_context=ctx) as pool:
+                results = list(pool.map(_ingest_worker, [type(store)] * len(chunks), [store.root] * len(chunks),
+                                        chunks, factor_chunks, [n] * len(chunks)))
+            # 子进程里的写入不会触发本进程的回调，这里补发
+            for r in results:
+                for c in r["synced"]:
+                    store._notify(c, adjust_type('day', ''))
+                    factor_store._notify(c)
+        synced, redownload, missing = {}, [], []
+        for r in results:
+            synced.update(r["synced"])
+            redownload.extend(r["redownload"])
+            missing.extend(r["missing"])
+            for c, e in r["failed"].items():
+                print(f'{c} 写入失败: {e}')
+            stats["failures"] += len(r["failed"])
+        stats["rows"] = len(synced)
+        if len(missing) > RAW_BACKFILL_LIMIT:
+            print(f'{len(missing)} 只股票还没有不复权历史，本次只回补 {RAW_BACKFILL_LIMIT} 只，'
+                  f'其余留到之后的更新；可先运行 python migrate.py --raw 一次性转换')
+        return synced, redownload + sorted(missing)[:RAW_BACKFILL_LIMIT]
+
+    def run(self) -> dict:
+        fetcher = self.fetcher
+        started_at = datetime.datetime.now()
+        status = "ok"
+        print('开始更新所有数据')
+        try:
+            with self._stage("calendar") as stats:
+                stats["rows"] = len(fetcher.update_trading_days())
+
+            with self._stage("metadata") as stats:
+                updated_metadata = fetcher.reconcile_metadata()
+                stats["rows"] = len(updated_metadata)
+
+            # 本次同步结果：code -> (最早日期, 最新日期)，最早日期为 None 表示不变
+            synced = {}
+            need_update = updated_metadata[(updated_metadata['status'].isin(['Active', 'Halting', 'Unknown']))]
+            with self._stage("backfill") as stats:
+                backfill_codes = need_update[need_update['status'].isin(['Halting', 'Unknown'])]['stock_code'].tolist()
+                synced.update(self._backfill(backfill_codes, stats, 'backfill'))
+
+            with self._stage("tushare") as stats:
+                calendar = fetcher.calendar
+                # 从上次更新到的交易日往前多取两天；上次的日期不在日历中时取全部
+                start = calendar.offset(fetcher.last_day, -2) if calendar.is_trading_day(fetcher.last_day) else ''
+                update_dates = calendar.to_list(start=start)
+                res = ts_get_daily_data(trade_days=update_dates)
+                factors = ts_get_adj_factor(trade_days=update_dates)
+                fetcher.last_day = calendar.last
+                stats["rows"] = len(res) + len(factors)
+
+            ingested, redownload = {}, []
+            with self._stage("ingest") as stats:
+                if not res.empty:
+                    need_update_list = need_update[need_update['status'].isin(['Active'])]['stock_code']
+                    res = res[res['stock_code'].isin(need_update_list)]
+                    ingested, redownload = self._ingest(res, factors, len(update_dates), stats)
+                    synced.update(ingested)
+
+            with self._stage("redownload") as stats:
+                if redownload:
+                    print(f'{len(redownload)} 只股票缺少历史或重叠数据不一致，重新下载: {redownload}')
+                    synced.update(self._backfill(redownload, stats, 'redownload'))
+
+            with self._stage("panel") as stats:
+                panel = PanelStore(fetcher.store.root)
+                if panel.exists():
+                    # 整段重新下载过的股票（最早日期有变化）刷新整列，其余只写新K线所在的行
+                    raw_type = adjust_type('day', '')
+                    refresh = {c: (fetcher.store.load(c, raw_type), fetcher.factors.load(c))
+                               for c, (earliest, _) in synced.items() if earliest is not None}
+                    new_bars = res[res['stock_code'].isin(list(ingested))] if ingested else pd.DataFrame()
+                    panel.update(new_bars, factors, refresh)
+                    stats["rows"] = len(new_bars) + len(refresh)
+
+            with self._stage("save") as stats:
+                fetcher.save_metadata(updated_metadata, synced)
+                stats["rows"] = len(synced)
+            print('所有数据更新完成')
+        except Exception:
+            status = "failed"
+            raise
+        finally:
+            report = self.write_report(started_at, status)
+        return report
+
+    def write_report(self, started_at: datetime.datetime, status: str) -> dict:
+        finished_at = datetime.datetime.now()
+        report = {
+            "status": status,
+            "started_at": started_at.isoformat(timespec='seconds'),
+            "finished_at": finished_at.isoformat(timespec='seconds'),
+            "seconds": round((finished_at - started_at).total_seconds(), 3),
+            "last_day": self.fetcher.last_day,
+            "stages": self.stages,
+        }
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"update_{started_at:%Y%m%d_%H%M%S}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'运行报告: {path}')
+        return report
+
+
+if __name__ == "__main__":
+    from data_fetcher import DataFetcher
+
+    parser = argparse.ArgumentParser(description='每日数据更新（独立进程运行，不占用 API 进程）')
+    parser.add_argument('--processes', type=int, default=None, help='ingest 阶段进程数，默认 CPU 核数')
+    parser.add_argument('--daemon', action='store_true', help='常驻运行，每个交易日 16:00 执行一次')
+    args = parser.parse_args()
+
+    fetcher = DataFetcher()
+    if not args.daemon:
+        UpdatePipeline(fetcher, processes=args.processes).run()
+    else:
+        import pytz
+        from apscheduler.schedulers.blocking import BlockingScheduler
+
+        scheduler = BlockingScheduler(timezone=pytz.timezone('Asia/Shanghai'))
+        scheduler.add_job(lambda: UpdatePipeline(fetcher, processes=args.processes).run(), 'cron', hour=16,
+                          minute=0, id='update_stock_data_daily', name='每日16:00更新股票数据')
+        scheduler.start()
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶限速器
+    :param rate: 每秒补充的令牌数（即平均请求速率）
+    :param capacity: 桶容量，允许的瞬时突发量，默认等于 rate
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """扣除令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def set_rate(self, rate: float):
+        """调整速率（自适应限速用），已积累的令牌保留"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.rate = rate
+
+    def acquire(self, tokens: float = 1):
+        """阻塞直到拿到令牌"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def wait(self, tokens: float = 1):
+        """
+        acquire 的异步版本，等待期间不阻塞事件循环
+        锁只在扣除令牌时短暂持有、不跨越等待，同一个桶可以由线程和协程同时使用
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
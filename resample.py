@@ -0,0 +1,107 @@
+import numpy as np
+
+from store import bar_dtype, to_datetime64
+
+# 可由本地基础周期合成的k线类型 → 基础周期
+RESAMPLE_BASE = {
+    'week': 'day',
+    'month': 'day',
+    'year': 'day',
+    'm5': 'm1',
+    'm15': 'm1',
+    'm30': 'm1',
+    'm60': 'm1',
+    'm120': 'm1',
+}
+MINUTE_SPANS = {'m5': 5, 'm15': 15, 'm30': 30, 'm60': 60, 'm120': 120}
+# A 股连续竞价时段（分钟数）：上午 09:30-11:30，下午 13:00-15:00
+MORNING_OPEN, MORNING_MINUTES, AFTERNOON_OPEN = 9 * 60 + 30, 120, 13 * 60
+
+
+def _day_numbers(dates: np.ndarray) -> np.ndarray:
+    """yyyyMMdd 整数 → 自 1970-01-01 起的天数"""
+    return (to_datetime64(dates) - np.datetime64('1970-01-01', 'D')).astype(np.int64)
+
+
+def _session_minutes(dates: np.ndarray) -> np.ndarray:
+    """yyyyMMddHHmm → 当日开盘后的第几分钟（上午 1..120，下午 121..240；09:30 集合竞价记为 0）"""
+    hhmm = np.asarray(dates, dtype=np.int64) % 10000
+    minutes = hhmm // 100 * 60 + hhmm % 100
+    return np.where(minutes <= MORNING_OPEN + MORNING_MINUTES, minutes - MORNING_OPEN,
+                    minutes - AFTERNOON_OPEN + MORNING_MINUTES)
+
+
+def _session_clock(x: np.ndarray) -> np.ndarray:
+    """_session_minutes 的逆：开盘后的第几分钟 → HHmm"""
+    minutes = np.where(x <= MORNING_MINUTES, MORNING_OPEN + x, AFTERNOON_OPEN + x - MORNING_MINUTES)
+    return minutes // 60 * 100 + minutes % 60
+
+
+def period_keys(dates: np.ndarray, type: str) -> np.ndarray:
+    """
+    每根基础K线所属周期的编号，同一周期编号相同且随时间递增
+    周按自然周（周一开始）划分，用天数计算，跨年的周不会被拆开
+    :param dates: 基础周期的整数日期
+    :param type: 目标k线类型
+    """
+    dates = np.asarray(dates, dtype=np.int64)
+    if type == 'week':
+        return (_day_numbers(dates) - 4) // 7  # 1970-01-05 是周一
+    if type == 'month':
+        return dates // 100
+    if type == 'year':
+        return dates // 10000
+    if type in MINUTE_SPANS:
+        # 按交易时段切分，如 m60 为 10:30、11:30、14:00、15:00 四根
+        bucket = np.maximum(_session_minutes(dates) - 1, 0) // MINUTE_SPANS[type]
+        return dates // 10000 * 100 + bucket
+    raise ValueError(f"不支持合成的k线类型: {type}")
+
+
+def period_start(date: int, type: str) -> int:
+    """日期所在周/月/年的第一个自然日（yyyyMMdd 整数）"""
+    if type == 'week':
+        day = np.datetime64('1970-01-01', 'D') + int(period_keys([date], 'week')[0]) * 7 + 4
+        return int(str(day).replace('-', ''))
+    if type == 'month':
+        return date // 100 * 100 + 1
+    if type == 'year':
+        return date // 10000 * 10000 + 101
+    raise ValueError(f"不支持的周期: {type}")
+
+
+def resample(arr: np.ndarray, type: str, trading_days: np.ndarray = None) -> np.ndarray:
+    """
+    由基础周期K线合成高周期K线：开盘取首根、最高取最大、最低取最小、收盘取末根、成交量求和
+    日期标记为周期内最后一根基础K线的日期（分钟线为该时段的结束时刻）
+    :param arr: 基础周期结构化数组（按日期升序），日线合成周/月/年，1 分钟线合成 m5~m120
+    :param type: 目标k线类型
+    :param trading_days: 交易日历（yyyyMMdd 整数，升序），给出时丢弃不在交易日内的基础K线；
+                         晚于日历最后一天的K线保留（日历可能比行情晚更新）
+    :return: 目标周期结构化数组
+    """
+    if type not in RESAMPLE_BASE:
+        raise ValueError(f"不支持合成的k线类型: {type}")
+    out_dtype = bar_dtype(type)
+    if trading_days is not None and len(trading_days) and len(arr):
+        days = arr['date'] // 10000 if type in MINUTE_SPANS else arr['date']
+        arr = arr[np.isin(days, trading_days) | (days > trading_days[-1])]
+    if not len(arr):
+        return np.empty(0, dtype=out_dtype)
+
+    keys = period_keys(arr['date'], type)
+    starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1])
+    ends = np.concatenate([starts[1:], [len(arr)]]) - 1
+
+    out = np.empty(len(starts), dtype=out_dtype)
+    if type in MINUTE_SPANS:
+        span = MINUTE_SPANS[type]
+        out['date'] = arr['date'][ends] // 10000 * 10000 + _session_clock((keys[starts] % 100 + 1) * span)
+    else:
+        out['date'] = arr['date'][ends]
+    out['open'] = arr['open'][starts]
+    out['close'] = arr['close'][ends]
+    out['high'] = np.maximum.reduceat(arr['high'], starts)
+    out['low'] = np.minimum.reduceat(arr['low'], starts)
+    out['volume'] = np.add.reduceat(arr['volume'], starts)
+    return out
@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+
+from resample import period_start, resample
+from store import BarStore, FactorStore, adjust_type, apply_factors, encode_dates
+from trading_calendar import TradingCalendar
+
+ROLLUP_TYPES = ['week', 'month', 'year']
+# 物化不复权和后复权两份；后复权的历史值不随新的除权变化，前复权由它除以最新因子得到
+ROLLUP_ADJUSTS = ['', 'hfq']
+
+
+class RollupStore:
+    """
+    物化的周/月/年K线，存放在 {root}/rollup/{type}_raw|{type}_hfq/
+    新的日线到来时只重算它所在的那个未结束周期，已结束的周期不再重算
+    与现场合成一样按交易日历合成，丢弃不在交易日内的日线
+    """
+
+    def __init__(self, store: BarStore, factors: FactorStore, calendar: TradingCalendar = None):
+        """
+        :param store: 日线所在的存储
+        :param factors: 复权因子表
+        :param calendar: 交易日历，默认读取 store 根目录下的日历文件
+        """
+        self.store = store
+        self.factors = factors
+        self.calendar = calendar or TradingCalendar(store.root)
+        self.rollups = type(store)(os.path.join(store.root, 'rollup'))
+
+    def subscribe(self, callback):
+        """注册写入回调 callback(stock_code, type)，type 为 week/month/year"""
+        self.rollups.subscribe(lambda stock_code, store_type: callback(stock_code, store_type.rsplit('_', 1)[0]))
+
+    def _store_type(self, type: str, adjust: str) -> str:
+        return adjust_type(type, 'hfq' if adjust == 'qfq' else adjust)
+
+    def exists(self, stock_code: str, type: str, adjust: str = 'qfq') -> bool:
+        return self.rollups.exists(stock_code, self._store_type(type, adjust))
+
+    def version(self, stock_code: str, type: str, adjust: str = 'qfq'):
+        version = self.rollups.version(stock_code, self._store_type(type, adjust))
+        if adjust == 'qfq':
+            return version, self.factors.version(stock_code)
+        return version
+
+    def is_current(self, stock_code: str, type: str, adjust: str = 'qfq') -> bool:
+        """物化结果是否已包含最新一根日线"""
+        last = self.rollups.last_date(stock_code, self._store_type(type, adjust))
+        return last is not None and last == self.store.last_date(stock_code, adjust_type('day', ''))
+
+    def _trading_days(self):
+        """交易日历（yyyyMMdd 整数数组），其他进程追加后重新载入，没有日历时返回 None"""
+        self.calendar.refresh()
+        return self.calendar.days if self.calendar else None
+
+    def _write(self, stock_code: str, raw: np.ndarray, points: np.ndarray, since: int = None):
+        days = self._trading_days()
+        for adjust in ROLLUP_ADJUSTS:
+            # 不取整，前复权除以最新因子后再取整，与日线的前复权一致
+            day = apply_factors(raw, points, adjust, decimals=None)
+            for type in ROLLUP_TYPES:
+                part = day
+                start = None
+                if since:
+                    start = period_start(since, type)
+                    part = day[int(np.searchsorted(day['date'], start)):]
+                bars = resample(part, type, days)
+                if not len(bars):
+                    continue
+                if start is None:
+                    self.rollups.write_records(stock_code, adjust_type(type, adjust), bars, adjust)
+                else:
+                    self.rollups.append_records(stock_code, adjust_type(type, adjust), bars, adjust, since=str(start))
+
+    def rebuild(self, stock_code: str):
+        """由全部日线重新生成（首次生成或日线被整段重写后调用）"""
+        self._write(stock_code, self.store.load(stock_code, adjust_type('day', '')), self.factors.load(stock_code))
+
+    def update(self, stock_code: str, since: str):
+        """
+        日线从 since 起有新增或改动时，只重算 since 所在周期及之后的K线
+        :param since: 新日线中最早的日期 yyyy-MM-dd
+        """
+        if not all(self.rollups.exists(stock_code, adjust_type(t, a)) for t in ROLLUP_TYPES for a in ROLLUP_ADJUSTS):
+            return self.rebuild(stock_code)
+        raw = self.store.load(stock_code, adjust_type('day', ''))
+        # 只需要 since 所在各周期内的日线（跨年的周可能早于当年年初）
+        date = int(encode_dates([since], 'day')[0])
+        lo = int(np.searchsorted(raw['date'], min(period_start(date, t) for t in ROLLUP_TYPES)))
+        self._write(stock_code, raw[lo:], self.factors.load(stock_code), date)
+
+    def load(self, stock_code: str, type: str, adjust: str = 'qfq') -> np.ndarray:
+        """读取物化的高周期K线，前复权由后复权除以最新因子得到"""
+        arr = self.rollups.load(stock_code, self._store_type(type, adjust))
+        if adjust == '' or not len(arr):
+            return arr
+        latest = self.factors.latest(stock_code) if adjust == 'qfq' else None
+        for c in ['open', 'close', 'high', 'low']:
+            arr[c] = np.round(arr[c] / latest if latest else arr[c], 2)
+        return arr
@@ -0,0 +1,39 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    合并并发的相同请求
+    同一 key 同时只执行一次 fn，期间到达的其他调用方等待同一个结果（或同一个异常）
+    fn 在 SingleFlight 持有的任务中运行，任何一个调用方被取消（如客户端断开）只影响它自己，不会中断其他调用方等待的执行
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> asyncio.Task
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key, fn):
+        """
+        :param key: 请求标识，如 (股票代码, k线类型, 复权方式, 区间)
+        :param fn: 无参协程函数，只有第一个调用方会真正执行
+        :return: fn 的返回值
+        """
+        self.calls += 1
+        task = self._flights.get(key)
+        if task is not None:
+            self.shared += 1
+        else:
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+        if not task.cancelled():
+            task.exception()  # 标记已取回，所有调用方都已离开时不触发 "never retrieved" 警告
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
@@ -0,0 +1,558 @@
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+BAR_COLUMNS = ['date', 'open', 'close', 'high', 'low', 'volume']
+MINUTE_TYPES = ['m1', 'm5', 'm15', 'm30', 'm60', 'm120']
+
+BAR_MAGIC = b'FPBAR01'
+# .bar 文件表头，固定 64 字节：魔数、记录数、最新日期、复权方式
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('count', '<i8'), ('last_date', '<i8'), ('adjust', 'S8'),
+                         ('reserved', 'V32')])
+
+
+def bar_dtype(type: str) -> np.dtype:
+    """
+    K线定长记录结构
+    日期存成整数：日线及以上为 int32 的 yyyyMMdd，分钟线为 int64 的 yyyyMMddHHmm
+    :param type: k线类型
+    :return: numpy 结构化 dtype
+    """
+    date_dtype = '<i8' if type in MINUTE_TYPES else '<i4'
+    return np.dtype([('date', date_dtype), ('open', '<f8'), ('close', '<f8'), ('high', '<f8'),
+                     ('low', '<f8'), ('volume', '<i8')])
+
+
+def encode_dates(dates, type: str) -> np.ndarray:
+    """'yyyy-MM-dd' / 'yyyyMMddHHmm' 字符串 → 整数日期"""
+    s = pd.Series(dates, dtype=str).str.replace('-', '', regex=False)
+    return s.astype(np.int64).to_numpy().astype(bar_dtype(type)['date'])
+
+
+def to_datetime64(values: np.ndarray) -> np.ndarray:
+    """yyyyMMdd 整数 → datetime64[D]，整段数组运算，不逐个解析字符串"""
+    values = np.asarray(values, dtype=np.int64)
+    y, m, d = values // 10000, values // 100 % 100, values % 100
+    months = ((y - 1970) * 12 + (m - 1)).astype('datetime64[M]')
+    return months.astype('datetime64[D]') + (d - 1)
+
+
+def decode_dates(values: np.ndarray, type: str) -> pd.Series:
+    """整数日期 → 与原 CSV 一致的字符串日期"""
+    if type in MINUTE_TYPES:
+        return pd.Series(np.asarray(values).astype(str))
+    return pd.Series(np.datetime_as_string(to_datetime64(values)))
+
+
+def decode_date(value: int, type: str) -> str:
+    """单个整数日期 → 字符串，不经过 pandas"""
+    value = int(value)
+    if type in MINUTE_TYPES:
+        return str(value)
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+def encode_bound(value: str, type: str, upper: bool = False) -> int:
+    """区间端点 → 整数日期；分钟线只给日期时补齐为当天开始/结束"""
+    digits = value.replace('-', '').replace(' ', '').replace(':', '')
+    if type in MINUTE_TYPES and len(digits) == 8:
+        digits += '2359' if upper else '0000'
+    return int(digits)
+
+
+def window(dates: np.ndarray, type: str, start: str = '', end: str = '', length: int = None) -> tuple:
+    """
+    在升序的整数日期列上二分查找区间
+    :param dates: 整数日期数组
+    :param start: 开始日期（含），留空表示最早
+    :param end: 结束日期（含），留空表示最新
+    :param length: 最多返回条数，从区间末尾往前数
+    :return: (lo, hi) 切片下标
+    """
+    lo, hi = 0, len(dates)
+    if start:
+        lo = int(np.searchsorted(dates, encode_bound(start, type), side='left'))
+    if end:
+        hi = int(np.searchsorted(dates, encode_bound(end, type, upper=True), side='right'))
+    if length:
+        lo = max(lo, hi - length)
+    return lo, max(lo, hi)
+
+
+def adjust_type(type: str, adjust: str = 'qfq') -> str:
+    """
+    不同复权方式的数据存放在不同子目录：前复权沿用 {type}，后复权 {type}_hfq，不复权 {type}_raw
+    :param adjust: 已归一化的复权方式 "qfq"、"hfq"、""
+    """
+    if adjust == 'hfq':
+        return f"{type}_hfq"
+    if adjust == '':
+        return f"{type}_raw"
+    return type
+
+
+def split_adjust_type(store_type: str) -> tuple:
+    """adjust_type 的逆操作：子目录名 → (type, adjust)"""
+    if store_type.endswith('_hfq'):
+        return store_type[:-4], 'hfq'
+    if store_type.endswith('_raw'):
+        return store_type[:-4], ''
+    return store_type, 'qfq'
+
+
+def to_records(df: pd.DataFrame, type: str) -> np.ndarray:
+    """DataFrame → 结构化数组（按日期升序）"""
+    df = df.drop_duplicates(subset=['date'], keep='last').sort_values('date')
+    arr = np.empty(len(df), dtype=bar_dtype(type))
+    arr['date'] = encode_dates(df['date'], type)
+    for c in ['open', 'close', 'high', 'low']:
+        arr[c] = pd.to_numeric(df[c], errors='coerce').to_numpy()
+    arr['volume'] = pd.to_numeric(df['volume'], errors='coerce').fillna(0).round().to_numpy()
+    return arr
+
+
+def from_records(arr: np.ndarray, type: str) -> pd.DataFrame:
+    """结构化数组 → DataFrame，列顺序与原 CSV 一致"""
+    df = pd.DataFrame({c: arr[c] for c in BAR_COLUMNS[1:]})
+    df.insert(0, 'date', decode_dates(arr['date'], type))
+    return df
+
+
+class BarStore:
+    """
+    K线存储接口
+    以 (股票代码, k线类型) 为单位整段读写，文件位于 {root}/{type}/{code}{suffix}
+    """
+    suffix = ''
+
+    def __init__(self, root: str = 'data'):
+        self.root = root
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """注册写入回调 callback(stock_code, type)，文件被改写后调用，用于缓存失效"""
+        self._listeners.append(callback)
+
+    def _notify(self, stock_code: str, type: str):
+        for callback in self._listeners:
+            callback(stock_code, type)
+
+    def path(self, stock_code: str, type: str) -> str:
+        return os.path.join(self.root, type, f"{stock_code}{self.suffix}")
+
+    def exists(self, stock_code: str, type: str) -> bool:
+        return os.path.exists(self.path(stock_code, type))
+
+    def version(self, stock_code: str, type: str) -> Optional[tuple]:
+        """
+        文件版本 (修改时间ns, 大小)，不存在时返回 None
+        其他进程（如独立运行的每日更新）写入时不会触发本进程的回调，读取方据此判断缓存是否过期
+        """
+        try:
+            st = os.stat(self.path(stock_code, type))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def codes(self, type: str) -> list:
+        """列出某类型下已落盘的全部股票代码"""
+        folder = os.path.join(self.root, type)
+        if not os.path.isdir(folder):
+            return []
+        n = len(self.suffix)
+        return sorted(f[:-n] for f in os.listdir(folder) if f.endswith(self.suffix))
+
+    def read(self, stock_code: str, type: str) -> pd.DataFrame:
+        """读取整段历史，不存在时返回空 DataFrame"""
+        raise NotImplementedError
+
+    def write(self, stock_code: str, type: str, df: pd.DataFrame, adjust: str = 'qfq'):
+        """
+        整段写入（覆盖）
+        :param adjust: 数据的复权方式，仅记录在带表头的格式中
+        """
+        raise NotImplementedError
+
+    def append(self, stock_code: str, type: str, df: pd.DataFrame, adjust: str = 'qfq', since: str = None):
+        """
+        追加新K线，若与已有数据重叠，则从新数据的第一根起覆盖
+        :param since: 从该日期起的旧K线一律覆盖（即使早于新数据的第一根），用于重算未结束的周期
+        """
+        if df.empty:
+            return
+        old_df = self.read(stock_code, type)
+        if not old_df.empty:
+            cut = encode_dates([df['date'].min()], type)[0]
+            if since:
+                cut = min(cut, encode_bound(since, type))
+            df = pd.concat([old_df[encode_dates(old_df['date'], type) < cut], df])
+        self.write(stock_code, type, df, adjust)
+
+    def write_records(self, stock_code: str, type: str, arr: np.ndarray, adjust: str = 'qfq'):
+        """整段写入结构化数组（按日期升序），省去 DataFrame 转换的格式可以覆盖"""
+        self.write(stock_code, type, from_records(arr, type), adjust)
+
+    def append_records(self, stock_code: str, type: str, arr: np.ndarray, adjust: str = 'qfq', since: str = None):
+        """append 的结构化数组版本"""
+        self.append(stock_code, type, from_records(arr, type), adjust, since)
+
+    def load(self, stock_code: str, type: str) -> np.ndarray:
+        """读取整段历史到内存中的结构化数组"""
+        df = self.read(stock_code, type)
+        if df.empty:
+            return np.empty(0, dtype=bar_dtype(type))
+        return to_records(df, type)
+
+    def tail(self, stock_code: str, type: str, n: int) -> pd.DataFrame:
+        """读取最新的 n 根K线"""
+        return self.read(stock_code, type).tail(n).reset_index(drop=True)
+
+    def tail_records(self, stock_code: str, type: str, n: int) -> np.ndarray:
+        """最新的 n 根K线（结构化数组）"""
+        df = self.tail(stock_code, type, n)
+        if df.empty:
+            return np.empty(0, dtype=bar_dtype(type))
+        return to_records(df, type)
+
+    def tails(self, codes: list, type: str, n: int) -> pd.DataFrame:
+        """批量读取多只股票最新的 n 根K线，拼成一张带 stock_code 列的表"""
+        arrays = [self.tail_records(c, type, n) for c in codes]
+        arr = np.concatenate(arrays) if arrays else np.empty(0, dtype=bar_dtype(type))
+        df = from_records(arr, type)
+        df.insert(0, 'stock_code', np.repeat(np.asarray(codes, dtype=str), [len(a) for a in arrays]))
+        return df
+
+    def read_range(self, stock_code: str, type: str, start: str = '', end: str = '',
+                   length: int = None) -> pd.DataFrame:
+        """读取 [start, end] 区间内最新的 length 根K线"""
+        df = self.read(stock_code, type)
+        if df.empty:
+            return df
+        lo, hi = window(encode_dates(df['date'], type), type, start, end, length)
+        return df.iloc[lo:hi].reset_index(drop=True)
+
+    def read_range_records(self, stock_code: str, type: str, start: str = '', end: str = '',
+                           length: int = None) -> np.ndarray:
+        """read_range 的结构化数组版本"""
+        arr = self.load(stock_code, type)
+        lo, hi = window(arr['date'], type, start, end, length)
+        return arr[lo:hi]
+
+    def last_date(self, stock_code: str, type: str) -> Optional[str]:
+        """最新一根K线的日期，无数据时返回 None"""
+        df = self.tail(stock_code, type, 1)
+        return None if df.empty else df['date'].iat[-1]
+
+    def _prepare(self, stock_code: str, type: str) -> str:
+        file_path = self.path(stock_code, type)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return file_path
+
+
+class CsvStore(BarStore):
+    """原有的 CSV 文件存储"""
+    suffix = '.csv'
+
+    def read(self, stock_code: str, type: str) -> pd.DataFrame:
+        file_path = self.path(stock_code, type)
+        if not os.path.exists(file_path):
+            return pd.DataFrame()
+        return pd.read_csv(file_path)
+
+    def write(self, stock_code: str, type: str, df: pd.DataFrame, adjust: str = 'qfq'):
+        if df.empty:
+            return
+        file_path = self._prepare(stock_code, type)
+        df[BAR_COLUMNS].to_csv(file_path, index=False)
+        self._notify(stock_code, type)
+
+
+class NpyStore(BarStore):
+    """NumPy 结构化数组存储（.npy），列有固定类型，读写无需解析文本"""
+    suffix = '.npy'
+
+    def read(self, stock_code: str, type: str) -> pd.DataFrame:
+        file_path = self.path(stock_code, type)
+        if not os.path.exists(file_path):
+            return pd.DataFrame()
+        return from_records(np.load(file_path), type)
+
+    def write(self, stock_code: str, type: str, df: pd.DataFrame, adjust: str = 'qfq'):
+        if df.empty:
+            return
+        file_path = self._prepare(stock_code, type)
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, to_records(df, type))
+        os.replace(tmp_path, file_path)
+        self._notify(stock_code, type)
+
+
+def _make_header(count: int, last_date: int, adjust: str) -> np.ndarray:
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'] = BAR_MAGIC
+    header['count'] = count
+    header['last_date'] = last_date
+    header['adjust'] = adjust.encode()
+    return header
+
+
+class BarFileStore(BarStore):
+    """
+    追加写的定长记录文件（.bar）
+    64 字节表头 + 连续的定长K线记录。增量数据直接追加到文件尾，
+    读取时用 numpy.memmap 打开，切片不需要解析或复制整段历史
+    文件只增长不截断，有效记录数以表头的 count 为准，之后可能残留已被覆盖掉的旧记录
+    """
+    suffix = '.bar'
+
+    def header(self, stock_code: str, type: str) -> Optional[np.void]:
+        """读取表头，文件不存在时返回 None"""
+        file_path = self.path(stock_code, type)
+        if not os.path.exists(file_path):
+            return None
+        header = np.fromfile(file_path, dtype=HEADER_DTYPE, count=1)
+        if not len(header) or header[0]['magic'] != BAR_MAGIC:
+            raise ValueError(f"{file_path} 不是有效的K线文件")
+        return header[0]
+
+    def records(self, stock_code: str, type: str) -> np.ndarray:
+        """以只读 memmap 打开全部记录"""
+        header = self.header(stock_code, type)
+        if header is None or header['count'] == 0:
+            return np.empty(0, dtype=bar_dtype(type))
+        return np.memmap(self.path(stock_code, type), dtype=bar_dtype(type), mode='r',
+                         offset=HEADER_DTYPE.itemsize, shape=(int(header['count']),))
+
+    def read(self, stock_code: str, type: str) -> pd.DataFrame:
+        arr = self.records(stock_code, type)
+        if not len(arr):
+            return pd.DataFrame()
+        return from_records(arr, type)
+
+    def load(self, stock_code: str, type: str) -> np.ndarray:
+        return np.array(self.records(stock_code, type))
+
+    def tail(self, stock_code: str, type: str, n: int) -> pd.DataFrame:
+        arr = self.records(stock_code, type)
+        if not len(arr):
+            return pd.DataFrame()
+        return from_records(arr[-n:], type)
+
+    def read_range(self, stock_code: str, type: str, start: str = '', end: str = '',
+                   length: int = None) -> pd.DataFrame:
+        arr = self.read_range_records(stock_code, type, start, end, length)
+        if not len(arr):
+            return pd.DataFrame()
+        return from_records(arr, type)
+
+    def read_range_records(self, stock_code: str, type: str, start: str = '', end: str = '',
+                           length: int = None) -> np.ndarray:
+        """在 memmap 的日期列上二分查找区间，只复制命中的记录"""
+        arr = self.records(stock_code, type)
+        lo, hi = window(arr['date'], type, start, end, length)
+        return np.array(arr[lo:hi])
+
+    def tail_records(self, stock_code: str, type: str, n: int) -> np.ndarray:
+        return np.array(self.records(stock_code, type)[-n:])
+
+    def last_date(self, stock_code: str, type: str) -> Optional[str]:
+        header = self.header(stock_code, type)
+        if header is None or header['count'] == 0:
+            return None
+        return decode_date(header['last_date'], type)
+
+    def adjust(self, stock_code: str, type: str) -> Optional[str]:
+        """文件记录的复权方式"""
+        header = self.header(stock_code, type)
+        return None if header is None else header['adjust'].decode()
+
+    def write(self, stock_code: str, type: str, df: pd.DataFrame, adjust: str = 'qfq'):
+        if df.empty:
+            return
+        self.write_records(stock_code, type, to_records(df, type), adjust)
+
+    def write_records(self, stock_code: str, type: str, arr: np.ndarray, adjust: str = 'qfq'):
+        if not len(arr):
+            return
+        file_path = self._prepare(stock_code, type)
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_make_header(len(arr), arr['date'][-1], adjust).tobytes())
+            f.write(arr.tobytes())
+        os.replace(tmp_path, file_path)
+        self._notify(stock_code, type)
+
+    def append(self, stock_code: str, type: str, df: pd.DataFrame, adjust: str = 'qfq', since: str = None):
+        if df.empty:
+            return
+        self.append_records(stock_code, type, to_records(df, type), adjust, since)
+
+    def append_records(self, stock_code: str, type: str, arr: np.ndarray, adjust: str = 'qfq', since: str = None):
+        if not len(arr):
+            return
+        header = self.header(stock_code, type)
+        if header is None or header['count'] == 0:
+            return self.write_records(stock_code, type, arr, adjust)
+        if header['adjust'].decode() != adjust:
+            raise ValueError(f"{stock_code} 复权方式不一致: 文件为 {header['adjust'].decode()!r}, 新数据为 {adjust!r}")
+
+        count = int(header['count'])
+        pos = count
+        cut = arr['date'][0] if not since else min(arr['date'][0], encode_bound(since, type))
+        if cut <= header['last_date']:
+            # 与已有数据重叠，从第一根重叠的K线开始覆盖
+            pos = int(np.searchsorted(self.records(stock_code, type)['date'], cut))
+        new_count = pos + len(arr)
+        with open(self.path(stock_code, type), 'r+b') as f:
+            f.seek(HEADER_DTYPE.itemsize + pos * arr.dtype.itemsize)
+            f.write(arr.tobytes())
+            f.flush()
+            # 先写数据再改表头，并发读取方只会看到完整的记录；
+            # 新数据比原来短时也不截断文件，尾部残留的旧记录由表头的 count 排除在外，
+            # 仍持有旧表头的读取方不会 memmap 到文件末尾之外
+            f.seek(0)
+            f.write(_make_header(new_count, arr['date'][-1], adjust).tobytes())
+        self._notify(stock_code, type)
+
+
+# 复权因子只对日线维护，其他周期仍按复权方式分目录存放
+FACTOR_TYPES = ['day']
+FACTOR_DTYPE = np.dtype([('date', '<i4'), ('factor', '<f8')])
+
+
+def compress_factors(dates, factors) -> np.ndarray:
+    """
+    逐日因子 → 变化点（首日及每个除权除息日），因子在两个变化点之间不变
+    :param dates: 'yyyy-MM-dd' 或 'yyyyMMdd' 日期
+    :param factors: 对应的后复权因子
+    """
+    arr = np.empty(len(dates), dtype=FACTOR_DTYPE)
+    arr['date'] = encode_dates(dates, 'day')
+    arr['factor'] = np.asarray(factors, dtype=float)
+    arr = arr[np.argsort(arr['date'], kind='stable')]
+    arr = arr[~np.isnan(arr['factor'])]
+    if not len(arr):
+        return arr
+    keep = np.ones(len(arr), dtype=bool)
+    keep[1:] = arr['factor'][1:] != arr['factor'][:-1]
+    return arr[keep]
+
+
+def apply_factors(arr: np.ndarray, points: np.ndarray, adjust: str, decimals: Optional[int] = 2) -> np.ndarray:
+    """
+    由不复权K线和因子变化点计算复权价格，成交量不变
+    后复权 = 原价 × 当日因子；前复权 = 原价 × 当日因子 / 最新因子
+    :param arr: 不复权K线结构化数组
+    :param points: FactorStore.load 返回的因子变化点，为空时视为没有除权（如指数）
+    :param adjust: 已归一化的复权方式 "qfq"、"hfq"、""
+    :param decimals: 价格保留的小数位，None 表示不取整（物化的高周期K线保存未取整的后复权价）
+    """
+    if adjust == '' or not len(points) or not len(arr):
+        return arr
+    # 早于第一条因子记录的K线沿用第一条因子
+    idx = np.maximum(np.searchsorted(points['date'], arr['date'], side='right') - 1, 0)
+    factor = points['factor'][idx]
+    out = arr.copy()
+    for c in ['open', 'close', 'high', 'low']:
+        price = arr[c] * factor
+        if adjust == 'qfq':
+            price = price / points['factor'][-1]
+        out[c] = price if decimals is None else np.round(price, decimals)
+    return out
+
+
+class FactorStore:
+    """
+    复权因子表，每只股票一份 {root}/adj_factor/{code}.npy
+    只保存因子变化点，除权除息日只需追加一条记录，不必重新下载历史
+    """
+
+    def __init__(self, root: str = 'data'):
+        self.root = root
+        self._listeners = []
+
+    def subscribe(self, callback):
+        """注册写入回调 callback(stock_code)"""
+        self._listeners.append(callback)
+
+    def _notify(self, stock_code: str):
+        for callback in self._listeners:
+            callback(stock_code)
+
+    def path(self, stock_code: str) -> str:
+        return os.path.join(self.root, 'adj_factor', f"{stock_code}.npy")
+
+    def version(self, stock_code: str) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path(stock_code))
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self, stock_code: str) -> np.ndarray:
+        file_path = self.path(stock_code)
+        if not os.path.exists(file_path):
+            return np.empty(0, dtype=FACTOR_DTYPE)
+        return np.load(file_path)
+
+    def _save(self, stock_code: str, points: np.ndarray):
+        file_path = self.path(stock_code)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = file_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, points)
+        os.replace(tmp_path, file_path)
+        self._notify(stock_code)
+
+    def write(self, stock_code: str, df: pd.DataFrame):
+        """
+        整段写入
+        :param df: 含 date、factor 两列的逐日因子
+        """
+        if df.empty:
+            return
+        self._save(stock_code, compress_factors(df['date'], df['factor']))
+
+    def append(self, stock_code: str, df: pd.DataFrame) -> bool:
+        """
+        合并新的逐日因子，与已有记录重叠时从新数据的第一天起覆盖
+        :return: 因子是否有变化（有变化才写文件）
+        """
+        if df.empty:
+            return False
+        old = self.load(stock_code)
+        new = compress_factors(df['date'], df['factor'])
+        head = old[old['date'] < new['date'][0]]
+        if len(head) and head['factor'][-1] == new['factor'][0]:
+            new = new[1:]
+        points = np.concatenate([head, new])
+        if len(points) == len(old) and np.array_equal(points, old):
+            return False
+        self._save(stock_code, points)
+        return True
+
+    def latest(self, stock_code: str) -> Optional[float]:
+        points = self.load(stock_code)
+        return float(points['factor'][-1]) if len(points) else None
+
+
+STORES = {
+    'csv': CsvStore,
+    'npy': NpyStore,
+    'bar': BarFileStore,
+}
+
+
+def get_store(backend: str = None, root: str = 'data') -> BarStore:
+    """
+    按名称创建存储后端，未指定时读取环境变量 FP_STORE_BACKEND，默认 bar
+    :param backend: 可选 "csv"、"npy"、"bar"
+    :param root: 数据根目录
+    """
+    backend = backend or os.environ.get('FP_STORE_BACKEND', 'bar')
+    if backend not in STORES:
+        raise ValueError(f"未知的存储后端: {backend}，可选 {list(STORES)}")
+    return STORES[backend](root)
@@ -0,0 +1,108 @@
+"""
+AsyncDataFetcher 对接本地假的腾讯日线接口：分页下载全部历史，以及 /api/kline 并发未命中时只下载、写盘一次
+上游由 httpx.MockTransport 在进程内模拟，AsyncDataFetcher 的 upstreams 把真实域名重定向到它
+"""
+import asyncio
+import os
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+import pytest
+
+from async_fetcher import AsyncDataFetcher
+
+FAKE_HOST = 'fake-tencent.local'
+DATES = pd.bdate_range('2019-01-01', periods=1000).strftime('%Y-%m-%d').tolist()
+
+
+class FakeTencent:
+    """假的日线接口：param=code,type,start,end,length,adjust，返回 [start, end] 内最近 length 根"""
+
+    def __init__(self, dates=DATES):
+        self.dates = dates
+        self.calls = []
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        assert request.url.host == FAKE_HOST  # 已被 upstreams 重定向，没有访问真实域名
+        code, type, start, end, length, adjust = request.url.params['param'].split(',')
+        self.calls.append((code, end))
+        rows = [(i, d) for i, d in enumerate(self.dates) if (not start or d >= start) and (not end or d <= end)]
+        bars = [[d, f'{10 + i / 100:.2f}', f'{10.5 + i / 100:.2f}', f'{11 + i / 100:.2f}', f'{9.5 + i / 100:.2f}',
+                 str(1000 + i)] for i, d in rows[-int(length):]]
+        return httpx.Response(200, json={'data': {code: {adjust + type: bars}}})
+
+
+def make_fetcher(fake: FakeTencent) -> AsyncDataFetcher:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(fake.handler))
+    upstreams = {host: f'http://{FAKE_HOST}' for host in ['proxy.finance.qq.com', 'web.ifzq.gtimg.cn']}
+    return AsyncDataFetcher(client=client, upstreams=upstreams)
+
+
+def test_get_history_paginates():
+    fake = FakeTencent()
+
+    async def run():
+        afetcher = make_fetcher(fake)
+        try:
+            return await afetcher.get_history('sz000001', 'day', adjust='')
+        finally:
+            await afetcher.aclose()
+
+    df = asyncio.run(run())
+    # 第一页 800 根（最新的），第二页从第一页最早的一天往前取，不足 800 根即到头
+    assert fake.calls == [('sz000001', ''), ('sz000001', DATES[200])]
+    assert df['date'].tolist() == DATES
+    assert df['close'].iloc[-1] == pytest.approx(10.5 + 999 / 100)
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """在临时目录下导入 main（数据目录为相对路径），换上假的上游和复权因子"""
+    monkeypatch.chdir(tmp_path)
+    import main
+
+    fake = FakeTencent()
+    factor_calls = []
+
+    def fake_factors(stock_code):
+        factor_calls.append(stock_code)
+        time.sleep(0.05)  # 留出并发请求排队的时间
+        return pd.DataFrame({'date': DATES, 'factor': 1.0})
+
+    monkeypatch.setattr(main, 'afetcher', make_fetcher(fake))
+    monkeypatch.setattr(main, 'ts_get_adj_factor_history', fake_factors)
+    yield main, fake, factor_calls
+    asyncio.run(main.afetcher.aclose())
+
+
+def test_concurrent_kline_misses_download_once(api):
+    main, fake, factor_calls = api
+    shared = main.history_flight.shared
+
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await asyncio.gather(*[client.get('/api/kline', params={'stock_code': 'sz000001', 'type': 'day'})
+                                          for _ in range(5)])
+
+    responses = asyncio.run(run())
+    bodies = [r.json() for r in responses]
+    assert all(r.status_code == 200 for r in responses)
+    assert all('error' not in b for b in bodies), bodies[0]
+    assert all(b == bodies[0] for b in bodies)
+    assert bodies[0]['data']['date'] == DATES
+
+    # 5 个并发未命中只触发一次分页下载和一次因子下载，其余 4 个共用结果
+    assert len(fake.calls) == 2
+    assert len(factor_calls) == 1
+    assert main.history_flight.shared - shared == 4
+
+    # 落盘的是不复权日线和复权因子
+    assert os.path.exists(os.path.join('data', 'day_raw', 'sz000001.bar'))
+    assert os.path.exists(os.path.join('data', 'adj_factor', 'sz000001.npy'))
+    arr = main.store.load('sz000001', 'day_raw')
+    assert len(arr) == len(DATES)
+    np.testing.assert_allclose(arr['close'], [10.5 + i / 100 for i in range(len(DATES))])
+    np.testing.assert_array_equal(arr['volume'], np.arange(len(DATES)) + 1000)
@@ -0,0 +1,60 @@
+"""
+回补进度日志按 (阶段, run_id) 区分：跨过零点仍能续跑，回补与重下两个阶段互不干扰
+"""
+import os
+import time
+
+import pandas as pd
+
+from backfill import Backfiller
+
+
+class FakeFetcher:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+
+    def download_history(self, code):
+        self.calls.append(code)
+        if code in self.fail:
+            raise ConnectionError('上游超时')
+        return pd.DataFrame({'date': ['2024-01-02', '2024-01-03']})
+
+
+def backfiller(fetcher, tmp_path, run_id='2024-01-03', stage='backfill') -> Backfiller:
+    return Backfiller(fetcher, workers=2, retries=0, run_id=run_id, stage=stage, state_dir=str(tmp_path),
+                      report_interval=60)
+
+
+def test_resume_after_midnight(tmp_path):
+    codes = ['sz000001', 'sz000002', 'sz000003']
+    first = FakeFetcher(fail={'sz000003'})
+    assert set(backfiller(first, tmp_path).run(codes)) == {'sz000001', 'sz000002'}
+    state = tmp_path / 'backfill.2024-01-03.log'
+    assert state.exists()  # 有失败，进度保留
+    yesterday = time.time() - 86400
+    os.utime(state, (yesterday, yesterday))  # 进度日志停在前一天（23:50 崩溃，零点后重跑）
+
+    second = FakeFetcher()
+    assert set(backfiller(second, tmp_path).run(codes)) == set(codes)
+    assert second.calls == ['sz000003']
+    assert not state.exists()  # 全部完成后删除
+
+
+def test_stages_do_not_share_progress(tmp_path):
+    failing = FakeFetcher(fail={'sz000002'})
+    backfiller(failing, tmp_path, stage='backfill').run(['sz000001', 'sz000002'])
+
+    redownload = FakeFetcher()
+    backfiller(redownload, tmp_path, stage='redownload').run(['sz000001'])
+    assert redownload.calls == ['sz000001']
+    assert (tmp_path / 'backfill.2024-01-03.log').exists()
+
+
+def test_new_run_discards_stale_progress(tmp_path):
+    backfiller(FakeFetcher(fail={'sz000002'}), tmp_path, run_id='2024-01-02').run(['sz000001', 'sz000002'])
+
+    fetcher = FakeFetcher()
+    backfiller(fetcher, tmp_path, run_id='2024-01-03').run(['sz000001', 'sz000002'])
+    assert sorted(fetcher.calls) == ['sz000001', 'sz000002']
+    assert not (tmp_path / 'backfill.2024-01-02.log').exists()
@@ -0,0 +1,48 @@
+"""
+按区间读取：只复制并复权命中的那一段，结果与读取整段历史后切片一致
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+DATES = pd.bdate_range('2015-01-01', periods=2000).strftime('%Y-%m-%d')
+
+
+@pytest.fixture
+def reader(tmp_path, monkeypatch):
+    """在临时目录下导入 data_reader（数据目录为相对路径），写入一只股票的不复权日线和复权因子"""
+    monkeypatch.chdir(tmp_path)
+    import data_reader
+
+    data_reader.bar_cache.clear()
+    raw = pd.DataFrame({'date': DATES, 'open': 10.0, 'close': np.round(10 + np.arange(2000) / 100, 2),
+                        'high': 40.0, 'low': 9.0, 'volume': 1000})
+    data_reader.store.write('sz000001', 'day_raw', raw, '')
+    factor = np.select([np.arange(2000) < 500, np.arange(2000) < 1500], [1.0, 1.2], 1.5)
+    data_reader.factors.write('sz000001', pd.DataFrame({'date': DATES, 'factor': factor}))
+    yield data_reader
+    data_reader.bar_cache.clear()
+
+
+@pytest.mark.parametrize('adjust', ['qfq', 'hfq', ''])
+@pytest.mark.parametrize('start, end, length', [('', '', 800), ('2016-03-01', '2017-06-30', None),
+                                                ('2016-03-01', '', 10), ('2030-01-01', '', None)])
+def test_window_matches_full_slice(reader, adjust, start, end, length):
+    full = reader._load('sz000001', 'day', adjust)
+    lo, hi = reader.window(full['date'], 'day', start, end, length)
+    arr = reader.read_stock_window('sz000001', 'day', adjust, start, end, length)
+    np.testing.assert_array_equal(arr, full[lo:hi])
+
+
+def test_window_reads_only_the_span(reader):
+    arr = reader.read_stock_window('sz000001', 'day', 'qfq', length=800)
+    assert len(arr) == 800
+    # 只缓存了这一段，没有载入整段历史
+    assert reader.bar_cache.stats()['entries'] == 1
+    assert reader.bar_cache.peek(('sz000001', 'day', 'qfq')) is None
+    assert reader.bar_cache.stats()['bytes'] == arr.nbytes
+    # 再次读取命中区间缓存；写入新K线后版本改变，重新读取
+    assert reader.read_stock_window('sz000001', 'day', 'qfq', length=800) is arr
+    reader.store.append('sz000001', 'day_raw', pd.DataFrame({'date': ['2030-01-02'], 'open': 1.0, 'close': 1.0,
+                                                             'high': 1.0, 'low': 1.0, 'volume': 1}), '')
+    assert reader.read_stock_window('sz000001', 'day', 'qfq', length=800)['date'][-1] == 20300102
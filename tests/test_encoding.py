@@ -0,0 +1,53 @@
+"""
+Arrow 输出：日线与分钟K线的 IPC 流（整表和按股票分批）可以被 pyarrow 读回，日期类型和取值不变
+"""
+import datetime
+
+import numpy as np
+import pytest
+
+from encoding import ARROW_EOS, arrow_bar_columns, arrow_bar_schema, arrow_batch_message, arrow_bytes, \
+    arrow_schema_message
+from store import bar_dtype
+
+pa = pytest.importorskip('pyarrow')
+
+
+def bars(type: str, dates: list) -> np.ndarray:
+    arr = np.zeros(len(dates), dtype=bar_dtype(type))
+    arr['date'] = dates
+    arr['close'] = np.arange(len(dates)) + 10.5
+    arr['volume'] = 1000
+    return arr
+
+
+def read_stream(data: bytes):
+    return pa.ipc.open_stream(data).read_all()
+
+
+@pytest.mark.parametrize('type', ['m1', 'm5', 'm60'])
+def test_minute_bars_round_trip(type):
+    table = read_stream(arrow_bytes(arrow_bar_columns(bars(type, [202401020931, 202401021130, 202401021500]), type)))
+    assert pa.types.is_timestamp(table.schema.field('date').type)
+    assert table['date'].to_pylist() == [datetime.datetime(2024, 1, 2, 9, 31), datetime.datetime(2024, 1, 2, 11, 30),
+                                         datetime.datetime(2024, 1, 2, 15, 0)]
+    assert table['close'].to_pylist() == [10.5, 11.5, 12.5]
+
+
+def test_day_bars_round_trip():
+    table = read_stream(arrow_bytes(arrow_bar_columns(bars('day', [20240102, 20240103]), 'day')))
+    assert table.schema.field('date').type == pa.date32()
+    assert table['date'].to_pylist() == [datetime.date(2024, 1, 2), datetime.date(2024, 1, 3)]
+    assert table['volume'].to_pylist() == [1000, 1000]
+
+
+@pytest.mark.parametrize('type', ['day', 'm5'])
+def test_batch_stream_round_trip(type):
+    schema = arrow_bar_schema(type)
+    dates = [20240102, 20240103] if type == 'day' else [202401020935, 202401020940]
+    data = arrow_schema_message(schema) + arrow_batch_message(schema, 'sz000001', bars(type, dates), type) + \
+        arrow_batch_message(schema, 'sz000002', bars(type, dates[:1]), type) + ARROW_EOS
+    table = read_stream(data)
+    assert table['stock_code'].to_pylist() == ['sz000001', 'sz000001', 'sz000002']
+    assert table['date'].to_pylist()[0] == (datetime.date(2024, 1, 2) if type == 'day' else
+                                            datetime.datetime(2024, 1, 2, 9, 35))
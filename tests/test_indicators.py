@@ -0,0 +1,56 @@
+"""
+指标的批量与流式计算结果一致，包括含 NaN（停牌）的输入；周期参数不合法时给出明确的错误
+"""
+import numpy as np
+import pytest
+
+from indicators import INDICATORS, compute
+
+CASES = [('sma', {'window': 5}), ('ema', {'window': 12}), ('macd', {}), ('rsi', {'window': 6}),
+         ('boll', {'window': 5}), ('atr', {'window': 14}), ('cross', {'fast': 3, 'slow': 7})]
+
+
+def make_bars(n: int = 120, nans=()) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    close = 10 + np.cumsum(rng.normal(0, 0.3, n))
+    bars = np.zeros(n, dtype=[('close', 'f8'), ('high', 'f8'), ('low', 'f8')])
+    bars['close'] = close
+    bars['high'] = close + rng.uniform(0, 0.5, n)
+    bars['low'] = close - rng.uniform(0, 0.5, n)
+    for i in nans:
+        bars[i] = (np.nan, np.nan, np.nan)
+    return bars
+
+
+def streamed(name: str, params: dict, bars: np.ndarray) -> dict:
+    indicator = INDICATORS[name](**params)
+    values = indicator.update_many(bars)
+    outputs = INDICATORS[name].outputs
+    if len(outputs) == 1:
+        return {outputs[0]: np.asarray(values, dtype=float)}
+    return {c: np.asarray([v[i] for v in values], dtype=float) for i, c in enumerate(outputs)}
+
+
+@pytest.mark.parametrize('nans', [(), (0, 1), (30,), (50, 51, 52), (119,)])
+@pytest.mark.parametrize('name, params', CASES)
+def test_batch_matches_stream(name, params, nans):
+    bars = make_bars(nans=nans)
+    batch = compute(name, bars, **params)
+    stream = streamed(name, params, bars)
+    for column, values in batch.items():
+        np.testing.assert_allclose(np.asarray(values, dtype=float), stream[column], rtol=1e-9, atol=1e-9,
+                                   err_msg=f'{name}.{column}')
+
+
+def test_window_with_nan_is_nan_until_it_leaves():
+    bars = make_bars(nans=(30,))
+    values = compute('sma', bars, window=5)['sma']
+    assert np.isnan(values[30:35]).all()
+    assert not np.isnan(values[29]) and not np.isnan(values[35])
+
+
+@pytest.mark.parametrize('name, param', [('sma', 'window'), ('boll', 'window'), ('macd', 'fast'),
+                                         ('macd', 'signal'), ('cross', 'slow')])
+def test_rejects_non_positive_periods(name, param):
+    with pytest.raises(ValueError, match=param):
+        compute(name, make_bars(), **{param: 0})
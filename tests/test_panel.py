@@ -0,0 +1,61 @@
+"""
+截面矩阵扩容和重建：新矩阵写入下一代文件，meta.json 替换后才切换，旧文件随后删除
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from panel import COLUMN_BLOCK, PanelStore
+from store import BarFileStore, FactorStore
+
+DATES = pd.bdate_range('2024-01-01', periods=5).strftime('%Y-%m-%d').tolist()
+
+
+def bars(code: str, dates) -> pd.DataFrame:
+    price = float(int(code[2:]))
+    return pd.DataFrame({'stock_code': code, 'date': dates, 'open': price, 'close': price, 'high': price,
+                         'low': price, 'volume': 100})
+
+
+def make_panel(root: str, codes: list) -> PanelStore:
+    store = BarFileStore(root)
+    for code in codes:
+        store.write(code, 'day_raw', bars(code, DATES).drop(columns='stock_code'), '')
+    panel = PanelStore(root)
+    panel.build(store, FactorStore(root), DATES)
+    return panel
+
+
+def test_resize_switches_files_after_meta(tmp_path):
+    root = str(tmp_path)
+    panel = make_panel(root, ['sz000001', 'sz000002'])
+    reader = PanelStore(root)
+    assert reader.slice('close')[2][:, 0].tolist() == [1.0] * 5
+    old_close = reader.matrix('close')  # 读取方已按旧的 meta 打开
+
+    new_codes = [f'sh{600000 + i}' for i in range(COLUMN_BLOCK)]
+    panel.update(pd.concat([bars(c, DATES[-1:]) for c in new_codes]))
+    meta = panel._load_meta()
+    assert meta['generation'] == 1 and meta['capacity'] == 2 * COLUMN_BLOCK
+    # 旧文件已删除，新文件带代数
+    assert not os.path.exists(os.path.join(root, 'panel', 'close.f8'))
+    assert os.path.exists(os.path.join(root, 'panel', 'close.1.f8'))
+    # 已打开的旧 memmap 仍可读
+    assert np.array(old_close)[:, 1].tolist() == [2.0] * 5
+    # 重新读取 meta 后看到扩容后的矩阵
+    dates, codes, values = reader.slice('close', symbols=['sz000002', 'sh600005'])
+    assert codes == ['sz000002', 'sh600005']
+    assert values[:, 0].tolist() == [2.0] * 5
+    assert np.isnan(values[:-1, 1]).all() and values[-1, 1] == 600005.0
+
+
+def test_rebuild_uses_next_generation(tmp_path):
+    root = str(tmp_path)
+    make_panel(root, ['sz000001'])
+    panel = make_panel(root, ['sz000001', 'sz000003'])
+    assert panel._load_meta()['generation'] == 1
+    assert sorted(os.listdir(os.path.join(root, 'panel'))) == \
+        ['close.1.f8', 'dates.1.i4', 'factor.1.f8', 'high.1.f8', 'low.1.f8', 'meta.json', 'open.1.f8',
+         'volume.1.f8']
+    assert PanelStore(root).slice('close')[2][-1].tolist() == [1.0, 3.0]
@@ -0,0 +1,51 @@
+"""
+SingleFlight：并发的相同请求只执行一次，第一个调用方被取消时其他调用方仍拿到结果
+"""
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_leader_cancel_does_not_cancel_waiters():
+    flight = SingleFlight()
+    runs = []
+
+    async def fetch():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return 'bars'
+
+    async def main():
+        leader = asyncio.ensure_future(flight.do('sz000001', fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(flight.do('sz000001', fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()  # 第一个请求的客户端断开
+        results = await asyncio.gather(*waiters)
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return results
+
+    assert asyncio.run(main()) == ['bars'] * 3
+    assert runs == [1]
+    assert flight.stats() == {"calls": 4, "shared": 3, "in_flight": 0}
+
+
+def test_exception_shared_and_key_released():
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('上游出错')
+
+    async def main():
+        results = await asyncio.gather(*[flight.do('k', fail) for _ in range(3)], return_exceptions=True)
+        # 失败后 key 已释放，下一次调用重新执行
+        return results, await flight.do('k', lambda: asyncio.sleep(0, 'ok'))
+
+    results, again = asyncio.run(main())
+    assert [type(r) for r in results] == [ValueError] * 3
+    assert again == 'ok'
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,33 @@
+"""
+.bar 文件：重叠覆盖后记录变少时不截断文件，按旧表头打开的读取方仍在文件范围内
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from store import BarFileStore
+
+
+def bars(dates) -> pd.DataFrame:
+    return pd.DataFrame({'date': dates, 'open': 10.0, 'close': 10.0, 'high': 10.0, 'low': 10.0, 'volume': 1})
+
+
+def test_overlapping_append_does_not_truncate(tmp_path):
+    store = BarFileStore(str(tmp_path))
+    dates = pd.bdate_range('2024-01-01', periods=10).strftime('%Y-%m-%d')
+    store.write('sz000001', 'day_raw', bars(dates), '')
+    path = store.path('sz000001', 'day_raw')
+    size = os.path.getsize(path)
+    old = store.records('sz000001', 'day_raw')  # 读取方持有旧表头（10 根）
+
+    # 从第 5 根起只重写 2 根，记录数变为 7
+    store.append('sz000001', 'day_raw', bars(dates[5:7]), '', since=dates[5])
+    assert os.path.getsize(path) == size
+    assert len(old) == 10 and np.array(old)['date'][-1] == 20240112
+    arr = store.records('sz000001', 'day_raw')
+    assert len(arr) == 7 and arr['date'][-1] == 20240109
+
+    # 之后的追加从表头的 count 处继续写，覆盖残留的旧记录
+    store.append('sz000001', 'day_raw', bars(['2024-01-10']), '')
+    assert store.records('sz000001', 'day_raw')['date'].tolist()[-2:] == [20240109, 20240110]
@@ -0,0 +1,28 @@
+"""
+按日期区间批量拉取指定股票时，每批 股票数 × 区间天数 不超过单次返回上限，days 不连续时也不例外
+"""
+import numpy as np
+import pandas as pd
+
+import ts
+
+
+class FakeClient:
+    def __init__(self):
+        self.params = []
+
+    def query_many(self, api_name, params):
+        self.params += params
+        return [pd.DataFrame() for _ in params]
+
+
+def test_batches_sized_by_date_range(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(ts, 'ts_client', client)
+    codes = [f'sz{i:06d}' for i in range(3000)]
+    days = ['20240102', '20240103', '20240628']  # 不连续：区间内约 129 个交易日
+    ts._ts_query_days('daily', codes, days)
+    sessions = int(np.busday_count(np.datetime64('2024-01-02'), np.datetime64('2024-06-29')))
+    assert sum(len(p['ts_code'].split(',')) for p in client.params) == len(codes)
+    assert all(len(p['ts_code'].split(',')) * sessions <= ts.TS_MAX_ROWS for p in client.params)
+    assert all((p['start_date'], p['end_date']) == ('20240102', '20240628') for p in client.params)
@@ -0,0 +1,162 @@
+import os
+from bisect import bisect_left, bisect_right
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from store import decode_date, decode_dates, encode_bound
+
+CALENDAR_FILE = 'trading_days.i4'
+# 旧版的 CSV 日历，首次载入时迁移
+LEGACY_CALENDAR_FILE = 'trading_days.csv'
+
+
+def to_int(date) -> int:
+    """'yyyy-MM-dd' / 'yyyyMMdd' / 整数 → yyyyMMdd 整数；带时间的（如 'yyyy-MM-dd HH:mm'）取其日期"""
+    if isinstance(date, (int, np.integer)):
+        return int(date)
+    try:
+        value = encode_bound(str(date), 'day')
+    except ValueError:
+        raise ValueError(f"日期格式错误: {date}，应为 yyyy-MM-dd")
+    if value > 10 ** 10:
+        value //= 10000
+    if not 19000101 <= value <= 29991231:
+        raise ValueError(f"日期格式错误: {date}，应为 yyyy-MM-dd")
+    return value
+
+
+class TradingCalendar:
+    """
+    交易日历：升序的 int32 yyyyMMdd 数组，日期运算都是二分查找 O(log n)
+    落盘为 {root}/trading_days.i4（小端 int32 依次排列，每天 4 字节），新交易日直接追加到文件尾
+    其他进程追加后，refresh() 按文件的修改时间和大小重新载入
+    """
+
+    def __init__(self, root: str = 'data', days=None):
+        """
+        :param root: 数据根目录
+        :param days: 初始交易日，不给时从文件载入
+        """
+        self.root = root
+        self.path = os.path.join(root, CALENDAR_FILE)
+        self.days = np.empty(0, dtype=np.int32)
+        self._list = []
+        self.version = None
+        if days is not None:
+            self._set(np.unique(np.asarray([to_int(d) for d in days], dtype=np.int32)))
+        else:
+            self.refresh()
+
+    def _set(self, days: np.ndarray):
+        self.days = days
+        self._list = days.tolist()  # bisect 在 Python 列表上比在数组上快
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def refresh(self) -> bool:
+        """文件有变化时重新载入，返回是否重新载入；只有旧版 CSV 时迁移为 .i4"""
+        version = self._stat()
+        if version is None:
+            legacy = os.path.join(self.root, LEGACY_CALENDAR_FILE)
+            if not os.path.exists(legacy):
+                return False
+            dates = pd.read_csv(legacy)['trading_days']
+            self._save(np.unique(np.asarray([to_int(d) for d in dates], dtype=np.int32)))
+            version = self._stat()
+        if version == self.version:
+            return False
+        days = np.fromfile(self.path, dtype='<i4')
+        # 其他进程正在追加时可能读到半条记录，fromfile 按整条截断
+        self._set(days.astype(np.int32))
+        self.version = version
+        return True
+
+    def _save(self, days: np.ndarray):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.path + '.tmp'
+        days.astype('<i4').tofile(tmp)
+        os.replace(tmp, self.path)
+        self._set(days)
+        self.version = self._stat()
+
+    def extend(self, dates) -> int:
+        """
+        加入新交易日并落盘：都晚于最后一天时只追加到文件尾，否则合并后整体重写
+        :return: 新增的天数
+        """
+        new = np.setdiff1d(np.asarray([to_int(d) for d in dates], dtype=np.int32), self.days)
+        if not len(new):
+            return 0
+        if not len(self.days) or new[0] > self.days[-1]:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.path, 'ab') as f:
+                new.astype('<i4').tofile(f)
+            self._set(np.concatenate([self.days, new]))
+            self.version = self._stat()
+        else:
+            self._save(np.union1d(self.days, new).astype(np.int32))
+        return len(new)
+
+    # ---------- 查询 ----------
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def __bool__(self) -> bool:
+        return len(self.days) > 0
+
+    @property
+    def first(self) -> Optional[str]:
+        return decode_date(self._list[0], 'day') if self._list else None
+
+    @property
+    def last(self) -> Optional[str]:
+        return decode_date(self._list[-1], 'day') if self._list else None
+
+    def is_trading_day(self, date) -> bool:
+        value = to_int(date)
+        i = bisect_left(self._list, value)
+        return i < len(self._list) and self._list[i] == value
+
+    def index(self, date) -> int:
+        """date 当天（非交易日则为之前最近一个交易日）在日历中的位置，早于日历时为 -1"""
+        return bisect_right(self._list, to_int(date)) - 1
+
+    def prev(self, date) -> Optional[str]:
+        """严格早于 date 的最近一个交易日"""
+        i = bisect_left(self._list, to_int(date)) - 1
+        return decode_date(self._list[i], 'day') if i >= 0 else None
+
+    def next(self, date) -> Optional[str]:
+        """严格晚于 date 的最近一个交易日"""
+        i = bisect_right(self._list, to_int(date))
+        return decode_date(self._list[i], 'day') if i < len(self._list) else None
+
+    def offset(self, date, n: int) -> Optional[str]:
+        """
+        从 date 起数 n 个交易日，n 可为负；date 不是交易日时从它之前最近的交易日数起
+        超出日历范围时返回 None
+        """
+        i = self.index(date) + n  # 早于日历时 index 为 -1，第一个交易日算作第 1 个
+        return decode_date(self._list[i], 'day') if 0 <= i < len(self._list) else None
+
+    def sessions_between(self, start, end) -> int:
+        """[start, end] 内（含两端）的交易日数"""
+        return max(0, bisect_right(self._list, to_int(end)) - bisect_left(self._list, to_int(start)))
+
+    def between(self, start='', end='') -> np.ndarray:
+        """[start, end] 内的交易日（整数数组），留空表示不限"""
+        lo = bisect_left(self._list, to_int(start)) if start else 0
+        hi = bisect_right(self._list, to_int(end)) if end else len(self._list)
+        return self.days[lo:hi]
+
+    def to_list(self, start='', end='') -> list:
+        """[start, end] 内的交易日，'yyyy-MM-dd' 字符串列表"""
+        return decode_dates(self.between(start, end), 'day').tolist()
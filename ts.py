@@ -1,10 +1,22 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import tushare as ts
 import pandas as pd
 from dateutil.utils import today
-import time
+
+from ratelimit import TokenBucket
+
 ts.set_token('4dc12a8feef3e5f980d89212234065f85d00867791ac37d2836cdc7b')
 pro = ts.pro_api()
 
+# 每分钟调用次数上限，按账号积分档位配置
+TS_CALLS_PER_MINUTE = float(os.environ.get('FP_TUSHARE_RATE', 200))
+# pro.daily 单次调用最多返回的行数
+TS_MAX_ROWS = 6000
+
 
 # 转换函数
 def ts_code_to_code(_ts_code):
@@ -23,53 +35,178 @@ def ts_date_to_date(ts_date):
     return ts_date[:4] + '-' + ts_date[4:6] + '-' + ts_date[6:]
 
 
-def ts_get_daily_data(code=None, trade_days=None):
-    use_cols = ['stock_code', 'date', 'open', 'high', 'low', 'close', 'volume']
-    ts_code = ''
-    if code:
-        for c in code:
-            ts_code += code_to_ts_code(c) + ','
+def is_rate_limited(e: Exception) -> bool:
+    """tushare 的频率限制错误，如 “抱歉，您每分钟最多访问该接口200次”"""
+    return '最多访问' in str(e) or '频率' in str(e)
+
+
+class TushareClient:
+    """
+    tushare 调用层
+    所有调用共用一个令牌桶限速；撞到频率限制时速率减半并退避重试，之后每次成功逐步恢复到配置上限
+    """
+
+    def __init__(self, api=None, calls_per_minute: float = TS_CALLS_PER_MINUTE, workers: int = 4,
+                 retries: int = 5):
+        """
+        :param api: tushare pro_api 实例，默认使用模块级的 pro
+        :param calls_per_minute: 每分钟调用次数上限
+        :param workers: query_many 的并发数，网络等待可以重叠，总速率仍受令牌桶限制
+        :param retries: 撞到频率限制后的最大重试次数
+        """
+        self.api = api or pro
+        self.max_rate = calls_per_minute / 60
+        self.limiter = TokenBucket(self.max_rate)
+        self.workers = workers
+        self.retries = retries
+
+    def query(self, api_name: str, **kwargs) -> pd.DataFrame:
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                df = self.api.query(api_name, **kwargs)
+            except Exception as e:
+                if attempt == self.retries or not is_rate_limited(e):
+                    raise
+                rate = max(self.limiter.rate / 2, self.max_rate / 16)
+                self.limiter.set_rate(rate)
+                wait = min(60, 2 ** attempt)
+                print(f'tushare 触发限频，降速到 {rate * 60:.0f} 次/分钟，{wait}s 后重试: {e}')
+                time.sleep(wait)
+                continue
+            if self.limiter.rate < self.max_rate:
+                self.limiter.set_rate(min(self.max_rate, self.limiter.rate * 1.1))
+            return df
+
+    def query_many(self, api_name: str, params: list) -> list:
+        """并发执行多次调用，按 params 的顺序返回结果"""
+        if len(params) <= 1:
+            return [self.query(api_name, **p) for p in params]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(lambda p: self.query(api_name, **p), params))
+
+
+ts_client = TushareClient()
+
+
+def _ts_trade_days(trade_days) -> list:
     if trade_days is None:
-        _df = pro.daily(ts_code=ts_code, trade_date=today().strftime("%Y%m%d"))
-    elif isinstance(trade_days, str):
-        _df = pro.daily(ts_code=ts_code, trade_date=trade_days)
-    elif isinstance(trade_days, list):
-        _df = pd.DataFrame()
-        for day in trade_days:
-            _df = pd.concat([_df, pro.daily(trade_date=day.replace('-', ''))])
-            time.sleep(0.8)
+        return [today().strftime("%Y%m%d")]
+    if isinstance(trade_days, str):
+        return [date_to_ts_date(trade_days)]
+    if isinstance(trade_days, list):
+        return [date_to_ts_date(d) for d in trade_days]
+    raise ValueError("trade_days 必须是 None, str 或 list 类型")
+
+
+def _sessions_upper_bound(days: list) -> int:
+    """
+    区间 [min(days), max(days)] 内交易日数的上界（工作日数）
+    区间查询返回整个区间的数据，days 不连续时按 len(days) 分批会超出单次返回上限、被静默截断
+    """
+    lo, hi = (np.datetime64(f'{d[:4]}-{d[4:6]}-{d[6:]}') for d in (min(days), max(days)))
+    return max(len(days), int(np.busday_count(lo, hi + 1)))
+
+
+def _ts_query_days(api_name: str, code, days: list) -> pd.DataFrame:
+    """
+    按交易日拉取全市场或指定股票的数据，结果按 (trade_date, ts_code) 升序
+    指定股票时按日期区间批量拉取，每批 股票数 × 区间天数 不超过单次返回上限；
+    全市场单日 5000 多行，已接近单次上限，只能逐日拉取，各日之间并发
+    """
+    if code:
+        ts_codes = [code_to_ts_code(c) for c in code]
+        step = max(1, TS_MAX_ROWS // _sessions_upper_bound(days))
+        params = [{'ts_code': ','.join(ts_codes[i:i + step]), 'start_date': min(days), 'end_date': max(days)}
+                  for i in range(0, len(ts_codes), step)]
     else:
-        raise ValueError("trade_days 必须是 None, str 或 list 类型")
-    if _df.empty:
-        return _df
-    _df['stock_code'] = _df['ts_code'].apply(ts_code_to_code)
+        params = [{'trade_date': d} for d in days]
+    chunks = [c for c in ts_client.query_many(api_name, params) if not c.empty]
+    if not chunks:
+        return pd.DataFrame()
+    _df = pd.concat(chunks, ignore_index=True)
+    _df = _df[_df['trade_date'].isin(days)]
+    # 区间查询按日期倒序返回，统一成按日期升序，与逐日拉取的顺序一致
+    _df = _df.sort_values(['trade_date', 'ts_code'], kind='stable')
+    parts = _df['ts_code'].str.split('.', expand=True)
+    _df['stock_code'] = parts[1].str.lower() + parts[0]
     _df['date'] = (
             _df['trade_date'].str[:4] + '-' +
             _df['trade_date'].str[4:6] + '-' +
             _df['trade_date'].str[6:]
     )
+    return _df
+
+
+def _ts_history(api_name: str, ts_code) -> pd.DataFrame:
+    """单只股票全部历史，每次最多返回 TS_MAX_ROWS 行，按日期往前翻页，最后一次性拼接"""
+    if ts_code is None:
+        return pd.DataFrame()
+    chunks = []
+    end_date = None
+    while True:
+        if end_date:
+            new_df = ts_client.query(api_name, ts_code=ts_code, end_date=end_date)
+        else:
+            new_df = ts_client.query(api_name, ts_code=ts_code)
+        if new_df.empty:
+            break
+        chunks.append(new_df)
+        end_date = (pd.to_datetime(new_df.trade_date.iloc[-1]) - pd.Timedelta(days=1)).strftime("%Y%m%d")
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks).reset_index()
+
+
+def ts_get_daily_data(code=None, trade_days=None):
+    """
+    获取不复权日线
+    :param code: 股票代码列表，留空表示全市场
+    :param trade_days: 交易日，None 为今天，可以是单个日期或日期列表（yyyy-MM-dd 或 yyyyMMdd）
+    """
+    use_cols = ['stock_code', 'date', 'open', 'high', 'low', 'close', 'volume']
+    days = _ts_trade_days(trade_days)
+    if not days:
+        return pd.DataFrame()
+    _df = _ts_query_days('daily', code, days)
+    if _df.empty:
+        return _df
     _df['volume'] = _df['vol']
     _df["volume"] = _df["volume"].round().astype(int)
     return _df.reset_index()[use_cols]
 
 
+def ts_get_adj_factor(code=None, trade_days=None):
+    """
+    获取复权因子，参数同 ts_get_daily_data
+    :return: stock_code、date、factor 三列
+    """
+    days = _ts_trade_days(trade_days)
+    if not days:
+        return pd.DataFrame()
+    _df = _ts_query_days('adj_factor', code, days)
+    if _df.empty:
+        return _df
+    _df['factor'] = _df['adj_factor']
+    return _df.reset_index()[['stock_code', 'date', 'factor']]
+
+
 def ts_get_history(ts_code):
     # 获取股票历史数据
-    if ts_code is None:
-        return pd.DataFrame()
-    else:
-        end_date = None
-        _df = None
-        while True:
-            new_df = pd.DataFrame()
-            if end_date:
-                new_df = pro.daily(ts_code=ts_code, end_date=end_date)
-            else:
-                new_df = pro.daily(ts_code=ts_code)
-            if new_df.empty:
-                return _df.reset_index()
-            _df = pd.concat([_df, new_df])
-            end_date = (pd.to_datetime(_df.trade_date.iloc[-1]) - pd.Timedelta(days=1)).strftime("%Y%m%d")
+    return _ts_history('daily', ts_code)
+
+
+def ts_get_adj_factor_history(stock_code):
+    """
+    单只股票全部历史复权因子，指数等没有因子的返回空表
+    :return: date、factor 两列，按日期升序
+    """
+    _df = _ts_history('adj_factor', code_to_ts_code(stock_code))
+    if _df.empty:
+        return pd.DataFrame(columns=['date', 'factor'])
+    _df = _df.sort_values('trade_date')
+    return pd.DataFrame({'date': _df['trade_date'].map(ts_date_to_date).to_numpy(),
+                         'factor': _df['adj_factor'].to_numpy()})
 
 
 if __name__ == "__main__":